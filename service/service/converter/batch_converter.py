@@ -0,0 +1,283 @@
+"""
+多画板并行转换。
+
+SketchConverter.convert 只处理页面中的第一个画板，这里会找出所有页面中的全部画板，
+分发到进程池中并行转换，再合并为一个文档。设计令牌和主元件映射在每个工作进程
+启动时通过 initializer 传入一次，之后的任务只传输画板本身。工作进程中记录的指标随每个画板的结果
+交回当前进程合并，与串行转换一样计入 metrics.REGISTRY。
+"""
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+try:
+    from . import metrics
+    from .diagnostics import Diagnostics, logger
+    from .document_index import DocumentIndex
+    from .dsl_to_html import iter_html_pages
+    from .dsl_writer import write_dsl
+    from .hybrid_converter_v1 import SketchConverter, INPUT_FILE
+    from .sketch_archive import SketchArchive, is_sketch_archive
+    from .token_report import TokenReportCollector
+except ImportError:
+    import metrics
+    from diagnostics import Diagnostics, logger
+    from document_index import DocumentIndex
+    from dsl_to_html import iter_html_pages
+    from dsl_writer import write_dsl
+    from hybrid_converter_v1 import SketchConverter, INPUT_FILE
+    from sketch_archive import SketchArchive, is_sketch_archive
+    from token_report import TokenReportCollector
+
+DOCUMENT_OUTPUT_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "media", "sketches", "dsl_document.json"
+)
+DOCUMENT_HTML_OUTPUT_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "media", "sketches", "dsl_document.html"
+)
+# 输入为 .sketch 文件时只转换这些页面（页面 ID 或名称），None 表示全部页面
+INPUT_PAGES = None
+# 作为转换起点的图层类型，与 SketchConverter._find_target_layer 一致
+TARGET_LAYER_CLASSES = ("artboard", "group")
+
+# 工作进程内复用的转换器，由 _init_worker 创建，只在进程池的子进程中使用
+_worker_converter = None
+# 是否在进程池的子进程中：子进程的指标需随结果交回父进程
+_worker_drains_metrics = False
+
+
+def iter_pages(sketch_data):
+    """返回文档中的所有页面；根节点本身是页面或单个画板时返回 [根节点]。"""
+    if sketch_data.get("_class") == "page":
+        return [sketch_data]
+    pages = sketch_data.get("pages") or [
+        layer for layer in sketch_data.get("layers", []) if layer.get("_class") == "page"
+    ]
+    return pages or [sketch_data]
+
+
+def iter_artboards(sketch_data):
+    """
+    依次产出 (页面 ID, 页面名称, 画板) 三元组，跳过隐藏的画板。
+
+    Sketch 允许多个页面同名，合并结果时按页面 ID（do_objectID）区分页面。
+    """
+    for page in iter_pages(sketch_data):
+        if page.get("_class") in TARGET_LAYER_CLASSES:
+            yield page.get("do_objectID"), page.get("name"), page
+            continue
+        for layer in page.get("layers", []):
+            if layer.get("_class") in TARGET_LAYER_CLASSES and layer.get("isVisible", True):
+                yield page.get("do_objectID"), page.get("name"), layer
+
+
+def _init_worker(tokens, index, drain_metrics=False):
+    """工作进程初始化：只接收一次共享的令牌和主元件索引，主元件的编译结果在该进程的所有画板间复用。"""
+    global _worker_converter, _worker_drains_metrics
+    _worker_converter = SketchConverter({}, tokens=tokens, index=index)
+    _worker_drains_metrics = drain_metrics
+
+
+def _convert_artboard(task):
+    """进程池任务：用本进程的转换器转换单个画板，结果中附带新增的指标。"""
+    return _convert_with(_worker_converter, task, drain_metrics=_worker_drains_metrics)
+
+
+def _convert_with(converter, task, drain_metrics=False):
+    """用给定的转换器转换单个画板，返回 DSL、未知令牌报告、诊断汇总和耗时。"""
+    page_id, page_name, artboard = task
+    start = time.perf_counter()
+    dsl = converter.convert_layer(artboard, reset=True)
+    elapsed = time.perf_counter() - start
+    result = {
+        "page_id": page_id,
+        "page": page_name,
+        "name": artboard.get("name"),
+        "id": artboard.get("do_objectID"),
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "dsl": dsl,
+        "report": converter.report.to_dict(),
+        "diagnostics": converter.diagnostics.summary(),
+    }
+    if drain_metrics:
+        result["metrics"] = metrics.REGISTRY.drain()
+    return result
+
+
+def _plan(sketch_data, max_workers, index):
+    """创建主转换器（加载令牌、建立索引）并确定待转换的画板和进程数。"""
+    base = SketchConverter(sketch_data, index=index)
+    tasks = list(iter_artboards(sketch_data))
+    max_workers = max_workers or os.cpu_count() or 1
+    return base, tasks, min(max_workers, len(tasks))
+
+
+def iter_artboard_results(base, tasks, workers):
+    """按文档顺序逐个产出画板的转换结果，多进程时每个结果一返回即产出。"""
+    if workers <= 1:
+        # 串行时使用本次文档专用的转换器，不写入工作进程的全局变量，交错或并发的多个流互不影响
+        converter = SketchConverter({}, tokens=base.tokens, index=base.index.without_objects())
+        for task in tasks:
+            yield _convert_with(converter, task)
+        return
+    logger.info("共 %d 个画板，使用 %d 个进程并行转换。", len(tasks), workers)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(base.tokens, base.index.without_objects(), True),
+    ) as executor:
+        for result in executor.map(_convert_artboard, tasks):
+            metrics.REGISTRY.merge(result.pop("metrics"))
+            yield result
+
+
+def _group_pages(results):
+    """
+    把按文档顺序产出的画板结果按页面分组，产出 {"id", "name", "artboards"}，artboards 为迭代器。
+
+    iter_artboards 逐页产出画板，同一页面的画板总是相邻的，按页面 ID 分组即可；
+    同名的不同页面不会被合并。
+    """
+    for page_id, page_results in itertools.groupby(results, key=itemgetter("page_id")):
+        first = next(page_results)
+        yield {"id": page_id, "name": first["page"], "artboards": itertools.chain((first,), page_results)}
+
+
+def convert_document(sketch_data, max_workers=None, index=None):
+    """
+    转换文档中所有页面的所有画板，并合并为一个 DSL 文档。
+
+    参数:
+        sketch_data (dict): Sketch JSON 数据（文档、页面或单个画板）。
+        max_workers (int, optional): 进程数，默认为 CPU 核数；为 1 或只有一个画板时在当前进程内串行转换。
+        index (DocumentIndex, optional): 读取文件时建立的文档索引，未传入时遍历一次文档建立。
+
+    返回:
+        dict: {"type": "Document", "pages": [{"id", "name", "artboards": [...]}, ...], "report": {...},
+               "token_stats": {...}, "diagnostics": {...}, "timings": {...}}
+    """
+    start = time.perf_counter()
+    base, tasks, workers = _plan(sketch_data, max_workers, index)
+    results = list(iter_artboard_results(base, tasks, workers))
+
+    report = TokenReportCollector()
+    diagnostics = Diagnostics()
+    diagnostics.merge(base.diagnostics.summary())
+    for result in results:
+        report.merge(result.pop("report"))
+        diagnostics.merge(result.pop("diagnostics"))
+    pages = [{**page, "artboards": list(page["artboards"])} for page in _group_pages(results)]
+
+    return {
+        "type": "Document",
+        "pages": pages,
+        "report": report.summary(),
+        "token_stats": report.stats(),
+        "diagnostics": diagnostics.summary(),
+        "timings": {
+            "workers": max(workers, 1),
+            "artboards": len(results),
+            "total_ms": round((time.perf_counter() - start) * 1000, 3),
+            "convert_ms": round(sum(r["elapsed_ms"] for r in results), 3),
+        },
+    }
+
+
+def stream_document(sketch_data, max_workers=None, index=None, on_result=None):
+    """
+    以流式结构返回与 convert_document 相同格式的文档，交给 dsl_writer.write_dsl 写出。
+
+    pages 及其中的 artboards 是迭代器，写出时才逐个转换画板，每个画板转换完成即编码写入；
+    report / token_stats / diagnostics / timings 是在全部画板写出后才求值的可调用对象。
+    页面按页面 ID 分组（见 _group_pages），与 convert_document 一致。
+
+    参数:
+        on_result (callable, optional): 每个画板的结果写出前调用 on_result(result)，
+            需要在写出后继续使用 DSL（如生成 HTML 预览）时用它保存结果。
+    """
+    start = time.perf_counter()
+    base, tasks, workers = _plan(sketch_data, max_workers, index)
+    report = TokenReportCollector()
+    diagnostics = Diagnostics()
+    diagnostics.merge(base.diagnostics.summary())
+    elapsed = []
+
+    def artboards():
+        for result in iter_artboard_results(base, tasks, workers):
+            report.merge(result.pop("report"))
+            diagnostics.merge(result.pop("diagnostics"))
+            elapsed.append(result["elapsed_ms"])
+            if on_result is not None:
+                on_result(result)
+            yield result
+
+    def timings():
+        return {
+            "workers": max(workers, 1),
+            "artboards": len(elapsed),
+            "total_ms": round((time.perf_counter() - start) * 1000, 3),
+            "convert_ms": round(sum(elapsed), 3),
+        }
+
+    return {
+        "type": "Document",
+        "pages": _group_pages(artboards()),
+        "report": report.summary,
+        "token_stats": report.stats,
+        "diagnostics": diagnostics.summary,
+        "timings": timings,
+    }
+
+
+def main():
+    """主函数：转换输入文件中的全部画板并写入文档文件。"""
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    index = DocumentIndex()
+    try:
+        if is_sketch_archive(INPUT_FILE):
+            # .sketch 文件只解析需要转换的页面
+            with SketchArchive(INPUT_FILE) as archive:
+                sketch_data = archive.load_document(INPUT_PAGES, index)
+        else:
+            with open(INPUT_FILE, "r", encoding="utf-8") as f:
+                sketch_data = json.load(f, object_hook=index.add)
+    except FileNotFoundError:
+        logger.error("输入文件未找到: %s", INPUT_FILE)
+        return
+    except json.JSONDecodeError:
+        logger.error("输入文件不是有效的 JSON 格式。")
+        return
+    except KeyError as e:
+        logger.error(".sketch 文件不完整或页面不存在: %s", e)
+        return
+
+    # 画板边转换边写入文档文件，DSL 留在内存中供之后生成 HTML 预览
+    roots = []
+    document = stream_document(
+        sketch_data, index=index,
+        on_result=lambda result: result["dsl"] and roots.append(result["dsl"]),
+    )
+    try:
+        write_dsl(DOCUMENT_OUTPUT_FILE, document)
+        logger.info("转换完成: %s", document["timings"]())
+        logger.info("成功！DSL 文档已生成于 %s", DOCUMENT_OUTPUT_FILE)
+    except IOError as e:
+        logger.error("无法写入 DSL 文档: %s", e)
+        return
+
+    # 所有画板渲染到同一个预览页面，共用一张样式驻留表
+    try:
+        with open(DOCUMENT_HTML_OUTPUT_FILE, "w", encoding="utf-8") as f:
+            for chunk in iter_html_pages(roots, intern_styles=True):
+                f.write(chunk)
+        logger.info("成功！HTML 预览已生成于 %s", DOCUMENT_HTML_OUTPUT_FILE)
+    except IOError as e:
+        logger.error("无法写入 HTML 预览: %s", e)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+转换流程的分阶段基准测试。
+
+用 synthetic_sketch 生成不同规模的合成文档，分别计时：
+    - filter：sketch_parser.filter_sketch_data；
+    - convert：SketchConverter.convert（不使用结果缓存和增量转换，DSL 以 compact 格式写入临时目录）；
+    - tailwind：tailwind_converter.traverse_layer；
+    - html：dsl_to_html.dsl_node_to_html（输入为 convert 阶段的 DSL）。
+
+每个阶段重复 BENCHMARK_REPEAT 次，取最短耗时计算吞吐量（节点/秒），结果写入 BENCHMARK_OUTPUT_FILE。
+BENCHMARK_BASELINE_FILE 存在时（例如另一个提交上的结果），同时打印各阶段相对它的吞吐量变化。
+"""
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+try:
+    from . import hybrid_converter_v1
+    from .document_index import DocumentIndex
+    from .dsl_to_html import dsl_node_to_html
+    from .sketch_parser import filter_sketch_data
+    from .synthetic_sketch import SyntheticSketchGenerator
+    from .tailwind_converter import traverse_layer
+    from .traversal import walk
+except ImportError:
+    import hybrid_converter_v1
+    from document_index import DocumentIndex
+    from dsl_to_html import dsl_node_to_html
+    from sketch_parser import filter_sketch_data
+    from synthetic_sketch import SyntheticSketchGenerator
+    from tailwind_converter import traverse_layer
+    from traversal import walk
+
+# --- 配置项 ---
+BENCHMARK_OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "..", "media", "benchmarks", "benchmark.json")
+# 对比基准的结果文件，不存在时跳过对比
+BENCHMARK_BASELINE_FILE = os.path.join(os.path.dirname(__file__), "..", "media", "benchmarks", "baseline.json")
+# 文档规模：名称 → 生成参数（见 SyntheticSketchGenerator）
+BENCHMARK_SIZES = {
+    "small": {"depth": 3, "fan_out": 4},
+    "medium": {"depth": 4, "fan_out": 5},
+    "large": {"depth": 5, "fan_out": 6},
+}
+BENCHMARK_STAGES = ("filter", "convert", "tailwind", "html")
+BENCHMARK_REPEAT = 5
+BENCHMARK_SEED = 0
+# 转换阶段打印大量进度信息，计时期间丢弃
+SUPPRESS_STAGE_OUTPUT = True
+
+
+def _count_nodes(node, children_key):
+    """统计树中的节点数。"""
+    counter = [0]
+
+    def enter(item, _):
+        counter[0] += 1
+        return None, item.get(children_key) or ()
+
+    walk(node, enter)
+    return counter[0]
+
+
+def _quiet():
+    return contextlib.redirect_stdout(io.StringIO()) if SUPPRESS_STAGE_OUTPUT else contextlib.nullcontext()
+
+
+def _time_stage(prepare, run, repeat):
+    """
+    计时 repeat 次 run(prepare())，prepare 的耗时不计入；计时期间关闭垃圾回收（与 timeit 相同）。
+
+    返回:
+        tuple: (每次耗时列表, 最后一次的返回值)
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        argument = prepare()
+        gc.collect()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with _quiet():
+                start = time.perf_counter()
+                result = run(argument)
+                timings.append(time.perf_counter() - start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    return timings, result
+
+
+class _ConvertStage:
+    """convert 阶段：每次在新生成的文档上转换（遍历会原地排序子图层），DSL 写入临时目录。"""
+
+    def __init__(self, generator, workdir):
+        self.generator = generator
+        self.dsl_file = os.path.join(workdir, "dsl.json")
+        self.report_file = os.path.join(workdir, "token_report.json")
+
+    def prepare(self):
+        page = self.generator.page()
+        return page, DocumentIndex.build(page)
+
+    def run(self, argument):
+        page, index = argument
+        converter = hybrid_converter_v1.SketchConverter(page, index=index)
+        return converter.convert(self.dsl_file, self.report_file, output_format="compact")
+
+
+def run_benchmarks(sizes=None, stages=None, repeat=None, seed=None):
+    """
+    运行基准测试。
+
+    参数:
+        sizes (dict, optional): 文档规模，默认为 BENCHMARK_SIZES。
+        stages (iterable, optional): 要计时的阶段，默认为 BENCHMARK_STAGES。
+        repeat (int, optional): 每个阶段的重复次数，默认为 BENCHMARK_REPEAT。
+        seed (int, optional): 生成文档的随机种子，默认为 BENCHMARK_SEED。
+
+    返回:
+        dict: 可直接写成 JSON 的结果，results 中每一项为一个 (规模, 阶段) 的计时。
+    """
+    sizes = sizes or BENCHMARK_SIZES
+    stages = tuple(stages or BENCHMARK_STAGES)
+    repeat = repeat or BENCHMARK_REPEAT
+    seed = BENCHMARK_SEED if seed is None else seed
+    results = []
+
+    # 基准测试不应发出 LLM 请求，结果也不能受网络影响
+    llm_enabled = hybrid_converter_v1.ENABLE_LLM_FALLBACK
+    hybrid_converter_v1.ENABLE_LLM_FALLBACK = False
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size_name, options in sizes.items():
+                generator = SyntheticSketchGenerator(seed=seed, **options)
+                layers = generator.layer_count()
+                print(f"[INFO] 规模 {size_name}: {options}，{layers} 个图层")
+
+                def record(stage, nodes, timings):
+                    best = min(timings)
+                    entry = {
+                        "size": size_name,
+                        "stage": stage,
+                        "nodes": nodes,
+                        "repeat": len(timings),
+                        "best_seconds": best,
+                        "median_seconds": statistics.median(timings),
+                        "nodes_per_sec": nodes / best if best > 0 else None,
+                    }
+                    results.append(entry)
+                    print(f"  {stage:<9} {nodes:>8} 节点  最短 {best * 1000:9.2f} ms  "
+                          f"{entry['nodes_per_sec'] or 0:12.0f} 节点/秒")
+
+                if "filter" in stages:
+                    page = generator.page()
+                    timings, _ = _time_stage(lambda: page, filter_sketch_data, repeat)
+                    # 过滤的是整个页面，包括页面末尾的主元件
+                    record("filter", generator.page_layer_count(), timings)
+
+                dsl = None
+                if "convert" in stages or "html" in stages:
+                    stage = _ConvertStage(generator, workdir)
+                    timings, dsl = _time_stage(stage.prepare, stage.run, repeat)
+                    if "convert" in stages:
+                        record("convert", layers, timings)
+
+                if "tailwind" in stages:
+                    # traverse_layer 只展开 group 的子图层，画板按编组处理
+                    root = dict(generator.page()["layers"][0], _class="group")
+                    timings, _ = _time_stage(lambda: root, traverse_layer, repeat)
+                    record("tailwind", layers, timings)
+
+                if "html" in stages and dsl is not None:
+                    timings, _ = _time_stage(lambda: dsl, dsl_node_to_html, repeat)
+                    record("html", _count_nodes(dsl, "children"), timings)
+    finally:
+        hybrid_converter_v1.ENABLE_LLM_FALLBACK = llm_enabled
+
+    return {
+        "created_time": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": seed,
+        "sizes": sizes,
+        "results": results,
+    }
+
+
+def _git_commit():
+    """当前代码所在的提交，不在 git 仓库中时返回 None。"""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def compare_results(baseline, current):
+    """
+    按 (规模, 阶段) 对比两次结果的吞吐量。
+
+    返回:
+        list: [{"size", "stage", "baseline", "current", "ratio"}, ...]，ratio 大于 1 表示变快。
+    """
+    previous = {(entry["size"], entry["stage"]): entry for entry in baseline.get("results", [])}
+    rows = []
+    for entry in current.get("results", []):
+        old = previous.get((entry["size"], entry["stage"]))
+        if old is None or not old.get("nodes_per_sec") or not entry.get("nodes_per_sec"):
+            continue
+        rows.append({
+            "size": entry["size"],
+            "stage": entry["stage"],
+            "baseline": old["nodes_per_sec"],
+            "current": entry["nodes_per_sec"],
+            "ratio": entry["nodes_per_sec"] / old["nodes_per_sec"],
+        })
+    return rows
+
+
+def main():
+    """主函数：运行全部基准测试，写出结果，存在基准文件时打印对比。"""
+    print("--- Converter Benchmark ---")
+    # 先读取基准文件，输出文件与它相同时也能正确对比
+    baseline = None
+    if BENCHMARK_BASELINE_FILE and os.path.exists(BENCHMARK_BASELINE_FILE):
+        try:
+            with open(BENCHMARK_BASELINE_FILE, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"[WARNING] 无法读取基准文件: {e}")
+
+    report = run_benchmarks()
+    os.makedirs(os.path.dirname(BENCHMARK_OUTPUT_FILE), exist_ok=True)
+    try:
+        with open(BENCHMARK_OUTPUT_FILE, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"[INFO] 基准结果已写入 {BENCHMARK_OUTPUT_FILE}")
+    except IOError as e:
+        print(f"[ERROR] 无法写入基准结果: {e}")
+
+    if baseline is not None:
+        print(f"--- 对比 {BENCHMARK_BASELINE_FILE}（提交 {baseline.get('commit')}）---")
+        for row in compare_results(baseline, report):
+            print(f"  {row['size']:<8} {row['stage']:<9} {row['baseline']:12.0f} → {row['current']:12.0f} 节点/秒  "
+                  f"x{row['ratio']:.2f}")
+
+if __name__ == "__main__":
+    main()
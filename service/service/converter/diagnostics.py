@@ -0,0 +1,128 @@
+"""
+转换过程的诊断信息：基于 logging，重复事件聚合为计数和少量示例。
+
+转换中有些事件会逐个图层发生（例如规则分析无法确定布局），大型文档中可达数万次；
+在 gunicorn 等环境下每次都同步写 stdout 代价很高。这里每个事件代码只有前 DIAGNOSTIC_LOG_LIMIT 次
+会写入日志，之后只计数，转换结束时（close）再输出一条汇总；
+同时保留前 DIAGNOSTIC_SAMPLE_SIZE 次的参数作为示例。
+
+消息采用 logging 的 %-格式并在需要时才格式化：日志级别未启用时，热路径上只有一次字典查找和计数。
+每次转换的汇总（summary）附加在令牌报告的 "diagnostics" 字段中。
+"""
+import logging
+
+# 转换器模块使用的日志记录器，级别与输出方式由调用方配置（Django 中见 settings.LOGGING）
+logger = logging.getLogger("converter")
+
+# 每个事件代码写入日志的次数上限，超出的只计数
+DIAGNOSTIC_LOG_LIMIT = 5
+# 每个事件代码保留的示例数
+DIAGNOSTIC_SAMPLE_SIZE = 3
+
+
+class _Event:
+    """单个事件代码的统计，示例保存为未格式化的 (消息, 参数)。"""
+
+    __slots__ = ("level", "count", "samples")
+
+    def __init__(self, level):
+        self.level = level
+        self.count = 0
+        self.samples = []
+
+
+class Diagnostics:
+    """
+    一次转换的诊断事件聚合器。
+
+    示例:
+        diagnostics.event("layout.fallback", "规则分析无法确定布局，回退到 absolute（%d 个子图层）", len(layers))
+    """
+
+    def __init__(self, log_limit=DIAGNOSTIC_LOG_LIMIT, sample_size=DIAGNOSTIC_SAMPLE_SIZE, log=logger):
+        self.log_limit = log_limit
+        self.sample_size = sample_size
+        self.logger = log
+        self._events = {}
+
+    def event(self, code, message, *args, level=logging.INFO):
+        """
+        记录一次事件。
+
+        参数:
+            code (str): 事件代码，相同代码的事件聚合在一起。
+            message (str): logging 风格的 %-格式消息，同一代码应始终使用同一消息。
+            *args: 消息参数，只在写入日志或生成汇总时格式化。
+            level (int): 日志级别。
+        """
+        entry = self._events.get(code)
+        if entry is None:
+            entry = self._events[code] = _Event(level)
+        entry.count += 1
+        if entry.count <= self.sample_size:
+            entry.samples.append((message, args))
+        if entry.count <= self.log_limit and self.logger.isEnabledFor(level):
+            self.logger.log(level, message, *args)
+
+    def debug(self, code, message, *args):
+        self.event(code, message, *args, level=logging.DEBUG)
+
+    def info(self, code, message, *args):
+        self.event(code, message, *args, level=logging.INFO)
+
+    def warning(self, code, message, *args):
+        self.event(code, message, *args, level=logging.WARNING)
+
+    def error(self, code, message, *args):
+        self.event(code, message, *args, level=logging.ERROR)
+
+    def close(self):
+        """输出被限流事件的汇总日志。"""
+        for code, entry in self._events.items():
+            if entry.count > self.log_limit and self.logger.isEnabledFor(entry.level):
+                self.logger.log(entry.level, "[%s] 共出现 %d 次，日志中只输出了前 %d 次", code, entry.count,
+                                self.log_limit)
+
+    def reset(self):
+        self._events = {}
+
+    def __bool__(self):
+        return bool(self._events)
+
+    def count(self, code):
+        entry = self._events.get(code)
+        return entry.count if entry else 0
+
+    def summary(self):
+        """
+        汇总为可写入 JSON 的字典。
+
+        返回:
+            dict: {事件代码: {"level": 级别名称, "count": 次数, "samples": [格式化后的消息, ...]}}
+        """
+        return {
+            code: {
+                "level": logging.getLevelName(entry.level),
+                "count": entry.count,
+                "samples": [_format(message, args) for message, args in entry.samples],
+            }
+            for code, entry in self._events.items()
+        }
+
+    def merge(self, summary):
+        """合并另一次转换（如批量转换的各个画板）的 summary 结果。"""
+        for code, data in summary.items():
+            entry = self._events.get(code)
+            if entry is None:
+                entry = self._events[code] = _Event(logging.getLevelName(data["level"]))
+            entry.count += data["count"]
+            room = self.sample_size - len(entry.samples)
+            if room > 0:
+                entry.samples.extend((sample, ()) for sample in data["samples"][:room])
+
+
+def _format(message, args):
+    try:
+        return message % args if args else message
+    except (TypeError, ValueError):
+        return f"{message} {args!r}"
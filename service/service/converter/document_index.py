@@ -0,0 +1,69 @@
+"""
+Sketch 文档的全局索引。
+
+按 symbolID 索引主元件（包括嵌套在任意层级的主元件、Symbols 页面上的主元件以及外部库引入的主元件），
+按 do_objectID 索引所有对象，按 sharedStyle 的 do_objectID 索引共享样式，均为 O(1) 查找。
+
+索引可以在读取 JSON 时通过 object_hook 同步建立，不需要额外遍历文档：
+    index = DocumentIndex()
+    data = json.load(f, object_hook=index.add)
+"""
+
+
+class DocumentIndex:
+    """symbolID / do_objectID / sharedStyleID 到对象的映射。"""
+
+    def __init__(self):
+        self.symbols = {}
+        self.objects = {}
+        self.shared_styles = {}
+
+    def add(self, obj):
+        """登记一个 JSON 对象并原样返回，可直接作为 json.load 的 object_hook。"""
+        object_id = obj.get("do_objectID")
+        if object_id is not None:
+            self.objects[object_id] = obj
+        object_class = obj.get("_class")
+        if object_class == "symbolMaster":
+            # 同一个 symbolID 出现多次时（如外部库主元件的本地副本）保留先登记的一个
+            self.symbols.setdefault(obj.get("symbolID"), obj)
+        elif object_class == "sharedStyle" and object_id is not None:
+            self.shared_styles[object_id] = obj
+        return obj
+
+    def add_tree(self, data):
+        """登记已加载数据中的全部对象（一次遍历）。"""
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                self.add(item)
+                stack.extend(value for value in item.values() if isinstance(value, (dict, list)))
+            elif isinstance(item, list):
+                stack.extend(value for value in item if isinstance(value, (dict, list)))
+        return data
+
+    @classmethod
+    def build(cls, data):
+        """为已加载的数据建立索引（一次遍历）。"""
+        index = cls()
+        index.add_tree(data)
+        return index
+
+    def without_objects(self):
+        """只含主元件和共享样式的副本，传给其他进程时不必序列化整个文档。"""
+        index = DocumentIndex()
+        index.symbols = self.symbols
+        index.shared_styles = self.shared_styles
+        return index
+
+    def symbol_names(self):
+        """symbolID → 主元件名称，与旧版 symbol_map 的结构一致。"""
+        return {symbol_id: master.get("name") for symbol_id, master in self.symbols.items()}
+
+    def shared_style_for(self, layer):
+        """返回图层引用的共享样式，没有引用或找不到时返回 None。"""
+        shared_style_id = layer.get("sharedStyleID")
+        if shared_style_id is None:
+            return None
+        return self.shared_styles.get(shared_style_id)
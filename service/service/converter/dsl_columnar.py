@@ -0,0 +1,437 @@
+"""
+DSL 的二进制列式存储格式（.dslc）。
+
+读取大型 DSL JSON 时，即使只渲染或查询一个画板也要解析整个文件。列式格式把节点保存为一张扁平的表：
+    - parent / end：父节点下标和子树结束位置（节点按前序排列，子树 i 即下标区间 [i, end[i])）；
+    - type：节点类型的枚举编码（类型名称列表在文件头中）；
+    - name / style / layout / extra：字符串表中的编号，-1 表示没有该字段。
+      style / layout 为去掉尺寸与坐标后的 JSON，相同的样式只保存一份；extra 为其余字段（variant、content 等）的 JSON；
+    - frame：top / left / width / height 四个 float64，flags 记录各值是否存在、是否为整数，保证读回的值与原值一致；
+    - 字符串表：偏移数组加 UTF-8 数据区。
+
+读取时整个文件通过 mmap 映射，各列是映射内存上的 memoryview（安装了 NumPy 时可取得零拷贝的数组视图），
+节点以轻量的 ColumnarNode 视图按需访问，只有被访问到的字符串和样式才会解码。
+ColumnarNode 提供与 DSL 字典相同的读取接口，可以直接交给 dsl_to_html 渲染任意子树。
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+try:
+    from .dsl_node import json_default
+    from .metrics import timed
+except ImportError:
+    from dsl_node import json_default
+    from metrics import timed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNAR_SUFFIX = ".dslc"
+COLUMNAR_MAGIC = b"DSLC"
+COLUMNAR_VERSION = 1
+# 文件头：魔数、版本号、保留字段、头部 JSON 的长度
+_PREAMBLE = struct.Struct("<4sHHI")
+_ALIGNMENT = 8
+
+# flags 各位的含义：前 4 位表示 frame 中对应的值存在，其后 4 位表示该值原本是整数
+FRAME_FIELDS = (("layout", "top"), ("layout", "left"), ("style", "width"), ("style", "height"))
+_FLAG_INT_SHIFT = 4
+_FLAG_CHILDREN = 1 << 8
+_NO_TYPE = 255
+_MISSING = object()
+
+# 按 DSLNode 的字段顺序重建节点字典，其余未知字段排在最后
+_NODE_KEY_ORDER = ("name", "type", "variant", "content", "style", "layout", "children", "ref", "overrides", "symbols")
+
+
+class _StringTable:
+    """写入时的字符串表，相同的字符串只保存一份。"""
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array("Q", [0])
+        self.data = bytearray()
+
+    def add(self, text):
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.ids)
+            self.data += text.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return string_id
+
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=json_default).encode
+
+
+def _as_dict(obj):
+    """节点、样式、布局的可修改副本（紧凑记录或普通字典均可）。"""
+    return dict(obj) if isinstance(obj, dict) else obj.to_dict()
+
+
+@timed("columnar")
+def write_columnar(path, root):
+    """
+    把一棵 DSL 树（紧凑记录或普通字典）写入列式文件。
+
+    参数:
+        path (str or Path): 输出路径，通常以 COLUMNAR_SUFFIX 结尾。
+        root: DSL 根节点。
+    """
+    strings = _StringTable()
+    types = {}
+    parents, ends = array("i"), array("i")
+    type_codes, flags = array("B"), array("H")
+    names, styles, layouts, extras = array("i"), array("i"), array("i"), array("i")
+    frames = array("d")
+
+    stack = [(root, -1)] if root else []
+    while stack:
+        node, parent = stack.pop()
+        index = len(parents)
+        parents.append(parent)
+        ends.append(0)
+
+        fields = _as_dict(node)
+        name = fields.pop("name", _MISSING)
+        if type(name) is str:
+            names.append(strings.add(name))
+        else:
+            names.append(-1)
+            if name is not _MISSING:
+                fields["name"] = name
+        node_type = fields.pop("type", _MISSING)
+        if type(node_type) is str:
+            code = types.setdefault(node_type, len(types))
+            if code >= _NO_TYPE:
+                raise ValueError("节点类型超过 255 种，无法写入列式格式")
+            type_codes.append(code)
+        else:
+            type_codes.append(_NO_TYPE)
+            if node_type is not _MISSING:
+                fields["type"] = node_type
+
+        flag = 0
+        parts = {}
+        for part in ("style", "layout"):
+            value = fields.pop(part, None)
+            if value is None or isinstance(value, str):
+                # 不存在或不是字典的值原样放在 extra 中
+                if part in node:
+                    fields[part] = value
+                parts[part] = None
+            else:
+                parts[part] = _as_dict(value)
+        for bit, (part, key) in enumerate(FRAME_FIELDS):
+            values = parts[part]
+            value = values.get(key) if values is not None else None
+            # bool 是 int 的子类，按类型精确比较以免把 True/False 当作数值
+            if type(value) is int or type(value) is float:
+                del values[key]
+                frames.append(value)
+                flag |= 1 << bit
+                if type(value) is int:
+                    flag |= 1 << (bit + _FLAG_INT_SHIFT)
+            else:
+                frames.append(0.0)
+        styles.append(strings.add(_encode(parts["style"])) if parts["style"] is not None else -1)
+        layouts.append(strings.add(_encode(parts["layout"])) if parts["layout"] is not None else -1)
+        children = fields.pop("children", _MISSING)
+        extras.append(strings.add(_encode(fields)) if fields else -1)
+
+        if children is not _MISSING:
+            flag |= _FLAG_CHILDREN
+            if children:
+                stack.extend((child, index) for child in reversed(children) if child)
+        flags.append(flag)
+
+    # 前序排列下，子树大小自底向上累加即可得到每个子树的结束位置
+    sizes = [1] * len(parents)
+    for index in range(len(parents) - 1, 0, -1):
+        sizes[parents[index]] += sizes[index]
+    for index, size in enumerate(sizes):
+        ends[index] = index + size
+
+    columns = {
+        "parent": parents, "end": ends, "type": type_codes, "flags": flags,
+        "name": names, "style": styles, "layout": layouts, "extra": extras,
+        "frame": frames, "string_offsets": strings.offsets,
+    }
+    header = {
+        "version": COLUMNAR_VERSION,
+        "byteorder": sys.byteorder,
+        "nodes": len(parents),
+        "strings": len(strings.ids),
+        "types": sorted(types, key=types.get),
+        "sections": {},
+    }
+    # 各段的偏移依赖头部长度，而头部又包含偏移：先按占位长度估算，不够时再多留一些空间
+    header_size = 512
+    while True:
+        offset = _align(_PREAMBLE.size + header_size)
+        for key, column in columns.items():
+            header["sections"][key] = [offset, column.typecode, len(column)]
+            offset = _align(offset + len(column) * column.itemsize)
+        header["sections"]["strings"] = [offset, "B", len(strings.data)]
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) <= header_size:
+            break
+        header_size = len(header_bytes) * 2
+
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 0, header_size))
+        f.write(header_bytes.ljust(header_size, b" "))
+        for key, column in columns.items():
+            _pad_to(f, header["sections"][key][0])
+            column.tofile(f)
+        _pad_to(f, header["sections"]["strings"][0])
+        f.write(strings.data)
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _pad_to(f, offset):
+    f.write(b"\0" * (offset - f.tell()))
+
+
+class ColumnarDSL:
+    """
+    以 mmap 打开的列式 DSL 文件。
+
+    节点以前序下标标识，根节点的下标为 0。各列可通过 columns[...] 读取（memoryview），
+    安装了 NumPy 时 array(...) 返回零拷贝的数组视图，适合向量化查询。
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, header_size = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != COLUMNAR_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"不是列式 DSL 文件: {path}")
+        if version != COLUMNAR_VERSION:
+            self._mmap.close()
+            raise ValueError(f"不支持的列式 DSL 版本: {version}")
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_size])
+        if header["byteorder"] != sys.byteorder:
+            self._mmap.close()
+            raise ValueError("列式 DSL 文件的字节序与当前平台不一致")
+        self.header = header
+        self.types = header["types"]
+        self._buffer = memoryview(self._mmap)
+        self.columns = {}
+        for key, (offset, typecode, count) in header["sections"].items():
+            size = array(typecode).itemsize
+            self.columns[key] = self._buffer[offset:offset + count * size].cast(typecode)
+        self._strings = {}
+        self._parts = {}
+
+    def __len__(self):
+        return self.header["nodes"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """释放列视图并关闭映射；仍有外部 NumPy 视图引用时映射在这些视图释放后关闭。"""
+        if self._mmap is None:
+            return
+        for column in self.columns.values():
+            column.release()
+        self._buffer.release()
+        self.columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._mmap = None
+
+    # --- 列访问 ---
+    def array(self, key):
+        """返回某一列的 NumPy 零拷贝视图，frame 列的形状为 (节点数, 4)。"""
+        if np is None:
+            raise RuntimeError("需要安装 'numpy' 库才能取得数组视图")
+        offset, typecode, count = self.header["sections"][key]
+        values = np.frombuffer(self._mmap, dtype=np.dtype(typecode), count=count, offset=offset)
+        return values.reshape(-1, len(FRAME_FIELDS)) if key == "frame" else values
+
+    def string(self, string_id):
+        """按编号读取字符串表中的字符串（解码结果会被缓存）。"""
+        text = self._strings.get(string_id)
+        if text is None:
+            offsets = self.columns["string_offsets"]
+            start = self.header["sections"]["strings"][0]
+            text = self._strings[string_id] = str(
+                self._buffer[start + offsets[string_id]:start + offsets[string_id + 1]], "utf-8"
+            )
+        return text
+
+    def _part(self, string_id):
+        part = self._parts.get(string_id)
+        if part is None:
+            part = self._parts[string_id] = json.loads(self.string(string_id))
+        return part
+
+    # --- 树结构 ---
+    @property
+    def root(self):
+        """根节点视图，空文件返回 None。"""
+        return ColumnarNode(self, 0) if len(self) else None
+
+    def node(self, index):
+        return ColumnarNode(self, index)
+
+    def children(self, index):
+        """依次产出节点的直接子节点下标。"""
+        end = self.columns["end"]
+        child = index + 1
+        stop = end[index]
+        while child < stop:
+            yield child
+            child = end[child]
+
+    def subtree(self, index):
+        """节点及其全部子孙的下标区间（前序）。"""
+        return range(index, self.columns["end"][index])
+
+    def find(self, name):
+        """返回名称为 name 的全部节点下标，只比较字符串表中的原始字节，不解码其他字符串。"""
+        target = name.encode("utf-8")
+        offsets = self.columns["string_offsets"]
+        start = self.header["sections"]["strings"][0]
+        string_ids = [
+            string_id for string_id in range(self.header["strings"])
+            if self._buffer[start + offsets[string_id]:start + offsets[string_id + 1]] == target
+        ]
+        if not string_ids:
+            return []
+        if np is not None:
+            return np.flatnonzero(np.isin(self.array("name"), string_ids)).tolist()
+        wanted = set(string_ids)
+        return [index for index, string_id in enumerate(self.columns["name"]) if string_id in wanted]
+
+    # --- 节点字段 ---
+    def field(self, index, key, default=None):
+        """读取单个节点的字段，与 DSL 字典的 get 语义相同；children 返回子节点视图的列表。"""
+        if key == "name":
+            string_id = self.columns["name"][index]
+            if string_id >= 0:
+                return self.string(string_id)
+        elif key == "type":
+            code = self.columns["type"][index]
+            if code != _NO_TYPE:
+                return self.types[code]
+        elif key in ("style", "layout"):
+            string_id = self.columns[key][index]
+            if string_id >= 0:
+                return self._with_frame(index, key, self._part(string_id))
+            return default
+        elif key == "children":
+            if self.columns["flags"][index] & _FLAG_CHILDREN:
+                return [ColumnarNode(self, child) for child in self.children(index)]
+            return default
+        string_id = self.columns["extra"][index]
+        if string_id >= 0:
+            return self._part(string_id).get(key, default)
+        return default
+
+    def _with_frame(self, index, part, values):
+        result = dict(values)
+        flag = self.columns["flags"][index]
+        frame = self.columns["frame"]
+        base = index * len(FRAME_FIELDS)
+        for bit, (frame_part, key) in enumerate(FRAME_FIELDS):
+            if frame_part == part and flag & (1 << bit):
+                value = frame[base + bit]
+                result[key] = int(value) if flag & (1 << (bit + _FLAG_INT_SHIFT)) else value
+        return result
+
+    def keys(self, index):
+        """节点拥有的字段，顺序与 DSLNode 的字段顺序一致。"""
+        present = set()
+        if self.columns["name"][index] >= 0:
+            present.add("name")
+        if self.columns["type"][index] != _NO_TYPE:
+            present.add("type")
+        for key in ("style", "layout"):
+            if self.columns[key][index] >= 0:
+                present.add(key)
+        if self.columns["flags"][index] & _FLAG_CHILDREN:
+            present.add("children")
+        extra_id = self.columns["extra"][index]
+        extra_keys = list(self._part(extra_id)) if extra_id >= 0 else []
+        present.update(extra_keys)
+        ordered = [key for key in _NODE_KEY_ORDER if key in present]
+        return ordered + [key for key in extra_keys if key not in _NODE_KEY_ORDER]
+
+    def to_dsl(self, index=0):
+        """把一个子树还原为普通字典表示的 DSL（显式栈实现）。"""
+        result = {}
+        stack = [(index, result)]
+        while stack:
+            node_index, target = stack.pop()
+            for key in self.keys(node_index):
+                if key == "children":
+                    children = target["children"] = []
+                    for child in self.children(node_index):
+                        child_dict = {}
+                        children.append(child_dict)
+                        stack.append((child, child_dict))
+                else:
+                    target[key] = self.field(node_index, key)
+        return result
+
+
+class ColumnarNode:
+    """列式 DSL 中单个节点的只读视图，读取接口与 DSL 字典相同。"""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def get(self, key, default=None):
+        return self.table.field(self.index, key, default)
+
+    def __getitem__(self, key):
+        value = self.table.field(self.index, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.table.field(self.index, key, _MISSING) is not _MISSING
+
+    def __bool__(self):
+        return True
+
+    def keys(self):
+        return self.table.keys(self.index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """还原以该节点为根的整个子树。"""
+        return self.table.to_dsl(self.index)
+
+    def __repr__(self):
+        return f"ColumnarNode({self.index}, name={self.get('name')!r})"
+
@@ -0,0 +1,319 @@
+"""
+紧凑的 DSL 节点表示。
+
+每个 DSL 节点原本由 node / style / layout / children 等多个字典组成，每个节点在存放任何字符串之前
+就要占用数百字节。这里用 __slots__ 类代替字典：字段固定，不再为每个节点分配哈希表，
+名称和令牌值使用驻留字符串，相同的值在整棵树中只保存一份。
+
+节点类提供字典式的访问接口（node["style"]、node.get("children")、"width" in style 等），
+已有按字典读写 DSL 的代码无需修改即可使用；反序列化得到的普通字典同样可以混用。
+序列化时按字段声明的顺序输出，与原先字典的键顺序一致：写出文件统一经由 dsl_writer，
+单独调用 json.dump 时传入 default=json_default 即可。
+"""
+import sys
+
+intern = sys.intern
+
+
+class _Missing:
+    """未赋值字段的占位值。"""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __reduce__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+class _SlotRecord:
+    """
+    以 __slots__ 存储的记录，值为 MISSING 的字段视为不存在的键。
+
+    所有字段在创建时都会赋值（默认为 MISSING），读取、序列化时不会触发 AttributeError，
+    直接访问属性时需要与 MISSING 比较。子类逐字段实现 __init__ 和 to_dict，避免循环和异常处理的开销。
+    """
+
+    __slots__ = ()
+    _fields = frozenset()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            value = getattr(self, key)
+            if value is not MISSING:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(f"{type(self).__name__} 不支持字段 {key!r}")
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        self[key]
+        setattr(self, key, MISSING)
+
+    def __contains__(self, key):
+        return key in self._fields and getattr(self, key) is not MISSING
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            value = getattr(self, key)
+            if value is not MISSING:
+                return value
+        return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        setattr(self, key, MISSING)
+        return value
+
+    def keys(self):
+        return list(self.to_dict())
+
+    def values(self):
+        return list(self.to_dict().values())
+
+    def items(self):
+        return list(self.to_dict().items())
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def copy(self):
+        """浅复制，子字段（style、children 等）与原记录共享。"""
+        clone = type(self).__new__(type(self))
+        for key in self.__slots__:
+            setattr(clone, key, getattr(self, key))
+        return clone
+
+    def __eq__(self, other):
+        if isinstance(other, _SlotRecord):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        for key in self.__slots__:
+            setattr(self, key, state.get(key, MISSING))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+# 字段顺序与 SketchConverter 原先写入字典的顺序一致，保证序列化结果不变
+
+class DSLNode(_SlotRecord):
+    """DSL 节点。"""
+
+    __slots__ = ("name", "type", "variant", "content", "style", "layout", "children", "ref", "overrides", "symbols")
+    _fields = frozenset(__slots__)
+
+    def __init__(self, name=MISSING, type=MISSING, variant=MISSING, content=MISSING, style=MISSING, layout=MISSING,
+                 children=MISSING, ref=MISSING, overrides=MISSING, symbols=MISSING):
+        self.name = name
+        self.type = type
+        self.variant = variant
+        self.content = content
+        self.style = style
+        self.layout = layout
+        self.children = children
+        self.ref = ref
+        self.overrides = overrides
+        self.symbols = symbols
+
+    def to_dict(self):
+        """转换为普通字典（浅转换），键顺序即字段声明顺序。"""
+        result = {}
+        if (value := self.name) is not MISSING:
+            result["name"] = value
+        if (value := self.type) is not MISSING:
+            result["type"] = value
+        if (value := self.variant) is not MISSING:
+            result["variant"] = value
+        if (value := self.content) is not MISSING:
+            result["content"] = value
+        if (value := self.style) is not MISSING:
+            result["style"] = value
+        if (value := self.layout) is not MISSING:
+            result["layout"] = value
+        if (value := self.children) is not MISSING:
+            result["children"] = value
+        if (value := self.ref) is not MISSING:
+            result["ref"] = value
+        if (value := self.overrides) is not MISSING:
+            result["overrides"] = value
+        if (value := self.symbols) is not MISSING:
+            result["symbols"] = value
+        return result
+
+
+class DSLStyle(_SlotRecord):
+    """DSL 节点的样式。"""
+
+    __slots__ = ("sharedStyle", "opacity", "backgroundColor", "textColor", "font", "borderWidth", "borderColor",
+                 "borderRadius", "shadow", "width", "height")
+    _fields = frozenset(__slots__)
+
+    def __init__(self, sharedStyle=MISSING, opacity=MISSING, backgroundColor=MISSING, textColor=MISSING, font=MISSING,
+                 borderWidth=MISSING, borderColor=MISSING, borderRadius=MISSING, shadow=MISSING, width=MISSING,
+                 height=MISSING):
+        self.sharedStyle = sharedStyle
+        self.opacity = opacity
+        self.backgroundColor = backgroundColor
+        self.textColor = textColor
+        self.font = font
+        self.borderWidth = borderWidth
+        self.borderColor = borderColor
+        self.borderRadius = borderRadius
+        self.shadow = shadow
+        self.width = width
+        self.height = height
+
+    def to_dict(self):
+        """转换为普通字典（浅转换），键顺序即字段声明顺序。"""
+        result = {}
+        if (value := self.sharedStyle) is not MISSING:
+            result["sharedStyle"] = value
+        if (value := self.opacity) is not MISSING:
+            result["opacity"] = value
+        if (value := self.backgroundColor) is not MISSING:
+            result["backgroundColor"] = value
+        if (value := self.textColor) is not MISSING:
+            result["textColor"] = value
+        if (value := self.font) is not MISSING:
+            result["font"] = value
+        if (value := self.borderWidth) is not MISSING:
+            result["borderWidth"] = value
+        if (value := self.borderColor) is not MISSING:
+            result["borderColor"] = value
+        if (value := self.borderRadius) is not MISSING:
+            result["borderRadius"] = value
+        if (value := self.shadow) is not MISSING:
+            result["shadow"] = value
+        if (value := self.width) is not MISSING:
+            result["width"] = value
+        if (value := self.height) is not MISSING:
+            result["height"] = value
+        return result
+
+
+class DSLLayout(_SlotRecord):
+    """DSL 节点的布局。"""
+
+    __slots__ = ("type", "columns", "direction", "gap", "h_gap", "v_gap", "position", "top", "left")
+    _fields = frozenset(__slots__)
+
+    def __init__(self, type=MISSING, columns=MISSING, direction=MISSING, gap=MISSING, h_gap=MISSING, v_gap=MISSING,
+                 position=MISSING, top=MISSING, left=MISSING):
+        self.type = type
+        self.columns = columns
+        self.direction = direction
+        self.gap = gap
+        self.h_gap = h_gap
+        self.v_gap = v_gap
+        self.position = position
+        self.top = top
+        self.left = left
+
+    def to_dict(self):
+        """转换为普通字典（浅转换），键顺序即字段声明顺序。"""
+        result = {}
+        if (value := self.type) is not MISSING:
+            result["type"] = value
+        if (value := self.columns) is not MISSING:
+            result["columns"] = value
+        if (value := self.direction) is not MISSING:
+            result["direction"] = value
+        if (value := self.gap) is not MISSING:
+            result["gap"] = value
+        if (value := self.h_gap) is not MISSING:
+            result["h_gap"] = value
+        if (value := self.v_gap) is not MISSING:
+            result["v_gap"] = value
+        if (value := self.position) is not MISSING:
+            result["position"] = value
+        if (value := self.top) is not MISSING:
+            result["top"] = value
+        if (value := self.left) is not MISSING:
+            result["left"] = value
+        return result
+
+
+class TailwindNode(_SlotRecord):
+    """Tailwind 转换结果的节点。"""
+
+    __slots__ = ("ele", "style", "src", "children")
+    _fields = frozenset(__slots__)
+
+    def __init__(self, ele=MISSING, style=MISSING, src=MISSING, children=MISSING):
+        self.ele = ele
+        self.style = style
+        self.src = src
+        self.children = children
+
+    def to_dict(self):
+        """转换为普通字典（浅转换），键顺序即字段声明顺序。"""
+        result = {}
+        if (value := self.ele) is not MISSING:
+            result["ele"] = value
+        if (value := self.style) is not MISSING:
+            result["style"] = value
+        if (value := self.src) is not MISSING:
+            result["src"] = value
+        if (value := self.children) is not MISSING:
+            result["children"] = value
+        return result
+
+
+def json_default(obj):
+    """json.dump 的 default 回调：把紧凑记录转换为字典。"""
+    if isinstance(obj, _SlotRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def to_plain(obj):
+    """把包含紧凑记录的结构完整转换为普通的字典和列表（显式栈实现，不受递归深度限制）。"""
+    root = [obj]
+    stack = [(root, 0)]
+    while stack:
+        container, key = stack.pop()
+        value = container[key]
+        if isinstance(value, _SlotRecord):
+            value = value.to_dict()
+        elif isinstance(value, tuple):
+            value = list(value)
+        elif isinstance(value, dict):
+            value = dict(value)
+        elif isinstance(value, list):
+            value = list(value)
+        else:
+            continue
+        container[key] = value
+        keys = value.keys() if isinstance(value, dict) else range(len(value))
+        stack.extend((value, child_key) for child_key in keys)
+    return root[0]
+
@@ -1,5 +1,14 @@
+import html
 import json
 import os
+import re
+
+try:
+    from .dsl_columnar import COLUMNAR_SUFFIX, ColumnarDSL
+    from .metrics import timed
+except ImportError:
+    from dsl_columnar import COLUMNAR_SUFFIX, ColumnarDSL
+    from metrics import timed
 
 # --- 配置项 ---
 DSL_INPUT_FILE = os.path.join(
@@ -19,11 +28,46 @@ DEBUG_COLORS = [
     "rgba(255, 159, 64, 0.2)",   # Orange
 ]
 
-def dsl_node_to_html(node, level=0):
-    """递归地将单个 DSL 节点转换为 HTML 字符串，并根据层级添加调试颜色。"""
-    if not node:
-        return ""
+# 是否为没有背景色/边框的元素添加调试用的背景色和细边框，生产环境预览可关闭
+ENABLE_DEBUG_STYLES = True
+# 流式输出时每个分块的大致字符数，避免向响应或文件逐个标签地小块写入
+HTML_CHUNK_SIZE = 64 * 1024
+# 完整页面是否把相同的样式声明合并为共享的 CSS 类，而不是在每个元素上写内联 style。
+# 驻留需要在输出第一个字节之前遍历整棵树收集样式，流式响应（预览接口）默认关闭，保持逐节点输出
+ENABLE_STYLE_INTERNING = False
+# 写入文件（write_html）时是否启用样式驻留，文件不在意首字节时间，驻留可明显减小体积
+HTML_FILE_INTERN_STYLES = True
+# 生成的 CSS 类名前缀
+STYLE_CLASS_PREFIX = "s"
+# 几乎每个元素都不同的声明（绝对定位坐标）不参与驻留，仍写在内联 style 中
+INLINE_STYLE_PROPERTIES = ("top:", "left:")
+# 合法的单条样式声明。样式值来自上传的文件，驻留后会写入页面级的 <style>，
+# 含有 {、}、;、\、< 等字符的值可能结束当前规则并注入全局规则，这样的声明直接丢弃
+_CSS_DECLARATION = re.compile(r"[a-z-]+: [^;{}\\<>]*;")
+# 驻留表拒绝的字符：只有格式错误的声明才会包含它们
+_CSS_UNSAFE_CHARS = frozenset("{}\\<>")
 
+HTML_DOCUMENT_HEAD_START = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>DSL Preview</title>
+    <style>
+        body { margin: 0; font-family: sans-serif; }
+        div { box-sizing: border-box; }
+"""
+HTML_DOCUMENT_HEAD_END = """    </style>
+</head>
+<body>
+"""
+HTML_DOCUMENT_TAIL = """
+</body>
+</html>"""
+
+
+def _node_style(node, level, debug_styles):
+    """生成单个 DSL 节点的样式声明列表，并根据层级添加调试颜色。"""
     # 1. 生成当前节点的样式
     styles = []
     node_style = node.get("style", {})
@@ -55,14 +99,14 @@ def dsl_node_to_html(node, level=0):
         if bg_color == "color-white": styles.append("background-color: #FFFFFF;")
         elif bg_color == "color-black": styles.append("background-color: #000000;")
         else: styles.append(f"background-color: {bg_color};")
-    else:
+    elif debug_styles:
         # 如果没有背景色，则根据层级应用一个调试颜色
         debug_color = DEBUG_COLORS[level % len(DEBUG_COLORS)]
         styles.append(f"background-color: {debug_color};")
     
     if "borderColor" in node_style and "borderWidth" in node_style:
         styles.append(f"border: {node_style['borderWidth']} solid {node_style['borderColor']};")
-    else:
+    elif debug_styles:
         # 为所有没有边框的元素添加一个细边框，以便观察
         styles.append("border: 1px solid rgba(0, 0, 0, 0.1);")
 
@@ -73,20 +117,218 @@ def dsl_node_to_html(node, level=0):
         else:
              styles.append(f"border-radius: {radius}px;")
 
-    # 2. 递归处理子节点
-    children_html = ""
-    if children := node.get("children"):
-        for child in children:
-            children_html += dsl_node_to_html(child, level + 1) # 传递下一层级
+    return [style for style in styles if _CSS_DECLARATION.fullmatch(style)]
+
+
+def _split_styles(styles):
+    """拆分为 (参与驻留的声明, 内联声明)。"""
+    shared = " ".join(style for style in styles if not style.startswith(INLINE_STYLE_PROPERTIES))
+    inline = " ".join(style for style in styles if style.startswith(INLINE_STYLE_PROPERTIES))
+    return shared, inline
+
+
+def _attr(value):
+    """转义属性值：图层名等内容来自上传的文件，不能原样写入 HTML。"""
+    return html.escape(str(value), quote=True)
+
+
+def _node_open_tag(node, level, debug_styles, interner=None):
+    """生成单个 DSL 节点的开始标签；传入 interner 时以类名引用样式。"""
+    styles = _node_style(node, level, debug_styles)
+    name = _attr(node.get("name", "Unnamed"))
+    if interner is None:
+        return f'<div data-name="{name}" style="{_attr(" ".join(styles))}">'
+    shared, inline = _split_styles(styles)
+    attrs = f' class="{_attr(interner.intern(shared))}"' if shared else ""
+    if inline:
+        attrs += f' style="{_attr(inline)}"'
+    return f'<div data-name="{name}"{attrs}>'
+
+
+def _iter_nodes(node, level):
+    """深度优先依次产出 (节点, 层级)。"""
+    if not node:
+        return
+    stack = [(node, level)]
+    while stack:
+        item, item_level = stack.pop()
+        yield item, item_level
+        if children := item.get("children"):
+            stack.extend((child, item_level + 1) for child in reversed(children) if child)
+
+
+class StyleInterner:
+    """
+    样式声明的驻留表。
+
+    每一组不同的样式声明只分配一个类名，页面中只在 <style> 里输出一次，元素通过 class 引用；
+    绝对定位坐标（INLINE_STYLE_PROPERTIES）几乎各不相同，不参与驻留。
+    同一个驻留表可以依次收集同一文档的多个画板，它们共用同一套类名。
+    """
+
+    def __init__(self, prefix=STYLE_CLASS_PREFIX):
+        self.prefix = prefix
+        self.classes = {}
+
+    def __len__(self):
+        return len(self.classes)
+
+    def intern(self, style_str):
+        """
+        返回样式声明对应的类名，首次出现时分配新的类名。
+
+        声明会原样写入 <style>，含有可能结束规则或 <style> 元素的字符时抛出 ValueError
+        （_node_style 已丢弃格式错误的声明，正常情况下不会发生）。
+        """
+        name = self.classes.get(style_str)
+        if name is None:
+            if not _CSS_UNSAFE_CHARS.isdisjoint(style_str):
+                raise ValueError(f"样式声明包含不允许的字符: {style_str!r}")
+            name = self.classes[style_str] = f"{self.prefix}{_base36(len(self.classes))}"
+        return name
+
+    def collect(self, node, level=0, debug_styles=None):
+        """预先收集一棵 DSL 树的全部样式声明，使 <style> 可以在页面内容之前输出。"""
+        if debug_styles is None:
+            debug_styles = ENABLE_DEBUG_STYLES
+        for item, item_level in _iter_nodes(node, level):
+            shared, _ = _split_styles(_node_style(item, item_level, debug_styles))
+            if shared:
+                self.intern(shared)
+
+    def iter_css(self, indent="        "):
+        """按分配顺序逐条产出 CSS 规则。"""
+        for style_str, name in self.classes.items():
+            yield f"{indent}.{name} {{ {style_str} }}\n"
+
+
+def _base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        text = digits[remainder] + text
+        if not number:
+            return text
+
+
+def _buffered(pieces, chunk_size):
+    """把细碎的 HTML 片段合并成约 chunk_size 个字符的分块。"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
 
-    # 3. 组合成最终的 HTML 元素
-    style_str = " ".join(styles)
-    return f'<div data-name="{node.get("name", "Unnamed")}" style="{style_str}">{children_html}</div>'
+
+def _iter_node_pieces(node, level, debug_styles, interner=None):
+    """深度优先依次产出开始标签和结束标签（显式栈实现，不受递归深度限制）。"""
+    if not node:
+        return
+    stack = [(node, level)]
+    while stack:
+        item, item_level = stack.pop()
+        if item is None:
+            yield "</div>"
+            continue
+        yield _node_open_tag(item, item_level, debug_styles, interner)
+        stack.append((None, item_level))
+        if children := item.get("children"):
+            stack.extend((child, item_level + 1) for child in reversed(children) if child)
+
+
+def iter_dsl_html(node, level=0, debug_styles=None, chunk_size=HTML_CHUNK_SIZE, interner=None):
+    """
+    以生成器形式深度优先地产出单个 DSL 节点的 HTML 分块。
+
+    参数:
+        node (dict): DSL 节点。
+        level (int): 节点所在层级，用于选择调试颜色。
+        debug_styles (bool, optional): 是否添加调试背景色和边框，默认取 ENABLE_DEBUG_STYLES。
+        chunk_size (int): 每个分块的大致字符数。
+        interner (StyleInterner, optional): 传入时以类名引用样式，对应的 CSS 由调用方输出。
+    """
+    if debug_styles is None:
+        debug_styles = ENABLE_DEBUG_STYLES
+    return _buffered(_iter_node_pieces(node, level, debug_styles, interner), chunk_size)
+
+
+def iter_html_pages(roots, debug_styles=None, chunk_size=HTML_CHUNK_SIZE, intern_styles=None, interner=None):
+    """
+    以生成器形式产出包含一个或多个 DSL 根节点（如同一文档的多个画板）的 HTML 预览页面，
+    可直接交给 StreamingHttpResponse。
+
+    启用样式驻留时先遍历一遍收集样式，在 <head> 中输出共享的 CSS 类，再遍历一遍输出元素；
+    两遍都不保存中间结果，内存占用只与树的深度、不同样式的数量和分块大小有关。
+
+    参数:
+        roots (list): DSL 根节点列表。
+        intern_styles (bool, optional): 是否启用样式驻留，默认取 ENABLE_STYLE_INTERNING。
+        interner (StyleInterner, optional): 复用已有的驻留表，传入时总是启用样式驻留。
+    """
+    if debug_styles is None:
+        debug_styles = ENABLE_DEBUG_STYLES
+    if intern_styles is None:
+        intern_styles = ENABLE_STYLE_INTERNING
+    if interner is None and intern_styles:
+        interner = StyleInterner()
+    if interner is not None:
+        for root in roots:
+            interner.collect(root, 0, debug_styles)
+
+    yield HTML_DOCUMENT_HEAD_START
+    if interner is not None:
+        yield from _buffered(interner.iter_css(), chunk_size)
+    yield HTML_DOCUMENT_HEAD_END
+    for index, root in enumerate(roots):
+        if index:
+            yield "\n"
+        yield from iter_dsl_html(root, 0, debug_styles, chunk_size, interner) # 从第 0 层开始
+    yield HTML_DOCUMENT_TAIL
+
+
+def iter_html_document(dsl_data, debug_styles=None, chunk_size=HTML_CHUNK_SIZE, intern_styles=None):
+    """
+    以生成器形式产出单个 DSL 根节点的完整 HTML 预览页面，可直接交给 StreamingHttpResponse。
+    """
+    return iter_html_pages([dsl_data], debug_styles, chunk_size, intern_styles)
+
+
+@timed("html")
+def write_html(dsl_data, fp, debug_styles=None, intern_styles=None):
+    """
+    将 DSL 根节点渲染为 HTML 预览页面，逐块写入任意文本文件对象。
+
+    intern_styles 默认取 HTML_FILE_INTERN_STYLES（与流式输出的默认值不同）。
+    """
+    if intern_styles is None:
+        intern_styles = HTML_FILE_INTERN_STYLES
+    for chunk in iter_html_document(dsl_data, debug_styles, intern_styles=intern_styles):
+        fp.write(chunk)
+
+
+def dsl_node_to_html(node, level=0, debug_styles=None):
+    """将单个 DSL 节点转换为 HTML 字符串，并根据层级添加调试颜色。"""
+    return "".join(iter_dsl_html(node, level, debug_styles))
+
+
+def dsl_to_html_document(dsl_data, debug_styles=None, intern_styles=None):
+    """将 DSL 根节点转换为完整的 HTML 预览页面。"""
+    return "".join(iter_html_document(dsl_data, debug_styles, intern_styles=intern_styles))
 
 
 def main():
-    """主函数：读取 DSL JSON 并生成 HTML 文件。"""
+    """主函数：读取 DSL（JSON 或列式格式）并生成 HTML 文件。"""
     print(f"--- DSL to HTML Converter ---")
+    if DSL_INPUT_FILE.endswith(COLUMNAR_SUFFIX):
+        _columnar_main()
+        return
     try:
         with open(DSL_INPUT_FILE, "r", encoding="utf-8") as f:
             dsl_data = json.load(f)
@@ -101,34 +343,33 @@ def main():
         print("[WARNING] DSL 文件为空，无法生成 HTML。")
         return
 
-    # 将根节点转换为 HTML
-    body_content = dsl_node_to_html(dsl_data, level=0) # 从第 0 层开始
-
-    # 构建完整的 HTML 页面
-    html_content = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>DSL Preview</title>
-    <style>
-        body {{ margin: 0; font-family: sans-serif; }}
-        div {{ box-sizing: border-box; }}
-    </style>
-</head>
-<body>
-{body_content}
-</body>
-</html>"""
-
-    # 写入 HTML 文件
+    # 逐块写入 HTML 文件
     try:
         with open(HTML_OUTPUT_FILE, "w", encoding="utf-8") as f:
-            f.write(html_content)
+            write_html(dsl_data, f)
         print(f"[SUCCESS] HTML 文件已成功生成于: {HTML_OUTPUT_FILE}")
     except IOError as e:
         print(f"[ERROR] 无法写入 HTML 文件: {e}")
 
 
+def _columnar_main():
+    """列式 DSL 通过 mmap 按需读取节点，渲染时不需要把整个文件反序列化。"""
+    try:
+        table = ColumnarDSL(DSL_INPUT_FILE)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"[ERROR] 无法读取列式 DSL 文件: {e}")
+        return
+    with table:
+        if table.root is None:
+            print("[WARNING] DSL 文件为空，无法生成 HTML。")
+            return
+        try:
+            with open(HTML_OUTPUT_FILE, "w", encoding="utf-8") as f:
+                write_html(table.root, f)
+            print(f"[SUCCESS] HTML 文件已成功生成于: {HTML_OUTPUT_FILE}")
+        except IOError as e:
+            print(f"[ERROR] 无法写入 HTML 文件: {e}")
+
+
 if __name__ == "__main__":
     main()
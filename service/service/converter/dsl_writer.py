@@ -0,0 +1,271 @@
+"""
+DSL 输出的序列化层。
+
+所有 DSL / 转换结果文件都经由这里写出和读取：
+    - 输出格式：pretty 为 4 空格缩进（便于阅读和 diff），compact 为无缩进、短分隔符（生产环境，体积约为一半）；
+    - JSON 后端：compact 模式下优先使用 orjson（未安装时退回标准库的 C 编码器），
+      pretty 模式使用显式栈编码器，输出与 json.dump(indent=4) 逐字节相同；
+    - 压缩：按文件后缀透明地读写 gzip（.gz）和 zstd（.zst，需要 zstandard 库），读取时按文件头识别；
+    - 流式编码：待写出的结构中可以包含迭代器（编码为数组，逐个取出元素）和无参可调用对象（编码时才求值），
+      结果可以边生成边写出，例如批量转换时每个画板转换完成后立即编码写入，不必等整个文档构建完毕。
+"""
+import gzip
+import json
+import logging
+import math
+from collections.abc import Iterator
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+try:
+    from .dsl_node import json_default
+    from .metrics import timed
+except ImportError:
+    from dsl_node import json_default
+    from metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("converter")
+
+# 输出格式："pretty" 或 "compact"
+DSL_OUTPUT_FORMAT = "pretty"
+# compact 模式的 JSON 后端："auto"（有 orjson 时使用）、"orjson" 或 "json"
+DSL_JSON_BACKEND = "auto"
+PRETTY_INDENT = 4
+GZIP_COMPRESS_LEVEL = 6
+ZSTD_COMPRESS_LEVEL = 3
+# 每个输出分块包含的片段数
+JSON_CHUNK_PIECES = 4096
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+_COMPRESSION_MAGIC = ((b"\x1f\x8b", "gzip"), (b"\x28\xb5\x2f\xfd", "zstd"))
+
+_SCALAR_TYPES = (str, int, float, type(None))
+_RAW = -1
+_LAZY = -2
+_END = object()
+
+
+def _encode_scalar(value, encode_str):
+    if isinstance(value, str):
+        return encode_str(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if value != value or value in (math.inf, -math.inf):
+        return json.dumps(value)
+    return float.__repr__(value)
+
+
+def iter_json(obj, indent=None, ensure_ascii=False, encode_item=None):
+    """
+    以显式栈逐块生成 JSON 文本，不受树深度限制。
+
+    indent 为整数时输出与 json.dumps(obj, indent=indent, default=json_default) 相同的文本，
+    为 None 时输出紧凑格式（分隔符为 "," 和 ":"）。标准库在指定 indent 时只能使用纯 Python 的递归编码器，
+    对紧凑记录还要逐个回调 default，这里直接展开记录，速度约为其 4 倍。
+
+    迭代器编码为数组并逐个取出元素，无参可调用对象在编码到该位置时才调用并编码其返回值。
+    encode_item(value) 用于编码迭代器元素和可调用对象的返回值，返回文本时原样写入，返回 None 时按普通值展开；
+    只适用于紧凑格式。
+    """
+    encode_str = encode_basestring_ascii if ensure_ascii else encode_basestring
+    item_sep, key_sep = (",", ": ") if indent is not None else (",", ":")
+    breaks = []
+
+    def line_break(level):
+        if indent is None:
+            return ""
+        while len(breaks) <= level:
+            breaks.append("\n" + " " * (indent * len(breaks)))
+        return breaks[level]
+
+    pieces = []
+    stack = [(obj, 0)]
+    push = stack.append
+    while stack:
+        item, level = stack.pop()
+        if level == _RAW:
+            pieces.append(item)
+        elif level == _LAZY:
+            iterator, depth, count = item
+            value = next(iterator, _END)
+            if value is _END:
+                pieces.append(line_break(depth) + "]" if count else "[]")
+            else:
+                item[2] = count + 1
+                push((item, _LAZY))
+                pieces.append((item_sep if count else "[") + line_break(depth + 1))
+                text = encode_item(value) if encode_item is not None else None
+                if text is None:
+                    push((value, depth + 1))
+                else:
+                    pieces.append(text)
+        else:
+            if isinstance(item, dict):
+                if not item:
+                    pieces.append("{}")
+                    continue
+                inner = line_break(level + 1)
+                push((line_break(level) + "}", _RAW))
+                entries = list(item.items())
+                for index in range(len(entries) - 1, -1, -1):
+                    key, value = entries[index]
+                    push((value, level + 1))
+                    push(((item_sep if index else "") + inner + encode_str(str(key)) + key_sep, _RAW))
+                pieces.append("{")
+            elif isinstance(item, (list, tuple)):
+                if not item:
+                    pieces.append("[]")
+                    continue
+                inner = line_break(level + 1)
+                push((line_break(level) + "]", _RAW))
+                for index in range(len(item) - 1, -1, -1):
+                    push((item[index], level + 1))
+                    push(((item_sep if index else "") + inner, _RAW))
+                pieces.append("[")
+            elif isinstance(item, _SCALAR_TYPES):
+                pieces.append(_encode_scalar(item, encode_str))
+            elif isinstance(item, Iterator):
+                push(([item, level, 0], _LAZY))
+            elif callable(item):
+                value = item()
+                text = encode_item(value) if encode_item is not None else None
+                if text is None:
+                    push((value, level))
+                else:
+                    pieces.append(text)
+            else:
+                # 紧凑记录等：转换为字典后重新编码，无法转换时抛出 TypeError
+                push((json_default(item), level))
+        if len(pieces) >= JSON_CHUNK_PIECES:
+            yield "".join(pieces)
+            pieces = []
+    if pieces:
+        yield "".join(pieces)
+
+
+def _compact_encoder(backend=None):
+    """返回紧凑格式的整树编码函数 value -> bytes；遇到流式结构、过深的树等无法一次编码的情况时抛出异常。"""
+    backend = backend or DSL_JSON_BACKEND
+    if backend == "orjson" and orjson is None:
+        logger.warning("未安装 'orjson' 库，使用标准库 json 编码。")
+    if backend in ("auto", "orjson") and orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        return lambda value: orjson.dumps(value, default=json_default, option=option)
+    return lambda value: json.dumps(
+        value, ensure_ascii=False, separators=(",", ":"), default=json_default
+    ).encode("utf-8")
+
+
+def iter_encoded(obj, output_format=None, backend=None):
+    """
+    按输出格式把 obj 编码为 UTF-8 字节分块。
+
+    compact 模式先尝试用后端一次编码整棵树；obj 中含有迭代器或可调用对象（或树深超出后端限制）时
+    改为流式编码，其中每个迭代器元素仍优先交给后端整体编码。
+    """
+    output_format = output_format or DSL_OUTPUT_FORMAT
+    if output_format == "pretty":
+        for chunk in iter_json(obj, indent=PRETTY_INDENT):
+            yield chunk.encode("utf-8")
+        return
+    if output_format != "compact":
+        raise ValueError(f"未知的输出格式: {output_format}")
+
+    encode = _compact_encoder(backend)
+
+    def encode_item(value):
+        try:
+            return encode(value).decode("utf-8")
+        except (TypeError, ValueError, RecursionError):
+            return None
+
+    try:
+        yield encode(obj)
+        return
+    except (TypeError, ValueError, RecursionError):
+        pass
+    for chunk in iter_json(obj, encode_item=encode_item):
+        yield chunk.encode("utf-8")
+
+
+def dumps_dsl(obj, output_format=None, backend=None):
+    """把 obj 编码为 UTF-8 字节串。"""
+    return b"".join(iter_encoded(obj, output_format, backend))
+
+
+def compression_for(path):
+    """按文件后缀判断压缩方式，无压缩时返回 None。"""
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if str(path).endswith(suffix):
+            return compression
+    return None
+
+
+def open_output(path, compression=None):
+    """以二进制写方式打开输出文件，compression 未指定时按后缀判断。"""
+    compression = compression or compression_for(path)
+    if compression is None:
+        return open(path, "wb")
+    if compression == "gzip":
+        # mtime 固定为 0，相同内容得到相同的文件
+        return gzip.GzipFile(path, "wb", compresslevel=GZIP_COMPRESS_LEVEL, mtime=0)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("写入 zstd 文件需要安装 'zstandard' 库")
+        return zstandard.ZstdCompressor(level=ZSTD_COMPRESS_LEVEL).stream_writer(open(path, "wb"), closefd=True)
+    raise ValueError(f"未知的压缩方式: {compression}")
+
+
+def open_input(path):
+    """以二进制读方式打开文件，按文件头识别 gzip / zstd 压缩。"""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    for magic, compression in _COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            if compression == "gzip":
+                return gzip.open(path, "rb")
+            if zstandard is None:
+                raise RuntimeError("读取 zstd 文件需要安装 'zstandard' 库")
+            return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+@timed("serialization")
+def write_dsl(path, obj, output_format=None, backend=None, compression=None):
+    """
+    把 DSL（或任何包含紧凑记录的结构）写入文件。
+
+    参数:
+        path (str or Path): 输出路径，后缀为 .gz / .zst 时自动压缩。
+        obj: 待写出的结构，可以包含迭代器和无参可调用对象（见 iter_json）。
+        output_format (str, optional): "pretty" 或 "compact"，默认为 DSL_OUTPUT_FORMAT。
+        backend (str, optional): compact 模式的 JSON 后端，默认为 DSL_JSON_BACKEND。
+        compression (str, optional): "gzip" 或 "zstd"，默认按后缀判断。
+    """
+    with open_output(path, compression) as f:
+        for chunk in iter_encoded(obj, output_format, backend):
+            f.write(chunk)
+
+
+def load_dsl(path):
+    """读取 write_dsl 写出的文件（自动解压），返回普通的字典和列表。"""
+    with open_input(path) as f:
+        data = f.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,8 +1,39 @@
+import hashlib
 import json
+import logging
+import math
 import os
 import time
-import statistics
-from collections import defaultdict
+from collections import Counter
+
+try:
+    from .diagnostics import Diagnostics, logger
+    from .document_index import DocumentIndex
+    from .dsl_node import DSLLayout, DSLNode, DSLStyle, intern
+    from .dsl_writer import write_dsl
+    from .incremental import IncrementalState, compute_subtree_hashes, compute_symbol_hashes
+    from .llm_layout import LLMLayoutResolver, apply_layout_to_node, build_layout_prompt
+    from . import metrics
+    from .layout_core import cluster_rows, is_column_aligned, sort_by_position
+    from .result_cache import ConversionCache, file_digest
+    from .sketch_parser import load_sketch
+    from .token_registry import get_token_registry, pack_rgb
+    from .token_report import TokenReportCollector
+    from .traversal import walk
+except ImportError:
+    from diagnostics import Diagnostics, logger
+    from document_index import DocumentIndex
+    from dsl_node import DSLLayout, DSLNode, DSLStyle, intern
+    from dsl_writer import write_dsl
+    from incremental import IncrementalState, compute_subtree_hashes, compute_symbol_hashes
+    from llm_layout import LLMLayoutResolver, apply_layout_to_node, build_layout_prompt
+    import metrics
+    from layout_core import cluster_rows, is_column_aligned, sort_by_position
+    from result_cache import ConversionCache, file_digest
+    from sketch_parser import load_sketch
+    from token_registry import get_token_registry, pack_rgb
+    from token_report import TokenReportCollector
+    from traversal import walk
 
 # --- V3.12 (Refactored) 配置项 ---
 INPUT_FILE = os.path.join(
@@ -15,11 +46,34 @@ DSL_OUTPUT_FILE = os.path.join(
 REPORT_OUTPUT_FILE = os.path.join(
     os.path.dirname(__file__), "..", "media", "sketches", "token_report.json"
 )
+INCREMENTAL_STATE_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "media", "sketches", "incremental_state.pickle"
+)
+# 设置后，每一次未知令牌的出现都会逐行写入该 JSONL 文件；报告本身只保留计数和示例
+TOKEN_OCCURRENCES_FILE = None
+
+# 颜色匹配的感知容差（CIELAB ΔE76），0 表示只做精确匹配；2.3 约为人眼可察觉的最小色差
+COLOR_DELTA_E_TOLERANCE = 0
+
+# 主元件实例的输出方式：
+#   "semantic" 只输出由主元件名称解析出的语义组件（type/variant），不包含主元件内容；
+#   "expand"   主元件只转换一次，每个实例复制其子节点并按 overrideValues 打补丁；
+#   "ref"      实例只记录 "ref": symbolID 和覆盖值，主元件的 DSL 统一放在根节点的 "symbols" 中
+SYMBOL_INSTANCE_MODE = "semantic"
+
+# 转换器版本，参与结果缓存键的计算；转换逻辑变化时需同步修改
+CONVERTER_VERSION = "3.12.2"
+ENABLE_RESULT_CACHE = True
+ENABLE_INCREMENTAL = True
 
 # --- 大模型 API 配置 ---
-ENABLE_LLM_FALLBACK = True
-LLM_API_KEY = "sk-ddwxtevjbtcuqswmcarbtykkrmlwdydiqqejgqakjayzbyga"  # 硅基流动
-LLM_MODEL_NAME = "Qwen/QwQ-32B"  # 硅基流动
+# LLM 布局回退默认关闭：开启后转换需要访问外部服务，结果也取决于模型的回答。
+# 设置环境变量 SKETCH_LLM_FALLBACK=1 并提供 LLM_API_KEY 后启用
+ENABLE_LLM_FALLBACK = os.environ.get("SKETCH_LLM_FALLBACK", "").lower() in ("1", "true", "yes")
+LLM_API_KEY = os.environ.get("LLM_API_KEY", "")
+LLM_MODEL_NAME = os.environ.get("LLM_MODEL_NAME", "Qwen/QwQ-32B")  # 硅基流动
+# 可通过环境变量指向本地的 OpenAI 兼容服务（如测试桩）
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.siliconflow.cn/v1")
 
 
 # --- 辅助函数 ---
@@ -32,6 +86,41 @@ def convert_color_to_hex(color_obj):
     b = int(color_obj.get("blue", 0) * 255)
     return f"#{r:02x}{g:02x}{b:02x}".upper()
 
+def packed_to_hex(packed, color_obj):
+    """将打包的 RGB 整数格式化为与 convert_color_to_hex 相同的十六进制字符串。"""
+    if packed is None:
+        return convert_color_to_hex(color_obj)
+    return f"#{packed:06X}"
+
+def _as_number(value, default):
+    """
+    样式中的数值（边框粗细、圆角）来自上传的文件，不是有限的数字时取默认值，
+    避免把任意字符串拼进生成的 CSS。
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return value
+    return default
+
+def _clone_with_patches(children, patches):
+    """
+    复制主元件的子节点列表并应用文本覆盖。
+
+    未被覆盖的子树在各实例间共享（只读），只复制从根到被覆盖节点的路径。
+    patches 为 {子节点下标路径: 文本}。
+    """
+    children = list(children)
+    for path, text in patches.items():
+        siblings = children
+        for depth, index in enumerate(path):
+            child = siblings[index].copy()
+            siblings[index] = child
+            if depth == len(path) - 1:
+                child["content"] = {**child.get("content", {}), "text": text}
+            else:
+                child["children"] = list(child["children"])
+                siblings = child["children"]
+    return children
+
 def parse_semantic_name(name):
     """解析如图 'component/button/primary' 的命名。"""
     parts = name.split("/")
@@ -51,225 +140,639 @@ class SketchConverter:
     此次重构旨在提高代码的可维护性和可扩展性。
     """
 
-    def __init__(self, sketch_data):
-        print("--- Sketch-to-DSL Converter V3.12 (Refactored) ---")
+    def __init__(self, sketch_data, cache=None, incremental=False, previous_state=None,
+                 tokens=None, symbol_map=None, index=None, source_digest=None):
+        logger.debug("--- Sketch-to-DSL Converter V3.12 (Refactored) ---")
+        # 转换过程的诊断事件，重复事件聚合计数，汇总写入令牌报告
+        self.diagnostics = Diagnostics()
         self.sketch_data = sketch_data
-        self.token_maps = self._load_design_tokens()
-        self.symbol_map = self._preprocess_symbols()
-        self.report = defaultdict(dict)
-        self.llm_client = None
-
-        if ENABLE_LLM_FALLBACK and LLM_API_KEY and "YOUR_API_KEY" not in LLM_API_KEY:
+        self.cache = cache
+        # sketch_data 读取自文件时为文件内容的 SHA-256（如 Sketch.content_hash），
+        # 结果缓存以它代替整棵图层树计算缓存键
+        self.source_digest = source_digest
+        # 增量转换：incremental 为真时记录子树哈希，转换后可从 incremental_state 取得本次状态，
+        # 传入上一次的 previous_state 即可复用未变化的子树
+        self.incremental = incremental or previous_state is not None
+        self.previous_state = previous_state
+        self.incremental_state = None
+        self.incremental_stats = None
+        # 批量转换时由调用方传入已加载的令牌和文档索引，避免重复加载
+        # 编译后的设计令牌由进程级注册表共享，文件未变化时不会重复加载
+        self.tokens = tokens if tokens is not None else get_token_registry(TOKENS_FILE).get()
+        self.token_maps = self.tokens.raw
+        # 文档索引最好在读取文件时通过 object_hook 同步建立（见 sketch_parser.load_sketch），
+        # 未传入时遍历一次文档建立
+        self._reset_metrics()
+        self._compiling_symbol = False
+        if index is None:
+            start = time.perf_counter()
+            index = DocumentIndex.build(sketch_data)
+            self._stage_seconds["symbols"] += time.perf_counter() - start
+        self.index = index
+        self.symbol_masters = index.symbols
+        self.symbol_map = symbol_map if symbol_map is not None else index.symbol_names()
+        self.diagnostics.info("index.loaded", "文档索引完成，找到 %d 个主元件(Symbols)、%d 个共享样式。",
+                              len(self.symbol_masters), len(index.shared_styles))
+        # 主元件编译缓存：symbolID → 编译结果，编译中的主元件为 None（防止循环引用）
+        self.compiled_symbols = {}
+        # 主元件内容哈希，首次需要时计算（见 _symbol_hashes）
+        self._symbol_hash_cache = None
+        # "ref" 模式下本次输出引用到的主元件
+        self._symbol_refs = set()
+        # 编译主元件期间收集的未知令牌记录，编译结束后随编译结果保存，每个实例回放一次
+        self._symbol_capture = None
+        self.report = TokenReportCollector(sidecar_path=TOKEN_OCCURRENCES_FILE)
+        self.llm_resolver = None
+        # 规则分析无法确定布局的编组，遍历结束后统一交给 LLM 解析：(DSL 节点, 提示词)
+        self._llm_pending = []
+        # 遍历回调：pre_hooks 在节点及其布局生成后、子节点处理前调用，
+        # post_hooks 在其全部子节点处理完后调用，签名均为 hook(node, layer)；
+        # 增量转换复用的子树只对其根节点调用回调
+        self.pre_hooks = []
+        self.post_hooks = []
+
+        if ENABLE_LLM_FALLBACK and LLM_API_KEY:
             try:
-                from openai import OpenAI
-                self.llm_client = OpenAI(
-                    api_key=LLM_API_KEY,
-                    base_url="https://api.siliconflow.cn/v1",
+                from openai import AsyncOpenAI
+                self.llm_resolver = LLMLayoutResolver(
+                    lambda: AsyncOpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL),
+                    LLM_MODEL_NAME,
+                    diagnostics=self.diagnostics,
                 )
-                print("[INFO] LLM 客户端已初始化。")
+                self.diagnostics.info("llm.ready", "LLM 客户端已初始化。")
             except ImportError:
-                print("[WARNING] 未安装 'openai' 库，无法使用 LLM 功能。")
+                self.diagnostics.warning("llm.unavailable", "未安装 'openai' 库，无法使用 LLM 功能。")
             except Exception as e:
-                print(f"\033[91m[ERROR] 初始化 LLM 客户端失败: {e}\033[0m")
+                self.diagnostics.error("llm.init_failed", "初始化 LLM 客户端失败: %s", e)
+
+    def convert(self, dsl_output_file=None, report_output_file=None, output_format=None):
+        """
+        执行转换过程并保存输出文件，未指定路径时使用 DSL_OUTPUT_FILE / REPORT_OUTPUT_FILE。
+
+        output_format 为 "pretty" 或 "compact"，默认取 dsl_writer.DSL_OUTPUT_FORMAT；
+        DSL 文件名以 .gz / .zst 结尾时压缩写出。
+        """
+        dsl_output_file = dsl_output_file or DSL_OUTPUT_FILE
+        dsl_output = self.build_dsl()
+        if dsl_output is None:
+            return None
 
-    def _load_design_tokens(self):
-        """加载外部设计令牌配置文件。"""
+        logger.info("转换完成，正在写入 DSL 文件: %s", dsl_output_file)
         try:
-            with open(TOKENS_FILE, "r", encoding="utf-8") as f:
-                print(f"[INFO] 成功加载设计令牌文件: {TOKENS_FILE}")
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"[WARNING] 设计令牌文件未找到: {TOKENS_FILE}。")
-            return {}
-        except json.JSONDecodeError:
-            print(f"[WARNING] 设计令牌文件格式错误。")
-            return {}
-
-    def _preprocess_symbols(self):
-        """预处理 Sketch 数据，建立 symbolID 到语义名称的映射。"""
-        symbol_map = {}
-        pages = self.sketch_data.get("layers", [self.sketch_data])
-        for page in pages:
-            if "layers" not in page:
-                continue
-            for artboard in page["layers"]:
-                if artboard.get("_class") in ["artboard", "symbolMaster"]:
-                    for item in artboard.get("layers", []):
-                        if item.get("_class") == "symbolMaster":
-                            symbol_map[item.get("symbolID")] = item.get("name")
-        print(f"[INFO] 预处理完成，找到 {len(symbol_map)} 个主元件(Symbols)。")
-        return symbol_map
-
-    def convert(self):
-        """执行转换过程并保存输出文件。"""
-        print("开始转换 (语义化模式)...")
+            write_dsl(dsl_output_file, dsl_output, output_format)
+            logger.info("成功！V3.12 版本的 DSL 文件已生成于 %s", dsl_output_file)
+        except IOError as e:
+            self.diagnostics.error("output.write_failed", "无法写入 DSL 文件: %s", e)
+
+        self._write_token_report(report_output_file)
+        return dsl_output
+
+    def build_dsl(self):
+        """
+        执行转换并返回 DSL 根节点，不写出任何文件；找不到可转换的图层时返回 None。
+
+        convert 在此基础上写出 DSL 和令牌报告；需要分别度量转换与序列化开销时（如 memory_profile）直接调用。
+        """
+        logger.debug("开始转换 (语义化模式)...")
         target_layer = self._find_target_layer()
         if not target_layer:
             return None
 
-        dsl_output = self._traverse_layer(target_layer)
-
-        print(f"转换完成，正在写入 DSL 文件: {DSL_OUTPUT_FILE}")
-        try:
-            with open(DSL_OUTPUT_FILE, "w", encoding="utf-8") as f:
-                json.dump(dsl_output, f, ensure_ascii=False, indent=4)
-            print(f"成功！V3.12 版本的 DSL 文件已生成于 {DSL_OUTPUT_FILE}")
-        except IOError as e:
-            print(f"[ERROR] 无法写入 DSL 文件: {e}")
+        # 缓存键需在遍历之前计算，遍历过程会原地排序子图层
+        cache_key = None
+        cached = None
+        # 需要写出完整出现记录时必须真正遍历，不使用缓存
+        if self.cache is not None and TOKEN_OCCURRENCES_FILE is None:
+            # 共享样式可能来自 .sketch 归档的 document.json，不在 sketch_data 中，通过全局指纹参与缓存键
+            cache_key = self.cache.make_key(
+                self.sketch_data, self.tokens.fingerprint, f"{CONVERTER_VERSION}/{self._state_fingerprint()}",
+                source_digest=self.source_digest,
+            )
+            cached = self.cache.get(cache_key)
+
+        if cached is not None:
+            self.diagnostics.info("cache.hit", "命中转换缓存，跳过遍历。")
+            dsl_output = cached["dsl"]
+            self.report = TokenReportCollector.from_dict(cached["report"])
+        else:
+            dsl_output = self.convert_layer(target_layer)
+            if cache_key is not None:
+                self.cache.put(cache_key, {"dsl": dsl_output, "report": self.report.to_dict()})
+        return dsl_output
 
-        self._write_token_report()
+    def convert_layer(self, layer, reset=False):
+        """
+        转换一个起点图层并返回 DSL 根节点：遍历图层树、回填 LLM 布局，结束时输出诊断汇总并记录指标。
+
+        build_dsl 与批量转换（batch_converter）都经由这里转换。reset 为真时先清空上一次转换的
+        报告、诊断和计数，同一个转换器可以依次转换多个画板。
+        """
+        if reset:
+            self.report.reset()
+            self.diagnostics.reset()
+            self._reset_metrics()
+        start = time.perf_counter()
+        dsl_output = self._traverse_layer(layer)
+        metrics.observe_stage("traversal", time.perf_counter() - start)
+        self._resolve_pending_layouts()
+        self.report.close()
+        self.diagnostics.close()
+        self._record_metrics()
         return dsl_output
 
+    def _reset_metrics(self):
+        """
+        清空本次转换的阶段耗时和计数。它们在转换结束时一次性记入 metrics，避免逐节点更新全局指标；
+        批量转换复用同一个转换器，每个画板开始前调用一次。
+        """
+        self._stage_seconds = dict.fromkeys(("symbols", "layout", "tokens"), 0.0)
+        self._layout_decisions = Counter()
+        self._token_lookups = Counter()
+        self._nodes_processed = 0
+
+    def _record_metrics(self):
+        """把本次转换累计的阶段耗时和计数记入 metrics。"""
+        for stage, seconds in self._stage_seconds.items():
+            metrics.observe_stage(stage, seconds)
+        metrics.NODES_PROCESSED.inc(self._nodes_processed)
+        for layout_type, count in self._layout_decisions.items():
+            metrics.LAYOUT_DECISIONS.inc(count, type=layout_type)
+        for (kind, result), count in self._token_lookups.items():
+            metrics.TOKEN_LOOKUPS.inc(count, kind=kind, result=result)
+
+    def _resolve_pending_layouts(self):
+        """并发请求 LLM 解析遍历中收集到的编组，并将结果回填到 DSL 节点。"""
+        if not self._llm_pending:
+            return
+        pending, self._llm_pending = self._llm_pending, []
+        self.diagnostics.info("llm.pending", "共 %d 个编组需要 LLM 判断布局，并发请求中...", len(pending))
+        stats_before = dict(self.llm_resolver.stats)
+        with metrics.STAGE_SECONDS.time(stage="llm"):
+            layouts = self.llm_resolver.resolve([prompt for _, prompt in pending])
+        for outcome, count in self.llm_resolver.stats.items():
+            if count > stats_before.get(outcome, 0):
+                metrics.LLM_CALLS.inc(count - stats_before.get(outcome, 0), outcome=outcome)
+        patched = sum(apply_layout_to_node(node, layout) for (node, _), layout in zip(pending, layouts))
+        self.diagnostics.info("llm.resolved", "LLM 布局回填完成：%d 个编组，统计 %s", patched, self.llm_resolver.stats)
+
     def _find_target_layer(self):
         """从根数据中找到要处理的第一个有效图层（Artboard 或 Group）。"""
         root = self.sketch_data
         if root.get("_class") == "page":
-            print("[INFO] 检测到根节点为 Page，正在查找可处理的画板...")
+            logger.debug("检测到根节点为 Page，正在查找可处理的画板...")
             for layer in root.get("layers", []):
                 if layer.get("_class") in ["artboard", "group"] and layer.get("isVisible", True):
-                    print(f"[INFO] 找到处理起点: '{layer.get('name')}' ({layer.get('_class')})")
+                    self.diagnostics.info("target.found", "找到处理起点: '%s' (%s)", layer.get("name"), layer.get("_class"))
                     return layer
-            print("[ERROR] Page 中未找到任何可见的 Artboard 或 Group。")
+            self.diagnostics.error("target.missing", "Page 中未找到任何可见的 Artboard 或 Group。")
             return None
         return root
 
     def _traverse_layer(self, layer, parent_layout_type="absolute"):
-        """递归遍历图层，将其转换为 DSL 节点。"""
+        """遍历图层树，将其转换为 DSL 节点（显式栈实现，不受递归深度限制）。"""
+        self._root_layout_type = parent_layout_type
+        self._symbol_refs = set()
+        if not self.incremental:
+            dsl_output = walk(layer, self._enter_layer, self._leave_layer)
+        else:
+            self._begin_incremental(layer)
+            dsl_output = walk(layer, self._enter_layer, self._leave_layer)
+            self._finish_incremental(dsl_output)
+        if SYMBOL_INSTANCE_MODE == "ref" and dsl_output is not None:
+            self._attach_symbol_table(dsl_output)
+        return dsl_output
+
+    def _enter_layer(self, layer, parent_node):
+        """前序处理：生成节点、样式和布局，返回待遍历的子图层。"""
         if not layer or not layer.get("isVisible", True):
             return None
+        if parent_node is None:
+            parent_layout_type = self._root_layout_type
+        else:
+            # 子图层的父布局类型即父节点分析得到的布局类型
+            parent_layout_type = parent_node["layout"].get("type")
+
+        if self.incremental:
+            key = (self._subtree_hashes.get(id(layer)), parent_layout_type)
+            if (entry := self._previous_entries.get(key)) is not None:
+                return self._reuse_subtree(key, entry, layer, parent_node)
 
         node = self._create_base_node(layer)
         if not node:
             return None
+        self._nodes_processed += 1
+        if self.incremental:
+            depth = len(self.report.ancestors())
+            self._open_nodes[id(node)] = (key, len(self._report_log), self._node_total, depth)
+            self._recomputed += 1
+            self._node_total += 1
 
         self._apply_styles_to_node(node, layer)
-        self._process_layout_and_children(node, layer, parent_layout_type)
-
-        return node
+        children = self._process_layout_and_children(node, layer, parent_layout_type)
+        if SYMBOL_INSTANCE_MODE != "semantic" and layer.get("_class") == "symbolInstance":
+            self._instantiate_symbol(node, layer)
+        if parent_node is not None:
+            parent_node["children"].append(node)
+        self.report.push(node["name"])
+
+        for hook in self.pre_hooks:
+            hook(node, layer)
+        return node, children
+
+    def _leave_layer(self, layer, node):
+        """后序处理：节点的全部子节点已生成。"""
+        self.report.pop()
+        if self.incremental and (opened := self._open_nodes.pop(id(node), None)):
+            key, report_start, node_start, depth = opened
+            self._entries[key] = (node, report_start, len(self._report_log), self._node_total - node_start, depth)
+        for hook in self.post_hooks:
+            hook(node, layer)
+
+    def _llm_signature(self):
+        """LLM 回退的开关和模型：编组布局可能来自模型的回答，参与缓存键和增量指纹的计算。"""
+        return f"llm:{LLM_MODEL_NAME}" if self.llm_resolver is not None else "llm:off"
+
+    def _symbol_hashes(self):
+        """
+        主元件内容的哈希，只在实例展开为主元件内容（"expand" / "ref"）时需要，"semantic" 模式下返回 None。
+
+        主元件可能来自 .sketch 归档的 document.json 或其他页面而不在 sketch_data 中，
+        其内容需要通过这些哈希参与缓存键和增量哈希的计算。
+        """
+        if SYMBOL_INSTANCE_MODE == "semantic":
+            return None
+        if self._symbol_hash_cache is None:
+            self._symbol_hash_cache = compute_symbol_hashes(self.symbol_masters)
+        return self._symbol_hash_cache
+
+    def _state_fingerprint(self):
+        """
+        影响所有节点的全局输入（令牌、主元件映射与内容、共享样式、版本、LLM 配置）的摘要。
+
+        设计令牌使用注册表加载文件时算好的摘要（CompiledTokens.fingerprint），不必每次重新序列化令牌表。
+        """
+        symbol_hashes = self._symbol_hashes() or {}
+        symbol_digests = {symbol_id: digest.hex() for symbol_id, digest in symbol_hashes.items()}
+        payload = json.dumps(
+            [CONVERTER_VERSION, COLOR_DELTA_E_TOLERANCE, SYMBOL_INSTANCE_MODE, self._llm_signature(),
+             self.tokens.fingerprint, self.symbol_map, symbol_digests, self.index.shared_styles],
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _begin_incremental(self, root_layer):
+        """计算子树哈希并准备上一次转换的复用表。"""
+        self._fingerprint = self._state_fingerprint()
+        self._subtree_hashes = compute_subtree_hashes(root_layer, self._symbol_hashes())
+        previous = self.previous_state
+        if previous is not None and previous.fingerprint != self._fingerprint:
+            self.diagnostics.info("incremental.invalidated", "设计令牌或主元件已变化，本次不复用上一次的转换结果。")
+            previous = None
+        self._previous_entries = previous.entries if previous is not None else {}
+        self._previous_log = previous.report_log if previous is not None else []
+        self._entries = {}
+        self._report_log = []
+        self._open_nodes = {}
+        self._reuse_offsets = {}
+        self._reused = 0
+        self._recomputed = 0
+        self._node_total = 0
+
+    def _reuse_subtree(self, key, entry, layer, parent_node):
+        """直接复用上一次生成的子树，并回放其未知令牌记录。"""
+        node, report_start, report_end, count, previous_depth = entry
+        offset = len(self._report_log) - report_start
+        # 子树可能被移动到了别的位置，记录中的路径前缀替换为当前位置的祖先路径
+        ancestors = self.report.ancestors()
+        for kind, token_key, layer_name, object_id, previous_ancestors in self._previous_log[report_start:report_end]:
+            self._log_unknown(kind, token_key, layer_name, object_id, ancestors + previous_ancestors[previous_depth:])
+        self._entries[key] = (node, report_start + offset, report_end + offset, count, len(ancestors))
+        self._reuse_offsets[id(node)] = offset
+        self._reused += count
+        self._node_total += count
+        if parent_node is not None:
+            parent_node["children"].append(node)
+        self.report.push(node["name"])
+        for hook in self.pre_hooks:
+            hook(node, layer)
+        return node, ()
+
+    def _finish_incremental(self, dsl_output):
+        """汇总统计，并把被复用子树内部的条目一并带入本次状态。"""
+        previous_by_node = {id(entry[0]): (key, entry) for key, entry in self._previous_entries.items()}
+        entries = self._entries
+
+        def enter(node, offset):
+            offset = self._reuse_offsets.get(id(node), offset)
+            if offset is not None and (found := previous_by_node.get(id(node))):
+                key, (prev_node, start, end, count, depth) = found
+                entries.setdefault(key, (prev_node, start + offset, end + offset, count, depth))
+            return offset, node.get("children", ())
+
+        if dsl_output is not None and self._reuse_offsets:
+            walk(dsl_output, enter)
+
+        self.incremental_state = IncrementalState(self._fingerprint, entries, self._report_log)
+        self.incremental_stats = {"reused": self._reused, "recomputed": self._recomputed}
+        self.diagnostics.info("incremental.stats", "增量转换：复用 %d 个节点，重新计算 %d 个节点。",
+                              self._reused, self._recomputed)
+
+    def _compile_symbol(self, symbol_id):
+        """
+        将主元件转换为 DSL，每个主元件只转换一次。
+
+        返回 {"node": DSL 节点, "ids": {do_objectID 路径: 子节点下标路径}, "records": 未知令牌记录}，
+        主元件不存在或存在循环引用时返回 None。
+        """
+        if symbol_id in self.compiled_symbols:
+            return self.compiled_symbols[symbol_id]
+        master = self.symbol_masters.get(symbol_id)
+        if master is None:
+            return None
+        self.compiled_symbols[symbol_id] = None
+        # 嵌套主元件的编译时间已包含在外层主元件的编译时间中
+        outermost = not self._compiling_symbol
+        self._compiling_symbol = True
+        start = time.perf_counter()
+        try:
+            compiled = self._compile_master(master)
+        finally:
+            if outermost:
+                self._compiling_symbol = False
+                self._stage_seconds["symbols"] += time.perf_counter() - start
+        self.compiled_symbols[symbol_id] = compiled
+        return compiled
+
+    def _compile_master(self, master):
+        """转换主元件图层树，返回 _compile_symbol 所述的编译结果。"""
+        object_ids = {}
+        instances = {}
+
+        def enter(layer, parent_node):
+            if parent_node is None:
+                # 主元件本身作为编组处理，不带定位信息
+                node = DSLNode(name=layer.get("name"), type="Group")
+                self._apply_styles_to_node(node, layer)
+                children = self._process_layout_and_children(node, layer, None)
+                self.report.push(node["name"])
+                return node, children
+            result = self._enter_layer(layer, parent_node)
+            if result is not None:
+                object_ids[id(result[0])] = layer.get("do_objectID")
+                if layer.get("_class") == "symbolInstance":
+                    instances[id(result[0])] = layer.get("symbolID")
+            return result
+
+        # 主元件的转换不属于任何子树，不参与增量记录；其未知令牌记录单独保存，由各实例回放
+        saved = (self.incremental, self._symbol_capture)
+        self.incremental = False
+        self._symbol_capture = ([], len(self.report.ancestors()))
+        try:
+            node = walk(master, enter, self._leave_layer)
+            records = self._symbol_capture[0]
+        finally:
+            self.incremental, self._symbol_capture = saved
+
+        ids = {}
+
+        def index(item, path):
+            if (object_id := object_ids.get(id(item))) is not None:
+                ids[object_id] = path
+                nested = self.compiled_symbols.get(instances.get(id(item)))
+                if nested is not None:
+                    # 嵌套实例：覆盖名为 "外层实例ID/内层图层ID"
+                    for nested_id, nested_path in nested["ids"].items():
+                        ids[f"{object_id}/{nested_id}"] = path + nested_path
+                    return path, ()
+            return path, [(child, path + (i,)) for i, child in enumerate(item.get("children", ()))]
+
+        walk((node, ()), lambda item, _: index(*item))
+        return {"node": node, "ids": ids, "records": records}
+
+    def _instantiate_symbol(self, node, layer):
+        """按 SYMBOL_INSTANCE_MODE 用编译好的主元件补全实例节点，并回放主元件内部的未知令牌。"""
+        symbol_id = layer.get("symbolID")
+        compiled = self._compile_symbol(symbol_id)
+        if compiled is None:
+            return
+        patches = {}
+        for override in layer.get("overrideValues") or ():
+            target, _, prop = override.get("overrideName", "").rpartition("_")
+            if prop == "stringValue" and target in compiled["ids"] and "value" in override:
+                patches[target] = override["value"]
+
+        if SYMBOL_INSTANCE_MODE == "ref":
+            node["ref"] = symbol_id
+            if patches:
+                node["overrides"] = {target: {"text": text} for target, text in patches.items()}
+            self._symbol_refs.add(symbol_id)
+        else:
+            master_node = compiled["node"]
+            layout = master_node["layout"].copy()
+            layout.update(node["layout"])
+            node["layout"] = layout
+            node["children"] = _clone_with_patches(
+                master_node["children"], {compiled["ids"][target]: text for target, text in patches.items()}
+            )
+
+        # 主元件内部的记录以实例替换主元件作为路径起点
+        ancestors = self.report.ancestors() + (node["name"],)
+        for kind, token_key, layer_name, object_id, relative in compiled["records"]:
+            if relative:
+                self._log_unknown(kind, token_key, layer_name, object_id, ancestors + relative[1:])
+
+    def _attach_symbol_table(self, dsl_output):
+        """在根节点上附加本次输出引用到的全部主元件 DSL。"""
+        refs = self._symbol_refs
+        if self.incremental_stats and self.incremental_stats["reused"]:
+            # 复用的子树中的引用不会经过 _instantiate_symbol，需要从输出中找出来
+            def enter(node, _):
+                if "ref" in node:
+                    refs.add(node["ref"])
+                return None, node.get("children", ())
+
+            walk(dsl_output, enter)
+        symbols = {}
+        pending = list(refs)
+
+        def collect_nested(node, _):
+            # 主元件中嵌套的实例同样以引用形式输出
+            if "ref" in node:
+                pending.append(node["ref"])
+            return None, node.get("children", ())
+
+        while pending:
+            symbol_id = pending.pop()
+            if symbol_id in symbols or (compiled := self._compile_symbol(symbol_id)) is None:
+                continue
+            symbols[symbol_id] = compiled["node"]
+            walk(compiled["node"], collect_nested)
+        if symbols:
+            dsl_output["symbols"] = symbols
 
     def _create_base_node(self, layer):
         """根据图层类型创建基础 DSL 节点。"""
         layer_class = layer.get("_class")
-        node = {"name": layer.get("name")}
+        node = DSLNode()
+        name = layer.get("name")
+        node.name = intern(name) if isinstance(name, str) else name
 
         if layer_class == "symbolInstance":
             symbol_id = layer.get("symbolID")
             semantic_name = self.symbol_map.get(symbol_id, layer.get("name"))
             parsed_name = parse_semantic_name(semantic_name)
-            node["type"] = parsed_name.get("type", "UnknownComponent")
-            node["variant"] = parsed_name.get("variant")
+            node.type = parsed_name.get("type", "UnknownComponent")
+            node.variant = parsed_name.get("variant")
             if overrides := layer.get("overrideValues"):
                 for override in overrides:
                     if "stringValue" in override and override["stringValue"]:
-                        node["content"] = {"text": override["stringValue"]}
+                        node.content = {"text": override["stringValue"]}
                         break
         elif layer_class == "text":
-            node["type"] = "Text"
-            node["content"] = {"text": layer.get("stringValue")}
+            node.type = "Text"
+            node.content = {"text": layer.get("stringValue")}
         elif layer_class in ["group", "artboard"]:
-            node["type"] = "Group"
+            node.type = "Group"
         elif layer_class in ["oval", "rectangle", "shapePath"]:
-            node["type"] = "Shape"
+            node.type = "Shape"
         else:
             return None
         return node
 
     def _apply_styles_to_node(self, node, layer):
         """将图层样式映射到 DSL 节点的 style 属性。"""
-        dsl_style = {}
-        style = layer.get("style", {})
-        layer_name = layer.get("name", "Unnamed")
+        start = time.perf_counter()
+        lookups = self._token_lookups
+        dsl_style = DSLStyle()
+        style = layer.get("style")
+        if "sharedStyleID" in layer and (shared_style := self.index.shared_style_for(layer)) is not None:
+            # 共享样式的名称即设计系统中的样式名；图层没有内联样式时使用共享样式的值
+            dsl_style.sharedStyle = shared_style.get("name")
+            if style is None:
+                style = shared_style.get("value")
+        style = style or {}
 
         # (此部分逻辑与旧版 map_styles_to_tokens 函数基本相同)
         opacity = style.get("contextSettings", {}).get("opacity", 1.0)
         if opacity < 1.0:
-            dsl_style["opacity"] = opacity
+            dsl_style.opacity = opacity
 
+        tokens = self.tokens
         if (fills := style.get("fills")) and fills and fills[0].get("isEnabled"):
-            hex_color = convert_color_to_hex(fills[0].get("color"))
-            if hex_color:
-                if token := self.token_maps.get("colors", {}).get(hex_color):
-                    dsl_style["backgroundColor"] = token
+            if color := fills[0].get("color"):
+                packed = pack_rgb(color)
+                if token := tokens.color_index.match(packed, COLOR_DELTA_E_TOLERANCE):
+                    dsl_style.backgroundColor = token
+                    lookups["backgroundColor", "hit"] += 1
                 else:
-                    dsl_style["backgroundColor"] = hex_color
-                    self.report["unknown_colors"][hex_color] = self.report["unknown_colors"].get(hex_color, []) + [layer_name]
+                    lookups["backgroundColor", "miss"] += 1
+                    hex_color = intern(packed_to_hex(packed, color))
+                    dsl_style.backgroundColor = hex_color
+                    self._record_unknown("unknown_colors", hex_color, layer)
 
         if text_style := style.get("textStyle"):
             attrs = text_style.get("encodedAttributes", {})
             if color_attr := attrs.get("MSAttributedStringColorAttribute"):
-                hex_color = convert_color_to_hex(color_attr)
-                if hex_color:
-                    if token := self.token_maps.get("textColors", {}).get(hex_color):
-                        dsl_style["textColor"] = token
-                    else:
-                        dsl_style["textColor"] = hex_color
-                        self.report["unknown_textColors"][hex_color] = self.report["unknown_textColors"].get(hex_color, []) + [layer_name]
+                packed = pack_rgb(color_attr)
+                if token := tokens.text_color_index.match(packed, COLOR_DELTA_E_TOLERANCE):
+                    dsl_style.textColor = token
+                    lookups["textColor", "hit"] += 1
+                else:
+                    lookups["textColor", "miss"] += 1
+                    hex_color = intern(packed_to_hex(packed, color_attr))
+                    dsl_style.textColor = hex_color
+                    self._record_unknown("unknown_textColors", hex_color, layer)
             font_attrs = attrs.get("MSAttributedStringFontAttribute", {}).get("attributes", {})
             font_name, font_size = font_attrs.get("name"), font_attrs.get("size")
             if font_name and font_size:
-                font_key = f"{font_name}-{int(font_size)}"
-                if token := self.token_maps.get("fonts", {}).get(font_key):
-                    dsl_style["font"] = token
+                if token := tokens.fonts.get((font_name, int(font_size))):
+                    dsl_style.font = token
+                    lookups["font", "hit"] += 1
                 else:
-                    self.report["unknown_fonts"][font_key] = self.report["unknown_fonts"].get(font_key, []) + [layer_name]
+                    lookups["font", "miss"] += 1
+                    self._record_unknown("unknown_fonts", f"{font_name}-{int(font_size)}", layer)
 
         if (borders := style.get("borders")) and borders and borders[0].get("isEnabled"):
             border = borders[0]
-            dsl_style["borderWidth"] = f'{border.get("thickness", 1)}px'
-            if hex_color := convert_color_to_hex(border.get("color")):
-                if token := self.token_maps.get("borderColors", {}).get(hex_color):
-                    dsl_style["borderColor"] = token
+            dsl_style.borderWidth = f'{_as_number(border.get("thickness", 1), 1)}px'
+            if border_color := border.get("color"):
+                packed = pack_rgb(border_color)
+                if token := tokens.border_color_index.match(packed, COLOR_DELTA_E_TOLERANCE):
+                    dsl_style.borderColor = token
+                    lookups["borderColor", "hit"] += 1
                 else:
-                    dsl_style["borderColor"] = hex_color
-                    self.report["unknown_borderColors"][hex_color] = self.report["unknown_borderColors"].get(hex_color, []) + [layer_name]
+                    lookups["borderColor", "miss"] += 1
+                    hex_color = intern(packed_to_hex(packed, border_color))
+                    dsl_style.borderColor = hex_color
+                    self._record_unknown("unknown_borderColors", hex_color, layer)
 
-        radius = layer.get("fixedRadius", 0)
+        radius = _as_number(layer.get("fixedRadius", 0), 0)
         if not radius and "points" in layer and layer.get("points"):
-            radius = layer["points"][0].get("cornerRadius", 0)
+            radius = _as_number(layer["points"][0].get("cornerRadius", 0), 0)
         if radius > 0:
-            radius_key = str(int(radius))
-            if token := self.token_maps.get("radii", {}).get(radius_key):
-                dsl_style["borderRadius"] = token
+            if token := tokens.radii.get(int(radius)):
+                dsl_style.borderRadius = token
+                lookups["borderRadius", "hit"] += 1
             else:
-                dsl_style["borderRadius"] = f"{radius_key}px"
+                lookups["borderRadius", "miss"] += 1
+                dsl_style.borderRadius = f"{int(radius)}px"
 
         if (shadows := style.get("shadows")) and shadows and shadows[0].get("isEnabled"):
-            dsl_style["shadow"] = "default"
+            dsl_style.shadow = "default"
 
         frame = layer.get("frame", {})
-        dsl_style["width"] = frame.get("width")
-        dsl_style["height"] = frame.get("height")
-        node["style"] = dsl_style
+        dsl_style.width = frame.get("width")
+        dsl_style.height = frame.get("height")
+        node.style = dsl_style
+        self._stage_seconds["tokens"] += time.perf_counter() - start
+
+    def _record_unknown(self, kind, key, layer):
+        """记录一次未匹配到设计令牌的样式值。"""
+        self._log_unknown(kind, key, layer.get("name", "Unnamed"), layer.get("do_objectID"), self.report.ancestors())
+
+    def _log_unknown(self, kind, key, layer_name, object_id, ancestors):
+        if self._symbol_capture is not None:
+            records, base_depth = self._symbol_capture
+            records.append((kind, key, layer_name, object_id, ancestors[base_depth:]))
+            return
+        self.report.record(kind, key, layer_name, object_id, ancestors)
+        if self.incremental:
+            self._report_log.append((kind, key, layer_name, object_id, ancestors))
 
     def _process_layout_and_children(self, node, layer, parent_layout_type):
-        """处理节点的布局和子节点。"""
-        layout = {}
-        children_nodes = []
+        """处理节点的布局，并返回待遍历的子图层。"""
+        layout = DSLLayout()
+        children = []
 
         if node["type"] == "Group" and layer.get("layers"):
             # 优先处理 FreeformGroupLayout
             if layer.get("groupLayout", {}).get("_class") == "MSImmutableFreeformGroupLayout":
-                layout["type"] = "absolute"
-                for child in layer["layers"]:
-                    if child_node := self._traverse_layer(child, parent_layout_type="absolute"):
-                        children_nodes.append(child_node)
+                layout.type = "absolute"
+                self._layout_decisions["freeform"] += 1
             else:
-                # 否则，回退到基于规则的自动布局分析
-                # (此处为简化，未包含复杂的 LLM 混合布局逻辑)
+                # 否则，回退到基于规则的自动布局分析，规则无法确定时记录下来交给 LLM
+                start = time.perf_counter()
                 layout_info = self._analyze_layout_with_rules(layer["layers"])
+                self._stage_seconds["layout"] += time.perf_counter() - start
+                layout_type = layout_info["type"]
+                if "direction" in layout_info:
+                    layout_type = f"{layout_type}-{layout_info['direction']}"
+                self._layout_decisions[layout_type] += 1
                 layout.update(layout_info)
-                for child in layer["layers"]:
-                    if child_node := self._traverse_layer(child, parent_layout_type=layout.get("type")):
-                        children_nodes.append(child_node)
+                if self.llm_resolver is not None and layout_info["type"] == "absolute" and len(layer["layers"]) > 1:
+                    self._llm_pending.append((node, build_layout_prompt(layer["layers"])))
+            children = layer["layers"]
 
         if parent_layout_type == "absolute":
             frame = layer.get("frame", {})
-            layout["position"] = "absolute"
-            layout["top"] = frame.get("y")
-            layout["left"] = frame.get("x")
+            layout.position = "absolute"
+            layout.top = frame.get("y")
+            layout.left = frame.get("x")
 
-        node["layout"] = layout
-        node["children"] = children_nodes
+        node.layout = layout
+        # 叶子节点共用一个空元组，序列化结果仍为 []
+        node.children = [] if children else ()
+        return children
 
     def _calculate_average_gap(self, layers, direction):
         """根据图层列表和方向精确计算平均间距。"""
@@ -289,21 +792,10 @@ class SketchConverter:
         """分析子元素的布局特征。"""
         if not layers or len(layers) < 2:
             return {"type": "absolute"}
-        layers.sort(key=lambda l: (l["frame"]["y"], l["frame"]["x"]))
-
-        rows = defaultdict(list)
-        y_threshold = 10
-        for layer in layers:
-            found_row = False
-            for y_key in list(rows.keys()):
-                if abs(layer["frame"]["y"] - y_key) < y_threshold:
-                    rows[y_key].append(layer)
-                    found_row = True
-                    break
-            if not found_row:
-                rows[layer["frame"]["y"]].append(layer)
-
-        num_rows, items_per_row = len(rows), [len(r) for r in rows.values()]
+        sort_by_position(layers)
+
+        rows = cluster_rows(layers)
+        num_rows, items_per_row = len(rows), [len(r) for _, r in rows]
 
         if num_rows > 1 and len(set(items_per_row)) == 1 and items_per_row[0] > 1:
             return {"type": "grid", "columns": items_per_row[0]}
@@ -313,44 +805,70 @@ class SketchConverter:
             return {"type": "flex", "direction": "row", "gap": gap}
 
         if items_per_row and all(count == 1 for count in items_per_row) and num_rows > 1:
-            x_coords = [l["frame"]["x"] for l in layers]
-            x_threshold = 5
-            x_std_dev = statistics.stdev(x_coords) if len(x_coords) > 1 else 0
-            if x_std_dev <= x_threshold:
+            if is_column_aligned(layers):
                 gap = self._calculate_average_gap(layers, "column")
                 return {"type": "flex", "direction": "column", "gap": gap}
 
-        print("[INFO] 规则分析无法确定布局，回退到 absolute。")
+        # 每个无法确定布局的编组都会走到这里，大型文档中可达数万次，由 diagnostics 聚合限流
+        self.diagnostics.info("layout.fallback_absolute", "规则分析无法确定布局，回退到 absolute（%d 个子图层）。",
+                              len(layers))
         return {"type": "absolute"}
 
-    def _write_token_report(self):
-        """生成关于未知令牌的报告文件。"""
-        if not any(self.report.values()):
-            print("[INFO] 设计系统检查通过，未发现未知令牌。")
-            return
-
-        print(f"[ACTION] 检测到未知令牌，正在生成报告文件: {REPORT_OUTPUT_FILE}")
+    def _write_token_report(self, report_output_file=None):
+        """生成关于未知令牌的报告文件，附带本次转换的诊断汇总。"""
+        report_output_file = report_output_file or REPORT_OUTPUT_FILE
+        report = self.report.summary()
+        if self.report:
+            report["token_stats"] = self.report.stats()
+        if self.incremental_stats is not None:
+            report["incremental"] = self.incremental_stats
+        if self.diagnostics:
+            report["diagnostics"] = self.diagnostics.summary()
+
+        if not self.report:
+            logger.info("设计系统检查通过，未发现未知令牌。")
+            if not report:
+                return
+        else:
+            logger.warning("检测到未知令牌，正在生成报告文件: %s", report_output_file)
         try:
-            with open(REPORT_OUTPUT_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.report, f, ensure_ascii=False, indent=4)
+            with open(report_output_file, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=4)
         except IOError as e:
-            print(f"[ERROR] 无法写入报告文件: {e}")
+            logger.error("无法写入报告文件: %s", e)
 
 
 def main():
     """主函数：加载数据并启动转换器。"""
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    index = DocumentIndex()
     try:
-        with open(INPUT_FILE, "r", encoding="utf-8") as f:
-            sketch_data = json.load(f)
+        sketch_data = load_sketch(INPUT_FILE, index)
     except FileNotFoundError:
-        print(f"[ERROR] 输入文件未找到: {INPUT_FILE}")
+        logger.error("输入文件未找到: %s", INPUT_FILE)
         return
     except json.JSONDecodeError:
-        print(f"[ERROR] 输入文件不是有效的 JSON 格式。")
+        logger.error("输入文件不是有效的 JSON 格式。")
+        return
+    except KeyError as e:
+        logger.error(".sketch 文件不完整: %s", e)
         return
 
-    converter = SketchConverter(sketch_data)
+    cache = ConversionCache() if ENABLE_RESULT_CACHE else None
+    source_digest = file_digest(INPUT_FILE) if cache is not None else None
+    previous_state = IncrementalState.load(INCREMENTAL_STATE_FILE) if ENABLE_INCREMENTAL else None
+    converter = SketchConverter(
+        sketch_data, cache=cache, incremental=ENABLE_INCREMENTAL, previous_state=previous_state, index=index,
+        source_digest=source_digest,
+    )
     converter.convert()
+    if cache is not None:
+        logger.info("转换缓存统计: %s", cache.stats())
+    if converter.incremental_state is not None:
+        try:
+            converter.incremental_state.save(INCREMENTAL_STATE_FILE)
+        except IOError as e:
+            logger.error("无法保存增量转换状态: %s", e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+"""
+基于子树 Merkle 哈希的增量转换支持。
+
+每个图层子树的哈希由其 do_objectID、影响 DSL 结果的字段以及子图层哈希共同决定，
+任意后代发生变化都会使其所有祖先的哈希改变。上一次转换保存的 哈希 → DSL 节点 映射
+可让下一次转换直接复用未变化的子树，只重新处理变化路径上的节点。
+"""
+import hashlib
+import pickle
+
+try:
+    from .traversal import walk
+except ImportError:
+    from traversal import walk
+
+# 参与哈希计算的图层字段，即 SketchConverter 生成 DSL 节点时读取的字段
+MERKLE_FIELDS = (
+    "_class", "name", "isVisible", "frame", "style", "sharedStyleID", "symbolID", "stringValue",
+    "overrideValues", "fixedRadius", "points", "groupLayout",
+)
+
+
+def _hash_layer(layer, child_hashes, symbol_hashes=None):
+    fields = [layer.get("do_objectID")]
+    for field in MERKLE_FIELDS:
+        if field in layer:
+            fields.append(field)
+            fields.append(layer[field])
+    # 图层数据来自 JSON，只含基本类型，repr 对其是确定且无歧义的，且比 JSON 编码更快
+    digest = hashlib.blake2b(repr(fields).encode("utf-8"), digest_size=16)
+    for child_hash in child_hashes:
+        digest.update(child_hash)
+    # 实例展开为主元件内容时，主元件的变化也要使实例的哈希改变
+    if symbol_hashes and (symbol_hash := symbol_hashes.get(layer.get("symbolID"))):
+        digest.update(symbol_hash)
+    return digest.digest()
+
+
+def compute_subtree_hashes(root, symbol_hashes=None):
+    """
+    自底向上计算每个图层子树的结构哈希。
+
+    隐藏图层不会生成 DSL 节点，因此不再向下展开，其哈希只取决于自身字段。
+
+    参数:
+        root (dict): 根图层。
+        symbol_hashes (dict, optional): symbolID → 主元件哈希，会混入对应实例图层的哈希。
+
+    返回:
+        dict: id(layer) → 16 字节哈希。
+    """
+    hashes = {}
+
+    def enter(layer, parent_ctx):
+        if not isinstance(layer, dict):
+            return None
+        children = layer.get("layers") if layer.get("isVisible", True) else None
+        # ctx: (本节点子哈希列表, 父节点子哈希列表)
+        return ([], parent_ctx[0] if parent_ctx is not None else None), children or ()
+
+    def leave(layer, ctx):
+        child_hashes, parent_hashes = ctx
+        layer_hash = _hash_layer(layer, child_hashes, symbol_hashes)
+        hashes[id(layer)] = layer_hash
+        if parent_hashes is not None:
+            parent_hashes.append(layer_hash)
+
+    walk(root, enter, leave)
+    return hashes
+
+
+def compute_symbol_hashes(symbol_masters):
+    """
+    计算每个主元件的哈希，嵌套引用的其他主元件的变化也会传递上来。
+
+    参数:
+        symbol_masters (dict): symbolID → symbolMaster 图层。
+
+    返回:
+        dict: symbolID → 16 字节哈希。
+    """
+    own_hashes = {}
+    references = {}
+    for symbol_id, master in symbol_masters.items():
+        own_hashes[symbol_id] = compute_subtree_hashes(master)[id(master)]
+        nested = set()
+
+        def enter(layer, _):
+            if layer.get("_class") == "symbolInstance":
+                nested.add(layer.get("symbolID"))
+            return None, layer.get("layers") or ()
+
+        walk(master, enter)
+        references[symbol_id] = nested
+
+    symbol_hashes = {}
+    for symbol_id in own_hashes:
+        # 收集可达的全部主元件（含自身），按 symbolID 排序后合并其哈希
+        reachable = {symbol_id}
+        pending = [symbol_id]
+        while pending:
+            for nested_id in references.get(pending.pop(), ()):
+                if nested_id in own_hashes and nested_id not in reachable:
+                    reachable.add(nested_id)
+                    pending.append(nested_id)
+        digest = hashlib.blake2b(digest_size=16)
+        for reachable_id in sorted(reachable):
+            digest.update(own_hashes[reachable_id])
+        symbol_hashes[symbol_id] = digest.digest()
+    return symbol_hashes
+
+
+class IncrementalState:
+    """
+    一次转换留下的增量状态。
+
+    entries 的键为 (子树哈希, 父布局类型)，值为 (DSL 节点, 报告起点, 报告终点, 子树节点数, 子树根的深度)，
+    报告起止点是 report_log 中该子树记录的未知令牌条目区间，复用时据此回放报告。
+    report_log 的条目为 (分类, 样式值, 图层名, do_objectID, 祖先路径)，回放时按子树根的深度替换路径前缀。
+    """
+
+    def __init__(self, fingerprint, entries, report_log):
+        self.fingerprint = fingerprint
+        self.entries = entries
+        self.report_log = report_log
+
+    def save(self, path):
+        """将状态保存到本地文件。"""
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """
+        从本地文件读取状态，文件不存在、损坏或无法还原时返回 None。
+
+        pickle 按模块路径记录类：以脚本方式运行（模块为 incremental）保存的状态在包内
+        （converter.incremental）读取时会找不到模块，反之亦然，这种情况同样视为没有可用的状态。
+        """
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError,
+                TypeError, ValueError):
+            return None
+        return state if isinstance(state, cls) else None
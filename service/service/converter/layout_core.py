@@ -0,0 +1,51 @@
+"""
+布局推断的公共内核，供 SketchConverter 与 tailwind_converter 共用。
+
+同组子图层先按 (y, x) 排序，再一次扫描完成行聚类，整体复杂度为 O(n log n)。
+"""
+import statistics
+
+# 两个图层 y 坐标之差小于该值时视为同一行
+ROW_Y_THRESHOLD = 10
+# 单列布局中 x 坐标标准差不超过该值时视为左对齐
+COLUMN_X_THRESHOLD = 5
+
+
+def sort_by_position(layers):
+    """按 (y, x) 原地排序图层列表。"""
+    layers.sort(key=lambda l: (l["frame"]["y"], l["frame"]["x"]))
+    return layers
+
+
+def cluster_rows(layers, y_threshold=ROW_Y_THRESHOLD):
+    """
+    将已按 (y, x) 排序的图层聚类成行。
+
+    每一行以其首个图层的 y 作为行键。由于输入已排序，且相邻行键至少相差
+    y_threshold，一个图层只可能归入最后一行，因此只需与最后的行键比较，
+    结果与逐行比较所有行键完全一致。
+
+    参数:
+        layers (list): 已按 (y, x) 排序的图层列表。
+        y_threshold (int): 同行判定阈值。
+
+    返回:
+        list: (行键, 该行图层列表) 的列表，按行键升序排列。
+    """
+    rows = []
+    row_y, row = None, None
+    for layer in layers:
+        y = layer["frame"]["y"]
+        if row is not None and abs(y - row_y) < y_threshold:
+            row.append(layer)
+        else:
+            row_y, row = y, [layer]
+            rows.append((row_y, row))
+    return rows
+
+
+def is_column_aligned(layers, x_threshold=COLUMN_X_THRESHOLD):
+    """判断图层的 x 坐标是否足够集中，可视为纵向排列的一列。"""
+    x_coords = [l["frame"]["x"] for l in layers]
+    x_std_dev = statistics.stdev(x_coords) if len(x_coords) > 1 else 0
+    return x_std_dev <= x_threshold
@@ -0,0 +1,185 @@
+"""
+并发、去重并带磁盘缓存的 LLM 布局回退。
+
+规则分析无法确定布局的编组会在遍历时被收集起来，遍历结束后统一并发请求 LLM，
+再把结果回填到对应的 DSL 节点。相同的提示词在同一时刻只会发出一次请求，
+响应按提示词哈希持久化到本地，之后的转换直接命中缓存。
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+
+try:
+    from .diagnostics import Diagnostics
+except ImportError:
+    from diagnostics import Diagnostics
+
+LLM_CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "media", "cache", "llm")
+# 同时进行中的 LLM 请求数上限
+LLM_MAX_CONCURRENCY = 8
+
+LLM_SYSTEM_PROMPT = (
+    "你是一名前端布局专家。给定一个编组内子元素的位置和尺寸（单位 px），"
+    "判断它们最合适的 CSS 布局。只返回一个 JSON 对象，不要包含其他内容，格式为以下之一：\n"
+    '{"type": "flex", "direction": "row" 或 "column", "gap": 数字}\n'
+    '{"type": "grid", "columns": 数字}\n'
+    '{"type": "absolute"}'
+)
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.S)
+
+
+def build_layout_prompt(layers):
+    """根据子图层的 frame 生成提示词，只包含布局判断需要的信息。"""
+    frames = [
+        {
+            "name": layer.get("name"),
+            "x": layer["frame"].get("x"),
+            "y": layer["frame"].get("y"),
+            "width": layer["frame"].get("width"),
+            "height": layer["frame"].get("height"),
+        }
+        for layer in layers
+    ]
+    return json.dumps(frames, ensure_ascii=False, separators=(",", ":"))
+
+
+def parse_layout_response(content):
+    """从 LLM 的回复中解析布局，无法识别时返回 None。"""
+    if not content or not (match := _JSON_OBJECT.search(content)):
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    layout_type = data.get("type")
+    try:
+        if layout_type == "flex" and data.get("direction") in ("row", "column"):
+            return {"type": "flex", "direction": data["direction"], "gap": round(float(data.get("gap") or 0))}
+        if layout_type == "grid" and int(data.get("columns") or 0) > 1:
+            return {"type": "grid", "columns": int(data["columns"])}
+    except (TypeError, ValueError):
+        return None
+    if layout_type == "absolute":
+        return {"type": "absolute"}
+    return None
+
+
+def apply_layout_to_node(node, layout):
+    """将 LLM 给出的布局回填到 DSL 节点，保留节点自身的定位信息。"""
+    if not layout or layout.get("type") == "absolute":
+        return False
+    position = {k: v for k, v in node["layout"].items() if k in ("position", "top", "left")}
+    node["layout"] = {**layout, **position}
+    # 父节点不再是绝对布局，子节点不需要绝对定位
+    for child in node.get("children", []):
+        for key in ("position", "top", "left"):
+            child["layout"].pop(key, None)
+    return True
+
+
+class LLMLayoutResolver:
+    """
+    批量解析编组布局。
+
+    client_factory 返回 openai.AsyncOpenAI 兼容的客户端，可通过 base_url 指向本地的兼容服务进行测试。
+    异步客户端与事件循环绑定，因此每批请求都会创建新的客户端并在结束后关闭。
+    请求失败等事件记录到 diagnostics（diagnostics.Diagnostics）中，服务不可用时不会逐个请求刷屏。
+    """
+
+    def __init__(self, client_factory, model, cache_dir=LLM_CACHE_DIR, max_concurrency=LLM_MAX_CONCURRENCY,
+                 diagnostics=None):
+        self.client_factory = client_factory
+        self.model = model
+        self.cache_dir = cache_dir
+        self.max_concurrency = max_concurrency
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        self.stats = {"requests": 0, "cache_hits": 0, "deduplicated": 0, "errors": 0}
+
+    def _key(self, prompt):
+        return hashlib.sha256(f"{self.model}\n{LLM_SYSTEM_PROMPT}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_cache(self, key):
+        try:
+            with open(self._cache_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)["content"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def _write_cache(self, key, content):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model, "content": content}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except IOError as e:
+            self.diagnostics.warning("llm.cache_write_failed", "无法写入 LLM 缓存: %s", e)
+
+    async def _request(self, client, key, prompt, semaphore):
+        async with semaphore:
+            self.stats["requests"] += 1
+            try:
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": LLM_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt},
+                    ],
+                )
+                content = response.choices[0].message.content
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.diagnostics.warning("llm.request_failed", "LLM 布局请求失败: %s", e)
+                return None
+        self._write_cache(key, content)
+        return content
+
+    async def _resolve_all(self, prompts):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        client = None
+        inflight = {}
+        tasks = []
+        for prompt in prompts:
+            key = self._key(prompt)
+            if key in inflight:
+                self.stats["deduplicated"] += 1
+                tasks.append(inflight[key])
+                continue
+            if (content := self._read_cache(key)) is not None:
+                self.stats["cache_hits"] += 1
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(content)
+            else:
+                client = client or self.client_factory()
+                future = asyncio.ensure_future(self._request(client, key, prompt, semaphore))
+            inflight[key] = future
+            tasks.append(future)
+        try:
+            contents = await asyncio.gather(*tasks)
+        finally:
+            if client is not None:
+                await client.close()
+        return [parse_layout_response(content) for content in contents]
+
+    def resolve(self, prompts):
+        """并发解析一组提示词，按输入顺序返回布局（无法确定时为 None）。"""
+        if not prompts:
+            return []
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._resolve_all(prompts))
+        # 当前线程已有运行中的事件循环（如异步视图），asyncio.run 不能嵌套，改在独立线程的新事件循环中执行
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self._resolve_all(prompts)).result()
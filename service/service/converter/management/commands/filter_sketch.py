@@ -0,0 +1,28 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.sketch_parser import filter_sketch_file, ijson
+from service.settings import MEDIA_ROOT
+
+
+class Command(BaseCommand):
+    help = '过滤一个 Sketch 文件，只保留转换需要的属性并去掉隐藏图层，结果写入 JSON 文件。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sketch_file', help='Sketch JSON 或 .sketch 文件，.sketch 只过滤第一个页面')
+        parser.add_argument('--output', default=str(Path(MEDIA_ROOT, 'sketches', 'output.json')),
+                            help='输出文件，默认为 media/sketches/output.json（tailwind_converter 的输入）')
+        parser.add_argument('--format', dest='output_format', choices=['pretty', 'compact'], default=None,
+                            help='输出格式，默认为 DSL_OUTPUT_FORMAT')
+
+    def handle(self, *args, **options):
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            filter_sketch_file(options['sketch_file'], output, options['output_format'])
+        except FileNotFoundError as e:
+            raise CommandError(f'输入文件未找到: {e}')
+        except (ValueError, KeyError) + ((ijson.JSONError,) if ijson else ()) as e:
+            raise CommandError(f'过滤失败: {e}')
+        self.stdout.write(f'过滤结果已写入 {output}')
@@ -0,0 +1,42 @@
+import contextlib
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.memory_profile import MemoryBudgetExceeded, check_budget, format_report, profile_pipeline
+
+
+class Command(BaseCommand):
+    help = '按转换流水线的各阶段分析一个 Sketch 文件的内存使用（tracemalloc），可设置每节点内存预算。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sketch_file', help='Sketch JSON 或 .sketch 文件')
+        parser.add_argument('--output-dir', help='转换结果的输出目录，默认写入临时目录')
+        parser.add_argument('--top', type=int, default=None, help='每个阶段列出的分配位置数')
+        parser.add_argument('--budget-per-node', type=int, default=None,
+                            help='流水线峰值内存按输出 DSL 节点折算的预算（字节），超出时命令失败')
+        parser.add_argument('--json', dest='json_file', help='同时把完整报告写入该 JSON 文件')
+        parser.add_argument('--verbose-conversion', action='store_true', help='显示转换过程本身的输出')
+
+    def handle(self, *args, **options):
+        quiet = contextlib.nullcontext() if options['verbose_conversion'] else contextlib.redirect_stdout(io.StringIO())
+        try:
+            with quiet:
+                report = profile_pipeline(
+                    options['sketch_file'], options['output_dir'], options['top'], options['budget_per_node']
+                )
+        except FileNotFoundError as e:
+            raise CommandError(f'输入文件未找到: {e}')
+        except (ValueError, KeyError) as e:
+            raise CommandError(f'转换失败: {e}')
+
+        self.stdout.write(format_report(report))
+        if options['json_file']:
+            with open(options['json_file'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=4)
+            self.stdout.write(f'报告已写入 {options["json_file"]}')
+        try:
+            check_budget(report)
+        except MemoryBudgetExceeded as e:
+            raise CommandError(str(e))
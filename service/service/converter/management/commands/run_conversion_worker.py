@@ -0,0 +1,52 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from converter import metrics
+from converter.models import ConversionJob
+
+
+class Command(BaseCommand):
+    help = '启动转换工作进程，从数据库队列中领取并执行转换任务。可启动多个进程提高吞吐量。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前排队的任务后退出')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='队列为空时的轮询间隔（秒）')
+        parser.add_argument('--name', default=f'{socket.gethostname()}:{os.getpid()}', help='工作进程名称')
+
+    def handle(self, *args, **options):
+        worker = options['name']
+        metrics_path = metrics.worker_metrics_path(worker)
+        self.stdout.write(f'转换工作进程已启动: {worker}')
+        try:
+            self._work(worker, metrics_path, options)
+        finally:
+            # 本进程的数值并入已退出进程的累计文件，/metrics 合并出的计数器不会因进程退出而减少
+            metrics.REGISTRY.dump(metrics_path)
+            metrics.retire_worker_metrics(worker)
+
+    def _work(self, worker, metrics_path, options):
+        # 指标写入文件，由 Web 进程的 /metrics 接口合并输出
+        metrics.REGISTRY.dump(metrics_path)
+        last_dump = time.monotonic()
+        while True:
+            close_old_connections()
+            job = ConversionJob.claim_next(worker)
+            if job is None:
+                if options['once']:
+                    break
+                # 空闲时也定期重写，避免文件被 /metrics 当作已退出进程的过期文件删除
+                if time.monotonic() - last_dump >= metrics.METRICS_DUMP_INTERVAL:
+                    metrics.REGISTRY.dump(metrics_path)
+                    last_dump = time.monotonic()
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'开始执行任务 {job.id}')
+            job.run()
+            metrics.REGISTRY.dump(metrics_path)
+            last_dump = time.monotonic()
+            self.stdout.write(f'任务 {job.id} 结束，状态: {job.status}')
@@ -0,0 +1,258 @@
+"""
+转换流水线的分阶段内存分析。
+
+按 pipeline.run_conversion_pipeline 的步骤依次执行各阶段，用 tracemalloc 记录每个阶段的：
+    - peak：阶段执行期间相对阶段开始时的内存峰值增量；
+    - net：阶段结束后仍然保留的内存增量（之后的阶段会继续持有这些对象）；
+    - top_sites：net 增长最多的分配位置（文件:行号）。
+
+阶段依次为 load（load_sketch，同时建立文档索引）、filter（filter_sketch_data，结果随即丢弃，
+只用于对比过滤是否值得）、convert（创建 SketchConverter 并调用 build_dsl）、dump（write_dsl 写出 DSL）、
+columnar（write_columnar）和 html（write_html）。报告中同时给出各阶段按输入图层数和输出 DSL 节点数
+折算的字节数；设置了每节点预算时，整个流水线的峰值超出预算即视为失败。
+
+可以作为库调用（profile_pipeline / check_budget），也可以通过 profile_conversion 管理命令运行。
+tracemalloc 会让执行慢数倍，只用于诊断，不要在工作进程中常开。
+"""
+import gc
+import os
+import tempfile
+import tracemalloc
+
+try:
+    from . import pipeline
+    from .document_index import DocumentIndex
+    from .dsl_columnar import write_columnar
+    from .dsl_to_html import write_html
+    from .dsl_writer import write_dsl
+    from .hybrid_converter_v1 import SketchConverter
+    from .sketch_parser import filter_sketch_data, load_sketch
+    from .traversal import walk
+except ImportError:
+    import pipeline
+    from document_index import DocumentIndex
+    from dsl_columnar import write_columnar
+    from dsl_to_html import write_html
+    from dsl_writer import write_dsl
+    from hybrid_converter_v1 import SketchConverter
+    from sketch_parser import filter_sketch_data, load_sketch
+    from traversal import walk
+
+# --- 配置项 ---
+# tracemalloc 为每次分配保存的调用栈深度，越深越慢
+TRACEMALLOC_FRAMES = 1
+# 每个阶段列出的分配位置数
+TOP_ALLOCATION_SITES = 10
+# 整个流水线的峰值内存按输出 DSL 节点折算的预算（字节/节点），None 表示不检查
+MEMORY_BUDGET_PER_NODE = None
+
+# 分配位置统计中忽略的模块
+_IGNORED_FILES = (tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>",
+                  "<unknown>")
+
+
+class MemoryBudgetExceeded(Exception):
+    """流水线的峰值内存超出了每节点预算。"""
+
+    def __init__(self, report):
+        budget = report["budget"]
+        super().__init__(
+            f"峰值内存 {budget['peak_per_node']:.0f} 字节/节点，超出预算 {budget['per_node']} 字节/节点"
+        )
+        self.report = report
+
+
+def _count_layers(data):
+    """统计输入中的图层数（layers 中的对象）。"""
+    counter = [0]
+
+    def enter(layer, _):
+        counter[0] += 1
+        return None, layer.get("layers") or ()
+
+    if isinstance(data, dict):
+        walk(data, enter)
+    return counter[0]
+
+
+def _count_nodes(dsl):
+    """统计 DSL 节点数，包括 "ref" 模式下根节点 symbols 中的主元件。"""
+    counter = [0]
+
+    def enter(node, _):
+        counter[0] += 1
+        children = list(node.get("children") or ())
+        symbols = node.get("symbols")
+        if symbols:
+            children.extend(symbols.values())
+        return None, children
+
+    if dsl is not None:
+        walk(dsl, enter)
+    return counter[0]
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES]
+    )
+
+
+class _StageProfiler:
+    """依次执行各阶段并记录内存，阶段之间保留的对象由调用方持有。"""
+
+    def __init__(self, top):
+        self.top = top
+        self.stages = []
+
+    def run(self, name, func, *args):
+        gc.collect()
+        before_snapshot = _snapshot()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+        sites = _snapshot().compare_to(before_snapshot, "lineno")[:self.top] if self.top else []
+        self.stages.append({
+            "stage": name,
+            "peak": peak - before,
+            "net": after - before,
+            "top_sites": [
+                {
+                    "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in sites if stat.size_diff
+            ],
+        })
+        return result
+
+
+def profile_pipeline(sketch_path, output_dir=None, top=None, budget_per_node=None):
+    """
+    按转换流水线的步骤分析 sketch_path 的内存使用。
+
+    参数:
+        sketch_path (str or Path): Sketch JSON 或 .sketch 文件。
+        output_dir (str or Path, optional): 输出目录，默认写入临时目录并在结束后删除。
+        top (int, optional): 每个阶段列出的分配位置数，默认为 TOP_ALLOCATION_SITES。
+        budget_per_node (int, optional): 每个输出 DSL 节点的峰值内存预算（字节），默认为 MEMORY_BUDGET_PER_NODE。
+
+    返回:
+        dict: {"input", "layers", "dsl_nodes", "peak", "stages": [...], "budget": {...} 或 None}；
+        超出预算时 budget["exceeded"] 为 True，可交给 check_budget 抛出异常。
+
+    异常:
+        ValueError: 文件中没有可转换的画板或编组。
+    """
+    top = TOP_ALLOCATION_SITES if top is None else top
+    budget_per_node = MEMORY_BUDGET_PER_NODE if budget_per_node is None else budget_per_node
+    if output_dir is None:
+        with tempfile.TemporaryDirectory() as workdir:
+            return profile_pipeline(sketch_path, workdir, top, budget_per_node)
+
+    os.makedirs(output_dir, exist_ok=True)
+    dsl_file = os.path.join(output_dir, pipeline.DSL_FILE_NAME)
+    columnar_file = os.path.join(output_dir, pipeline.COLUMNAR_FILE_NAME)
+    html_file = os.path.join(output_dir, pipeline.HTML_FILE_NAME)
+
+    def filter_and_discard(data):
+        filter_sketch_data(data)
+
+    def build_dsl(sketch_data, index):
+        return SketchConverter(sketch_data, index=index).build_dsl()
+
+    def write_html_file(dsl_output):
+        with open(html_file, "w", encoding="utf-8") as f:
+            write_html(dsl_output, f)
+
+    # 预热：令牌注册表的加载和 LLM 客户端的模块导入是进程级的一次性开销，不计入 convert 阶段
+    SketchConverter({"_class": "page", "layers": []}, index=DocumentIndex())
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        profiler = _StageProfiler(top)
+        index = DocumentIndex()
+        sketch_data = profiler.run("load", load_sketch, sketch_path, index)
+        # 只度量过滤本身，结果随即丢弃（流水线不使用过滤后的数据）
+        profiler.run("filter", filter_and_discard, sketch_data)
+        dsl_output = profiler.run("convert", build_dsl, sketch_data, index)
+        if not dsl_output:
+            raise ValueError("未找到可转换的画板或编组")
+        profiler.run("dump", write_dsl, dsl_file, dsl_output, pipeline.DSL_OUTPUT_FORMAT)
+        profiler.run("columnar", write_columnar, columnar_file, dsl_output)
+        profiler.run("html", write_html_file, dsl_output)
+        # 整个流水线的峰值：各阶段峰值加上之前阶段保留的内存，取最大值
+        # （不直接用 tracemalloc 的全局峰值，分配位置快照本身也会被计入）
+        retained = 0
+        peak = 0
+        for stage in profiler.stages:
+            peak = max(peak, retained + stage["peak"])
+            retained += stage["net"]
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    layers = _count_layers(sketch_data)
+    nodes = _count_nodes(dsl_output)
+    for stage in profiler.stages:
+        stage["peak_per_layer"] = stage["peak"] / layers if layers else None
+        stage["peak_per_node"] = stage["peak"] / nodes if nodes else None
+        stage["net_per_layer"] = stage["net"] / layers if layers else None
+        stage["net_per_node"] = stage["net"] / nodes if nodes else None
+
+    report = {
+        "input": str(sketch_path),
+        "file_size": os.path.getsize(sketch_path),
+        "layers": layers,
+        "dsl_nodes": nodes,
+        "peak": peak,
+        "peak_per_layer": peak / layers if layers else None,
+        "peak_per_node": peak / nodes if nodes else None,
+        "stages": profiler.stages,
+        "budget": None,
+    }
+    if budget_per_node:
+        report["budget"] = {
+            "per_node": budget_per_node,
+            "peak_per_node": report["peak_per_node"],
+            "exceeded": bool(nodes) and report["peak_per_node"] > budget_per_node,
+        }
+    return report
+
+
+def check_budget(report):
+    """报告中的峰值超出每节点预算时抛出 MemoryBudgetExceeded。"""
+    if report.get("budget") and report["budget"]["exceeded"]:
+        raise MemoryBudgetExceeded(report)
+
+
+def format_report(report):
+    """把报告格式化为便于阅读的文本表格。"""
+    lines = [
+        f"输入: {report['input']}（{report['file_size']} 字节，{report['layers']} 个图层，"
+        f"{report['dsl_nodes']} 个 DSL 节点）",
+        f"{'阶段':<10}{'峰值 KiB':>12}{'净增 KiB':>12}{'峰值 B/图层':>14}{'峰值 B/节点':>14}",
+    ]
+    for stage in report["stages"]:
+        lines.append(
+            f"{stage['stage']:<10}{stage['peak'] / 1024:>12.1f}{stage['net'] / 1024:>12.1f}"
+            f"{stage['peak_per_layer'] or 0:>14.0f}{stage['peak_per_node'] or 0:>14.0f}"
+        )
+    lines.append(f"流水线峰值: {report['peak'] / 1024:.1f} KiB（{report['peak_per_node'] or 0:.0f} 字节/节点）")
+    if report["budget"]:
+        state = "超出" if report["budget"]["exceeded"] else "未超出"
+        lines.append(f"预算: {report['budget']['per_node']} 字节/节点，{state}")
+    for stage in report["stages"]:
+        if stage["top_sites"]:
+            lines.append(f"[{stage['stage']}] 保留内存最多的分配位置:")
+            lines.extend(
+                f"    {site['size_diff'] / 1024:>10.1f} KiB  {site['count_diff']:>8} 个  {site['site']}"
+                for site in stage["top_sites"]
+            )
+    return "\n".join(lines)
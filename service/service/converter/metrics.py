@@ -0,0 +1,403 @@
+"""
+转换流程的运行指标（直方图与计数器），以 Prometheus 文本格式输出。
+
+各阶段的耗时记录在 sketch_conversion_stage_seconds 直方图中（按 stage 标签区分）：
+    parse          load_sketch 读取文件
+    filter         filter_sketch_data / stream_filter_sketch
+    symbols        文档索引建立与主元件编译
+    traversal      图层树遍历（包含下面三个阶段）
+    layout         规则布局分析
+    tokens         样式到设计令牌的映射
+    llm            LLM 布局请求
+    serialization  write_dsl 写出 DSL
+    columnar       write_columnar 写出列式 DSL
+    html           write_html 渲染预览页面
+遍历期间逐节点发生的阶段（symbols、layout、tokens）先在转换器内累计，每次转换结束时记录一次，
+直方图的每个样本始终对应一次转换。
+
+转换在 run_conversion_worker 工作进程中执行，而 /metrics 由 Web 进程提供：工作进程每完成一个任务
+（空闲时每隔 METRICS_DUMP_INTERVAL 秒）就把本进程的指标写入 METRICS_DIR 下以进程命名的 JSON 文件，
+/metrics 合并所有文件后输出。工作进程正常退出时、以及超过 METRICS_STALE_SECONDS 没有更新
+（视为进程已异常退出）时，其文件中的数值并入已退出进程的累计文件 EXITED_METRICS_NAME 后删除，
+与 prometheus_client 的多进程模式一样：合并后的计数器不会因工作进程退出或重启而减少，
+Prometheus 不会把它误判为计数器重置。
+批量转换（batch_converter）的进程池子进程把每个画板新增的指标随结果交回父进程合并。
+"""
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# --- 配置项 ---
+METRICS_DIR = os.path.join(os.path.dirname(__file__), "..", "media", "metrics")
+# 工作进程空闲时重写指标文件的间隔（秒），同时表明进程仍在运行
+METRICS_DUMP_INTERVAL = 60
+# 指标文件超过该时长（秒）没有更新即视为进程已退出；需大于单个任务的最长耗时
+METRICS_STALE_SECONDS = 30 * 60
+# METRICS_DIR 中累计已退出工作进程指标的文件，扩展名不是 .json，不会被当作工作进程文件
+EXITED_METRICS_NAME = "exited-workers.state"
+# 合并、并入累计文件时使用的锁文件
+METRICS_LOCK_NAME = ".lock"
+# 阶段耗时直方图的桶上界（秒）
+STAGE_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_local = threading.local()
+
+logger = logging.getLogger("converter")
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """单调递增的计数器，按标签值分别计数。"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def state(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def drain(self):
+        """返回当前状态并清空计数。"""
+        with self._lock:
+            values, self._values = self._values, {}
+        return [[list(key), value] for key, value in values.items()]
+
+    def merge(self, state):
+        with self._lock:
+            for key, value in state:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """按桶累计的直方图，桶计数在输出时转换为 Prometheus 要求的累计值。"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+        # 标签值 → [各桶计数（最后一个为 +Inf）, 总和]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][position] += 1
+            entry[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """计时 with 块并记录一次样本。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return sum(entry[0]) if entry else 0
+
+    def state(self):
+        with self._lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+    def drain(self):
+        """返回当前状态并清空样本。"""
+        with self._lock:
+            values, self._values = self._values, {}
+        return [[list(key), list(counts), total] for key, (counts, total) in values.items()]
+
+    def merge(self, state):
+        with self._lock:
+            for key, counts, total in state:
+                key = tuple(key)
+                if len(counts) != len(self.buckets) + 1:
+                    # 桶配置不同的旧文件无法合并
+                    continue
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+    def render(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """一组指标，可序列化为 JSON 状态在进程之间合并。"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=STAGE_SECONDS_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def state(self):
+        return {name: metric.state() for name, metric in self._metrics.items()}
+
+    def dump(self, path):
+        """把当前进程的指标写入 JSON 文件（原子替换）。"""
+        try:
+            _write_json(path, {"pid": os.getpid(), "metrics": self.state()})
+        except IOError as e:
+            logger.warning("无法写入指标文件: %s", e)
+
+    def drain(self):
+        """返回当前状态并清空所有指标，子进程用它把新增的样本交给父进程 merge。"""
+        return {name: metric.drain() for name, metric in self._metrics.items()}
+
+    def empty_copy(self):
+        """结构相同、数值为空的新注册表。"""
+        registry = MetricsRegistry()
+        for metric in self._metrics.values():
+            if isinstance(metric, Histogram):
+                registry.histogram(metric.name, metric.documentation, metric.labelnames, metric.buckets)
+            else:
+                registry.counter(metric.name, metric.documentation, metric.labelnames)
+        return registry
+
+    def merge(self, state):
+        for name, metric_state in state.items():
+            if (metric := self._metrics.get(name)) is not None:
+                metric.merge(metric_state)
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）。"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "sketch_conversion_stage_seconds", "Duration of each conversion stage in seconds.", ("stage",)
+)
+CONVERSIONS = REGISTRY.counter("sketch_conversions_total", "Finished conversion pipelines by status.", ("status",))
+NODES_PROCESSED = REGISTRY.counter("sketch_conversion_nodes_total", "DSL nodes produced by traversal.")
+LAYOUT_DECISIONS = REGISTRY.counter(
+    "sketch_conversion_layout_decisions_total", "Group layouts chosen during traversal by type.", ("type",)
+)
+TOKEN_LOOKUPS = REGISTRY.counter(
+    "sketch_conversion_token_lookups_total", "Design token lookups by property and result.", ("kind", "result")
+)
+LLM_CALLS = REGISTRY.counter(
+    "sketch_conversion_llm_calls_total", "LLM layout prompts by outcome.", ("outcome",)
+)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def timed(stage):
+    """
+    装饰器：把函数的执行时间记录为 stage 阶段的一次样本。
+
+    同一线程中嵌套或递归调用同一阶段时只记录最外层的调用。
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            active = getattr(_local, "active", None)
+            if active is None:
+                active = _local.active = set()
+            if stage in active:
+                return func(*args, **kwargs)
+            active.add(stage)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                active.discard(stage)
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+        return wrapper
+
+    return decorator
+
+
+def worker_metrics_path(worker, directory=None):
+    """工作进程的指标文件路径。"""
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in worker)
+    return os.path.join(directory or METRICS_DIR, f"{safe_name}.json")
+
+
+def _write_json(path, payload):
+    """原子地写入 JSON 文件，失败时抛出 IOError。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@contextlib.contextmanager
+def _locked(directory):
+    """
+    跨进程互斥地访问 directory 中的指标文件：并入累计文件与 collect 的读取不会交错，
+    一次合并不会既读到某个工作进程的文件又读到已并入该文件的累计值。fcntl 不可用（Windows）时不加锁。
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, METRICS_LOCK_NAME), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _retire(directory, path):
+    """把已退出进程的指标文件并入累计文件后删除，调用方需持有 _locked(directory)。"""
+    try:
+        dumped = _read_json(path)
+    except FileNotFoundError:
+        return
+    except (IOError, json.JSONDecodeError) as e:
+        # 写入中途退出留下的文件无法恢复，直接删除
+        logger.warning("无法读取指标文件 %s，已删除: %s", os.path.basename(path), e)
+        os.remove(path)
+        return
+    exited_path = os.path.join(directory, EXITED_METRICS_NAME)
+    exited = REGISTRY.empty_copy()
+    try:
+        exited.merge(_read_json(exited_path).get("metrics", {}))
+    except FileNotFoundError:
+        pass
+    except (IOError, json.JSONDecodeError) as e:
+        logger.warning("无法读取已退出进程的指标累计文件: %s", e)
+    exited.merge(dumped.get("metrics", {}))
+    try:
+        _write_json(exited_path, {"metrics": exited.state()})
+    except IOError as e:
+        # 保留原文件，下次再并入
+        logger.warning("无法写入已退出进程的指标累计文件: %s", e)
+        return
+    os.remove(path)
+
+
+def retire_worker_metrics(worker, directory=None):
+    """工作进程退出时把自己的指标文件并入已退出进程的累计文件，合并后的计数器不会因此减少。"""
+    directory = directory or METRICS_DIR
+    with _locked(directory):
+        _retire(directory, worker_metrics_path(worker, directory))
+
+
+def collect(directory=None, stale_seconds=METRICS_STALE_SECONDS):
+    """
+    合并当前进程、directory（默认为 METRICS_DIR）中所有工作进程以及已退出进程的指标，返回 Prometheus 文本。
+
+    超过 stale_seconds 秒没有更新的文件属于已异常退出的进程，并入已退出进程的累计文件后删除。
+    """
+    directory = directory or METRICS_DIR
+    cutoff = time.time() - stale_seconds
+    registry = REGISTRY.empty_copy()
+    registry.merge(REGISTRY.state())
+    with _locked(directory):
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    _retire(directory, path)
+                    continue
+                dumped = _read_json(path)
+            except FileNotFoundError:
+                continue
+            except (IOError, json.JSONDecodeError) as e:
+                logger.warning("无法读取指标文件 %s: %s", name, e)
+                continue
+            # 本进程写出的文件已包含在内存中的指标里
+            if dumped.get("pid") != os.getpid():
+                registry.merge(dumped.get("metrics", {}))
+        try:
+            registry.merge(_read_json(os.path.join(directory, EXITED_METRICS_NAME)).get("metrics", {}))
+        except FileNotFoundError:
+            pass
+        except (IOError, json.JSONDecodeError) as e:
+            logger.warning("无法读取已退出进程的指标累计文件: %s", e)
+    return registry.render()
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sketch', '0001_initial'),
+        ('core', '0003_alter_basemodel_creator'),
+        ('converter', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionJob',
+            fields=[
+                ('basemodel_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='core.basemodel')),
+                ('status', models.CharField(choices=[('queued', '排队中'), ('running', '执行中'), ('done', '已完成'), ('failed', '失败')], db_index=True, default='queued', max_length=10)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True)),
+                ('dsl_file', models.CharField(blank=True, max_length=255)),
+                ('html_file', models.CharField(blank=True, max_length=255)),
+                ('started_time', models.DateTimeField(blank=True, null=True)),
+                ('finished_time', models.DateTimeField(blank=True, null=True)),
+                ('source_sketch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversion_jobs', to='sketch.sketch')),
+            ],
+            options={
+                'ordering': ['created_time'],
+            },
+            bases=('core.basemodel',),
+        ),
+    ]
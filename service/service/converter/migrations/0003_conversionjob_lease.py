@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0002_conversionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversionjob',
+            name='heartbeat_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,21 +1,162 @@
-from django.db import models
+from django.db import connection, models
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import os
+import threading
 import uuid
-from .sketch_parser import load_sketch, filter_sketch_data
+from core.models import BaseModel
 from service.settings import MEDIA_ROOT
 from pathlib import Path
-import json
+
+logger = logging.getLogger("converter")
+
+# 执行中的任务每隔 JOB_HEARTBEAT_SECONDS 秒更新一次心跳；心跳超过 JOB_LEASE_SECONDS 秒未更新的任务
+# 视为工作进程已退出（如被 OOM 终止），由下一次 claim_next 重新入队
+JOB_HEARTBEAT_SECONDS = 30
+JOB_LEASE_SECONDS = 300
+# 同一任务最多执行的次数，反复导致工作进程退出的任务不再重试，直接标记为失败
+JOB_MAX_ATTEMPTS = 3
+
+
 # Create your models here.
 class Converter(models.Model):
     project_name = models.CharField(max_length=100)
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    def __init__(self):
-        self.sketch = load_sketch(Path (MEDIA_ROOT, 'sketches/0C46BA71-DAE4-4953-B743-9287F90A179D.json'))
-        self.sketch = filter_sketch_data(self.sketch)
-        with open(Path(MEDIA_ROOT, 'sketches/output.json'), "w", encoding="utf-8") as file:
-            # json.dump() 函数将 Python 对象转换为 JSON 格式并写入文件
-            json.dump(self.sketch, file, ensure_ascii=False, indent=4)
-        print('success')
-        
-
-    
-    
+
+
+class ConversionJob(BaseModel):
+    """
+    数据库队列中的一次转换任务。
+
+    上传 Sketch 文件时入队，由 run_conversion_worker 管理命令启动的工作进程领取并执行。
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, '排队中'),
+        (STATUS_RUNNING, '执行中'),
+        (STATUS_DONE, '已完成'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    # 字段名不能用 sketch：BaseModel 已有指向 Sketch 子表的同名反向关联
+    source_sketch = models.ForeignKey('sketch.Sketch', on_delete=models.CASCADE, related_name='conversion_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    dsl_file = models.CharField(max_length=255, blank=True)
+    html_file = models.CharField(max_length=255, blank=True)
+    started_time = models.DateTimeField(null=True, blank=True)
+    heartbeat_time = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    finished_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_time']
+
+    def __str__(self):
+        return f'{self.source_sketch_id} ({self.status})'
+
+    @classmethod
+    def reclaim_stale(cls, lease_seconds=JOB_LEASE_SECONDS):
+        """
+        处理心跳超时的执行中任务：重新入队，已执行 JOB_MAX_ATTEMPTS 次的标记为失败。
+
+        返回:
+            int: 处理的任务数。
+        """
+        now = timezone.now()
+        stale = cls.objects.filter(status=cls.STATUS_RUNNING, heartbeat_time__lt=now - timedelta(seconds=lease_seconds))
+        failed = stale.filter(attempts__gte=JOB_MAX_ATTEMPTS).update(
+            status=cls.STATUS_FAILED, error=f'工作进程在执行中退出，已尝试 {JOB_MAX_ATTEMPTS} 次', finished_time=now
+        )
+        requeued = stale.filter(attempts__lt=JOB_MAX_ATTEMPTS).update(status=cls.STATUS_QUEUED, worker='')
+        if failed or requeued:
+            logger.warning("回收了 %d 个心跳超时的转换任务（重新入队 %d 个）", failed + requeued, requeued)
+        return failed + requeued
+
+    @classmethod
+    def claim_next(cls, worker):
+        """
+        领取最早入队的任务，领取前先回收心跳超时的任务（见 reclaim_stale）。
+
+        通过带状态条件的 UPDATE 抢占任务，多个工作进程同时领取同一任务时只有一个会成功，
+        不依赖数据库的行锁支持（SQLite 同样适用）。
+        """
+        cls.reclaim_stale()
+        candidates = cls.objects.filter(status=cls.STATUS_QUEUED).order_by('created_time').values_list('pk', flat=True)[:10]
+        for pk in candidates:
+            now = timezone.now()
+            claimed = cls.objects.filter(pk=pk, status=cls.STATUS_QUEUED).update(
+                status=cls.STATUS_RUNNING, worker=worker, started_time=now, heartbeat_time=now,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return cls.objects.get(pk=pk)
+        return None
+
+    @property
+    def queued_seconds(self):
+        """从入队到开始执行的等待时间。"""
+        if not self.started_time:
+            return None
+        return (self.started_time - self.created_time).total_seconds()
+
+    @property
+    def run_seconds(self):
+        """执行耗时。"""
+        if not self.started_time or not self.finished_time:
+            return None
+        return (self.finished_time - self.started_time).total_seconds()
+
+    def _owned(self):
+        """本工作进程仍持有的任务（未被 reclaim_stale 回收）。"""
+        return ConversionJob.objects.filter(pk=self.pk, status=self.STATUS_RUNNING, worker=self.worker)
+
+    def _heartbeat(self, stop):
+        """心跳线程：定期更新 heartbeat_time，直到 stop 被设置。"""
+        try:
+            while not stop.wait(JOB_HEARTBEAT_SECONDS):
+                self._owned().update(heartbeat_time=timezone.now())
+        finally:
+            # 线程中打开的数据库连接不会被请求周期自动关闭
+            connection.close()
+
+    def run(self):
+        """
+        执行转换流水线并记录结果，异常会被记录为失败状态而不会抛出。
+
+        执行期间由后台线程更新心跳；任务已被回收（心跳超时后由其他工作进程重新领取）时不写入结果。
+        """
+        from .pipeline import run_conversion_pipeline
+
+        output_dir = Path(MEDIA_ROOT, 'results', str(self.id))
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop,), daemon=True)
+        heartbeat.start()
+        try:
+            paths = run_conversion_pipeline(
+                self.source_sketch.file.path, output_dir, self.source_sketch.content_hash or None
+            )
+        except Exception as e:
+            self.status = self.STATUS_FAILED
+            self.error = f'{type(e).__name__}: {e}'
+        else:
+            self.status = self.STATUS_DONE
+            self.dsl_file = os.path.relpath(paths['dsl_file'], MEDIA_ROOT)
+            self.html_file = os.path.relpath(paths['html_file'], MEDIA_ROOT)
+        finally:
+            stop.set()
+            heartbeat.join()
+        self.finished_time = timezone.now()
+        updated = self._owned().update(
+            status=self.status, error=self.error, dsl_file=self.dsl_file, html_file=self.html_file,
+            finished_time=self.finished_time, updated_time=self.finished_time,
+        )
+        if not updated:
+            logger.warning("转换任务 %s 已被回收，丢弃本次结果", self.id)
+
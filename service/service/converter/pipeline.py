@@ -0,0 +1,72 @@
+"""
+上传文件的完整转换流水线：Sketch JSON / .sketch 文件 → DSL（JSON 与列式两种格式）→ HTML 预览。
+"""
+import os
+
+try:
+    from .document_index import DocumentIndex
+    from .dsl_columnar import write_columnar
+    from .dsl_to_html import write_html
+    from .hybrid_converter_v1 import ENABLE_RESULT_CACHE, SketchConverter
+    from .metrics import CONVERSIONS
+    from .result_cache import ConversionCache
+    from .sketch_parser import load_sketch
+except ImportError:
+    from document_index import DocumentIndex
+    from dsl_columnar import write_columnar
+    from dsl_to_html import write_html
+    from hybrid_converter_v1 import ENABLE_RESULT_CACHE, SketchConverter
+    from metrics import CONVERSIONS
+    from result_cache import ConversionCache
+    from sketch_parser import load_sketch
+
+# 上传文件的转换结果以紧凑格式 gzip 压缩保存，预览接口通过 dsl_writer.load_dsl 读取
+DSL_FILE_NAME = "dsl.json.gz"
+DSL_OUTPUT_FORMAT = "compact"
+# 列式格式的 DSL，结果接口通过 mmap 按需读取子树，不必解析整个 JSON
+COLUMNAR_FILE_NAME = "dsl.dslc"
+REPORT_FILE_NAME = "token_report.json"
+HTML_FILE_NAME = "preview.html"
+
+
+def run_conversion_pipeline(sketch_path, output_dir, content_hash=None):
+    """
+    转换一个 Sketch JSON 文件，结果写入 output_dir。
+
+    参数:
+        sketch_path (str or Path): 上传的 Sketch JSON 或 .sketch 文件路径，.sketch 文件只解析第一个页面。
+        output_dir (str or Path): 输出目录，不存在时自动创建。
+        content_hash (str, optional): 文件内容的 SHA-256（Sketch.content_hash）。传入时以它作为
+            结果缓存的键，相同内容的文件不再重复转换；未传入时不使用缓存。
+
+    返回:
+        dict: 生成的 DSL（JSON 与列式）、令牌报告和 HTML 文件路径。
+
+    异常:
+        ValueError: 文件中没有可转换的画板或编组。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "dsl_file": os.path.join(output_dir, DSL_FILE_NAME),
+        "columnar_file": os.path.join(output_dir, COLUMNAR_FILE_NAME),
+        "report_file": os.path.join(output_dir, REPORT_FILE_NAME),
+        "html_file": os.path.join(output_dir, HTML_FILE_NAME),
+    }
+
+    try:
+        index = DocumentIndex()
+        sketch_data = load_sketch(sketch_path, index)
+        cache = ConversionCache() if ENABLE_RESULT_CACHE and content_hash else None
+        converter = SketchConverter(sketch_data, cache=cache, index=index, source_digest=content_hash)
+        dsl_output = converter.convert(paths["dsl_file"], paths["report_file"], DSL_OUTPUT_FORMAT)
+        if not dsl_output:
+            raise ValueError("未找到可转换的画板或编组")
+        write_columnar(paths["columnar_file"], dsl_output)
+
+        with open(paths["html_file"], "w", encoding="utf-8") as f:
+            write_html(dsl_output, f)
+    except Exception:
+        CONVERSIONS.inc(status="failed")
+        raise
+    CONVERSIONS.inc(status="done")
+    return paths
@@ -0,0 +1,133 @@
+"""
+SketchConverter 转换结果的内容寻址缓存。
+
+缓存键由输入、设计令牌和转换器版本共同计算得到，任何一项变化都会产生新的键。
+输入读取自文件时以文件内容的摘要代表输入，不必序列化整棵图层树；只有内存中的输入才对树本身计算摘要。
+条目以 JSON 文件存放在 MEDIA_ROOT 下，按总大小做 LRU 淘汰（以文件 mtime 作为最近使用时间）。
+"""
+import hashlib
+import json
+import logging
+import os
+
+try:
+    from .dsl_writer import load_dsl, write_dsl
+except ImportError:
+    from dsl_writer import load_dsl, write_dsl
+
+logger = logging.getLogger("converter")
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "media", "cache", "dsl")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _json_bytes(obj):
+    """规范化的 JSON 编码：键排序、无多余空白，内容相同的对象总是得到相同的字节。"""
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """逐块计算文件内容的 SHA-256，作为 ConversionCache.make_key 的 source_digest。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """基于本地磁盘的转换结果缓存，带大小上限的 LRU 淘汰和命中统计。"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(sketch_data, token_maps, version, source_digest=None):
+        """
+        计算输入、设计令牌（令牌表或其摘要）和转换器版本的 SHA-256 摘要。
+
+        输入读取自文件时传入文件内容的摘要 source_digest（如 Sketch.content_hash 或 file_digest 的结果），
+        此时不会序列化 sketch_data；未传入时对整棵图层树做规范化 JSON 编码后参与摘要。
+        """
+        if source_digest:
+            source = b"file:" + source_digest.encode("utf-8")
+        else:
+            source = b"tree:" + _json_bytes(sketch_data)
+        digest = hashlib.sha256()
+        for chunk in (_json_bytes(version), _json_bytes(token_maps), source):
+            # 写入长度前缀，避免不同分段拼接出相同的字节流
+            digest.update(len(chunk).to_bytes(8, "big"))
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """读取缓存条目，未命中时返回 None。"""
+        path = self._path(key)
+        try:
+            value = load_dsl(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            # 更新 mtime，作为 LRU 的最近使用时间
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """写入缓存条目，并在超出容量时淘汰最久未使用的条目。"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            write_dsl(tmp_path, value, "compact")
+            os.replace(tmp_path, path)
+        except IOError as e:
+            logger.warning("无法写入转换缓存: %s", e)
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        """返回命中统计和当前占用。"""
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
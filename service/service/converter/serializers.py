@@ -0,0 +1,13 @@
+from rest_framework import serializers
+from .models import ConversionJob
+
+
+class ConversionJobSerializer(serializers.ModelSerializer):
+    queued_seconds = serializers.ReadOnlyField()
+    run_seconds = serializers.ReadOnlyField()
+
+    class Meta:
+        model = ConversionJob
+        fields = ['id', 'source_sketch', 'status', 'worker', 'error', 'dsl_file', 'html_file',
+                  'created_time', 'started_time', 'finished_time', 'queued_seconds', 'run_seconds']
+        read_only_fields = fields
@@ -0,0 +1,193 @@
+"""
+.sketch 文件（zip 归档）的按需读取。
+
+.sketch 文件包含：
+    - document.json：页面引用、共享样式、外部库主元件；
+    - meta.json：页面与画板的名称目录（pagesAndArtboards）；
+    - pages/<页面 ID>.json：各页面的图层树。
+
+列出页面和画板只读取 meta.json；只有实际请求的页面（或画板所在的页面）才会被解压和解析，
+转换 60 页文档中的一个画板时不会解析其余 59 页。本地主元件可以放在任意页面（通常是 Symbols 页面，
+但页面可能被改名或本地化），建立文档索引时会逐页扫描顶层图层，只登记其中的主元件，
+使其他页面中的元件实例可以找到主元件。
+"""
+import json
+import zipfile
+
+try:
+    from .document_index import DocumentIndex
+except ImportError:
+    from document_index import DocumentIndex
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def is_sketch_archive(path):
+    """判断文件是否为 .sketch 归档（按 zip 文件头判断，不依赖扩展名）。"""
+    return zipfile.is_zipfile(path)
+
+
+class SketchArchive:
+    """以只读方式打开的 .sketch 文件，页面在首次请求时才解析。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self._meta = None
+        self._document = None
+        # 已解析的页面，再次请求时不必重新解析
+        self._pages = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def _read_json(self, name, index=None):
+        with self._zip.open(name) as f:
+            return json.load(f, object_hook=index.add if index is not None else None)
+
+    @property
+    def meta(self):
+        """meta.json 的内容。"""
+        if self._meta is None:
+            self._meta = self._read_json("meta.json")
+        return self._meta
+
+    @property
+    def document(self):
+        """document.json 的内容。"""
+        if self._document is None:
+            self._document = self._read_json("document.json")
+        return self._document
+
+    # --- 目录 ---
+    def pages(self):
+        """
+        按文档顺序列出页面及其画板，只读取 meta.json。
+
+        返回:
+            list: [{"id": 页面 ID, "name": 页面名称, "artboards": [{"id": 画板 ID, "name": 画板名称}, ...]}, ...]
+        """
+        return [
+            {
+                "id": page_id,
+                "name": entry.get("name"),
+                "artboards": [
+                    {"id": artboard_id, "name": artboard.get("name")}
+                    for artboard_id, artboard in entry.get("artboards", {}).items()
+                ],
+            }
+            for page_id, entry in self.meta.get("pagesAndArtboards", {}).items()
+        ]
+
+    def page_id(self, page):
+        """按页面 ID 或名称查找页面 ID，找不到时抛出 KeyError。"""
+        catalog = self.meta.get("pagesAndArtboards", {})
+        if page in catalog:
+            return page
+        for page_id, entry in catalog.items():
+            if entry.get("name") == page:
+                return page_id
+        raise KeyError(f"文档中没有页面: {page}")
+
+    def page_of_artboard(self, artboard_id):
+        """返回画板所在的页面 ID，找不到时抛出 KeyError。"""
+        for page_id, entry in self.meta.get("pagesAndArtboards", {}).items():
+            if artboard_id in entry.get("artboards", {}):
+                return page_id
+        raise KeyError(f"文档中没有画板: {artboard_id}")
+
+    # --- 按需解析 ---
+    def open_page(self, page):
+        """以二进制流打开页面 JSON 而不解析，供增量解析使用。"""
+        return self._zip.open(f"pages/{self.page_id(page)}.json")
+
+    def load_page(self, page, index=None):
+        """解析单个页面（页面 ID 或名称）；传入 DocumentIndex 时同时登记其中的对象。"""
+        page_id = self.page_id(page)
+        data = self._pages.get(page_id)
+        if data is None:
+            data = self._pages[page_id] = self._read_json(f"pages/{page_id}.json", index)
+        elif index is not None:
+            index.add_tree(data)
+        return data
+
+    def _iter_layers(self, page_id):
+        """
+        逐个产出页面的顶层图层。
+
+        页面已解析过时直接取其图层；否则安装了 ijson 时增量解析，每个图层处理完即可丢弃，
+        不会同时驻留内存；未安装时解析整个页面（不缓存）。
+        """
+        data = self._pages.get(page_id)
+        if data is not None:
+            yield from data.get("layers", [])
+            return
+        with self.open_page(page_id) as f:
+            if ijson is not None:
+                yield from ijson.items(f, "layers.item", use_float=True)
+            else:
+                yield from json.load(f).get("layers", [])
+
+    def load_artboard(self, artboard_id, index=None):
+        """只取出页面中的一个画板，其余顶层图层解析后即丢弃（见 _iter_layers）。"""
+        page_id = self.page_of_artboard(artboard_id)
+        for layer in self._iter_layers(page_id):
+            if layer.get("do_objectID") == artboard_id:
+                if index is not None:
+                    index.add_tree(layer)
+                return layer
+        raise KeyError(f"页面 {page_id} 中没有画板: {artboard_id}")
+
+    def build_index(self, index=None):
+        """
+        建立（或补充）文档索引：document.json 中的共享样式和外部库主元件，以及所有页面中的本地主元件。
+
+        主元件总是页面的顶层图层，逐页扫描顶层图层即可找到，不依赖页面名称；画板等其他图层不登记。
+        """
+        if index is None:
+            index = DocumentIndex()
+        index.add_tree(self.document)
+        for page in self.pages():
+            for layer in self._iter_layers(page["id"]):
+                if layer.get("_class") == "symbolMaster":
+                    index.add_tree(layer)
+        return index
+
+    def load(self, page=None, artboard=None, index=None):
+        """
+        读取转换的起点：指定画板时返回该画板，否则返回指定页面（默认为第一个页面）。
+
+        传入 DocumentIndex 时会同时登记 document.json 中的共享样式与各页面中的主元件。
+        """
+        if index is not None:
+            self.build_index(index)
+        if artboard is not None:
+            return self.load_artboard(artboard, index)
+        if page is None:
+            pages = self.pages()
+            if not pages:
+                raise KeyError("文档中没有页面")
+            page = pages[0]["id"]
+        return self.load_page(page, index)
+
+    def load_document(self, pages=None, index=None):
+        """
+        读取多个页面，组成与 batch_converter.iter_pages 兼容的文档结构 {"_class": "document", "pages": [...]}。
+
+        参数:
+            pages (list, optional): 页面 ID 或名称列表，默认为全部页面。
+            index (DocumentIndex, optional): 同时登记主元件和共享样式的索引。
+        """
+        if index is not None:
+            self.build_index(index)
+        if pages is None:
+            pages = [page["id"] for page in self.pages()]
+        return {"_class": "document", "pages": [self.load_page(page, index) for page in pages]}
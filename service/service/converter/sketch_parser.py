@@ -1,11 +1,46 @@
 import json
+import logging
 from typing import Dict, Any
 
-def load_sketch(sketch_file):
+try:
+    from .dsl_writer import write_dsl
+    from .metrics import timed
+    from .sketch_archive import SketchArchive, is_sketch_archive
+except ImportError:
+    from dsl_writer import write_dsl
+    from metrics import timed
+    from sketch_archive import SketchArchive, is_sketch_archive
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger("converter")
+
+# 需要保留在最终输出中的键
+KEYS_TO_KEEP = {'_class', 'name', 'frame', 'rotation', 'layers', 'style', 'do_objectID'}
+# 在 'frame' 字典中需要保留的键
+FRAME_KEYS_TO_KEEP = {'height', 'width', 'x', 'y'}
+# 包含需要递归过滤的列表的键
+LIST_KEYS = {'layers'}
+
+@timed("parse")
+def load_sketch(sketch_file, index=None, page=None, artboard=None):
+    """
+    读取 Sketch JSON 文件或 .sketch 归档；传入 DocumentIndex 时在解析的同时建立文档索引。
+
+    .sketch 归档只解析一个页面（page 指定，默认为第一个页面）或 artboard 指定的画板，
+    主元件和共享样式通过索引从 document.json 与各页面的顶层主元件中查找，因此读取归档时应传入 index。
+    """
+    if is_sketch_archive(sketch_file):
+        with SketchArchive(sketch_file) as archive:
+            return archive.load(page, artboard, index)
     with open(sketch_file, 'r') as f:
         sketch = f.read()
-    return json.loads(sketch)
+    return json.loads(sketch, object_hook=index.add if index is not None else None)
 
+@timed("filter")
 def filter_sketch_data(data):
     """
     递归地过滤 Sketch JSON 字典，只保留必要的属性。
@@ -20,18 +55,15 @@ def filter_sketch_data(data):
     返回:
         dict or list: 包含过滤后数据的新字典或列表。
     """
-    # 需要保留在最终输出中的键
-    keys_to_keep = {'_class', 'name', 'frame', 'rotation', 'layers', 'style', 'do_objectID'}
-    # 在 'frame' 字典中需要保留的键
-    frame_keys_to_keep = {'height', 'width', 'x', 'y'}
-    # 包含需要递归过滤的列表的键
-    list_keys = {'layers'}
+    return _filter_sketch_data(data)
+
 
+def _filter_sketch_data(data):
     # 如果数据是列表，则处理列表中的每个项目
     if isinstance(data, list):
         filtered_list = []
         for item in data:
-            result = filter_sketch_data(item)
+            result = _filter_sketch_data(item)
             # 如果过滤结果不为空，则添加到列表中
             if result:
                 filtered_list.append(result)
@@ -49,17 +81,17 @@ def filter_sketch_data(data):
                 # 特殊处理 'style' 字段，递归保留其所有内容
                 filtered_dict[key] = value
             # 过滤顶层键
-            elif key in keys_to_keep:
+            elif key in KEYS_TO_KEEP:
                 if key == 'frame' and isinstance(value, dict):
                     # 过滤 'frame' 字典，只保留指定的键
-                    filtered_frame = {k: v for k, v in value.items() if k in frame_keys_to_keep}
+                    filtered_frame = {k: v for k, v in value.items() if k in FRAME_KEYS_TO_KEEP}
                     filtered_dict[key] = filtered_frame
-                elif key in list_keys and isinstance(value, list):
+                elif key in LIST_KEYS and isinstance(value, list):
                     # 递归过滤图层列表
-                    filtered_dict[key] = filter_sketch_data(value)
+                    filtered_dict[key] = _filter_sketch_data(value)
                 elif isinstance(value, dict):
                     # 递归过滤其他嵌套的字典
-                    filtered_dict[key] = filter_sketch_data(value)
+                    filtered_dict[key] = _filter_sketch_data(value)
                 elif key == 'do_objectID':
                     filtered_dict['id'] = value
                 else:
@@ -70,3 +102,168 @@ def filter_sketch_data(data):
         # 对于非字典/列表类型，按原样返回其值
         return data
 
+
+
+# --- 流式过滤 ---
+# 事件驱动构建时栈帧的几种模式
+_FILTER_DICT = 0   # 按白名单过滤的字典
+_FILTER_LIST = 1   # 递归过滤的列表，空结果会被丢弃
+_FRAME_DICT = 2    # 'frame' 字典，只保留坐标与尺寸
+_RAW = 3           # 原样保留（如 'style'）
+_SKIP = 4          # 丢弃的子树，只计数不构建
+
+_DROP = object()
+
+
+def _child_mode(mode, key, event):
+    """根据父容器模式、键和值的起始事件，决定值的处理方式及写入的键。"""
+    is_map = event == 'start_map'
+    is_array = event == 'start_array'
+    if mode == _FILTER_DICT:
+        if key == 'style':
+            return _RAW, key
+        if key not in KEYS_TO_KEEP:
+            return _DROP, None
+        if key == 'frame' and is_map:
+            return _FRAME_DICT, key
+        if key in LIST_KEYS and is_array:
+            return _FILTER_LIST, key
+        if is_map:
+            return _FILTER_DICT, key
+        if key == 'do_objectID':
+            return _RAW, 'id'
+        return _RAW, key
+    if mode == _FILTER_LIST:
+        if is_map:
+            return _FILTER_DICT, None
+        if is_array:
+            return _FILTER_LIST, None
+        return _RAW, None
+    if mode == _FRAME_DICT and key not in FRAME_KEYS_TO_KEEP:
+        return _DROP, None
+    return _RAW, key
+
+
+def filter_sketch_events(events):
+    """
+    基于增量解析事件流构建过滤后的 Sketch 数据，结果与 filter_sketch_data 一致。
+
+    事件格式与 ijson.basic_parse 相同，即 (event, value) 二元组。
+    被丢弃的键和隐藏的子树只做层级计数，不会被构建成 Python 对象，
+    因此峰值内存只与树的深度和最终保留的数据有关，而与文件大小无关。
+
+    参数:
+        events (iterable): (event, value) 事件序列。
+
+    返回:
+        dict or list: 过滤后的数据。
+    """
+    root = None
+    # 每个栈帧为 [mode, container, key]；_SKIP 帧的 container 为嵌套深度，
+    # key 为子树结束时交给父容器的值（_DROP 表示不写入）
+    stack = []
+
+    for event, value in events:
+        top = stack[-1] if stack else None
+
+        if top is not None and top[0] == _SKIP:
+            if event == 'start_map' or event == 'start_array':
+                top[1] += 1
+                continue
+            if event == 'end_map' or event == 'end_array':
+                top[1] -= 1
+                if top[1] > 0:
+                    continue
+                stack.pop()
+                result = top[2]
+                if result is _DROP:
+                    continue
+                value, top = result, (stack[-1] if stack else None)
+            else:
+                continue
+        elif event == 'map_key':
+            top[2] = value
+            continue
+        elif event == 'end_map' or event == 'end_array':
+            stack.pop()
+            value, top = top[1], (stack[-1] if stack else None)
+        elif top is not None:
+            mode, key = top[0], top[2]
+            if mode == _FILTER_DICT and key == 'isVisible' and event not in ('start_map', 'start_array') and not value:
+                # 隐藏对象：丢弃已构建的部分，剩余内容只计数，结束时交出空字典
+                top[0], top[1], top[2] = _SKIP, 1, {}
+                continue
+            child_mode, dest = _child_mode(mode, key, event)
+            if child_mode is _DROP:
+                if event == 'start_map' or event == 'start_array':
+                    stack.append([_SKIP, 1, _DROP])
+                continue
+            if mode != _FILTER_LIST:
+                top[2] = dest
+            if event == 'start_map':
+                stack.append([child_mode, {}, None])
+                continue
+            if event == 'start_array':
+                stack.append([child_mode, [], None])
+                continue
+        elif event == 'start_map':
+            stack.append([_FILTER_DICT, {}, None])
+            continue
+        elif event == 'start_array':
+            stack.append([_FILTER_LIST, [], None])
+            continue
+
+        # 将已完成的值交给父容器
+        if top is None:
+            root = value
+        elif isinstance(top[1], list):
+            if value or top[0] != _FILTER_LIST:
+                top[1].append(value)
+        else:
+            top[1][top[2]] = value
+
+    return root
+
+
+@timed("filter")
+def stream_filter_sketch(sketch_file):
+    """
+    以流式方式读取并过滤 Sketch JSON 文件，避免整份文件及其副本同时驻留内存。
+
+    需要安装 'ijson' 库；未安装时回退到 load_sketch + filter_sketch_data。
+
+    参数:
+        sketch_file (str or Path): Sketch JSON 文件或 .sketch 归档路径，归档只过滤第一个页面。
+
+    返回:
+        dict or list: 过滤后的数据。
+    """
+    if ijson is None:
+        logger.warning("未安装 'ijson' 库，回退到整体加载模式。")
+        return filter_sketch_data(load_sketch(sketch_file))
+    if is_sketch_archive(sketch_file):
+        with SketchArchive(sketch_file) as archive:
+            pages = archive.pages()
+            if not pages:
+                return {}
+            with archive.open_page(pages[0]["id"]) as f:
+                return filter_sketch_events(ijson.basic_parse(f, use_float=True))
+    with open(sketch_file, 'rb') as f:
+        return filter_sketch_events(ijson.basic_parse(f, use_float=True))
+
+
+def filter_sketch_file(sketch_file, output_file, output_format=None):
+    """
+    过滤 Sketch 文件并把结果写入 output_file（例如作为 tailwind_converter 的输入）。
+
+    参数:
+        sketch_file (str or Path): Sketch JSON 文件或 .sketch 归档路径，归档只过滤第一个页面。
+        output_file (str or Path): 输出路径，后缀为 .gz / .zst 时自动压缩。
+        output_format (str, optional): "pretty" 或 "compact"，默认为 dsl_writer.DSL_OUTPUT_FORMAT。
+
+    返回:
+        dict or list: 过滤后的数据。
+    """
+    data = stream_filter_sketch(sketch_file)
+    write_dsl(output_file, data, output_format)
+    return data
@@ -0,0 +1,254 @@
+"""
+合成 Sketch 文档生成器。
+
+按参数生成结构确定的 Sketch 页面 JSON，用于基准测试和在没有真实设计稿时调试转换流程：
+    - depth / fan_out：编组的层数和每个编组的子图层数，图层总数为 1 + fan_out + ... + fan_out^depth；
+    - symbol_ratio / text_ratio：叶子图层中主元件实例和文本的比例，其余为形状和位图；
+    - hidden_ratio：隐藏图层（isVisible 为 False）的比例；
+    - pattern_weights：编组内子图层排列方式（行、列、网格、自由摆放）的权重，决定布局分析走哪条分支。
+
+相同的参数和 seed 总是生成相同的文档（包括 do_objectID），不同提交之间的基准结果可以直接比较。
+"""
+import json
+import os
+import random
+import uuid
+
+# --- 配置项 ---
+OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "..", "media", "sketches", "synthetic.json")
+DEFAULT_DEPTH = 4
+DEFAULT_FAN_OUT = 5
+DEFAULT_SYMBOL_RATIO = 0.1
+DEFAULT_TEXT_RATIO = 0.3
+DEFAULT_HIDDEN_RATIO = 0.05
+# 编组内子图层的排列方式及其权重
+DEFAULT_PATTERN_WEIGHTS = {"row": 3, "column": 3, "grid": 2, "free": 1}
+# 文档中主元件（symbolMaster）的数量
+DEFAULT_SYMBOL_COUNT = 4
+
+# 颜色取自 design_tokens.json 中的颜色和若干不在令牌表中的颜色，两类匹配路径都会走到
+_COLORS = (
+    (1.0, 1.0, 1.0), (0.0, 0.0, 0.0), (0.2901960784313726, 0.5647058823529412, 0.8862745098039215),
+    (0.9607843137254902, 0.9607843137254902, 0.9607843137254902), (0.5, 0.3, 0.3), (0.3, 0.6, 0.3),
+)
+_FONTS = (("PingFangSC-Regular", 14), ("PingFangSC-Regular", 16), ("PingFangSC-Semibold", 32), ("Helvetica", 18))
+_SHAPE_CLASSES = ("rectangle", "oval", "shapePath", "bitmap")
+_LAYER_NAMES = ("card", "row", "item", "图标", "标题", "container")
+_TEXTS = ("确定", "取消", "Hello", "商品名称", "¥ 99.00", "")
+# 每个主元件的图层数：主元件本身、背景和文本
+_SYMBOL_MASTER_LAYERS = 3
+# 子图层的间距和尺寸
+_CELL_WIDTH = 120
+_CELL_HEIGHT = 40
+_GAP = 16
+
+
+class SyntheticSketchGenerator:
+    """
+    合成文档生成器，参数见模块说明。
+
+    示例:
+        page = SyntheticSketchGenerator(depth=3, fan_out=4, seed=1).page()
+    """
+
+    def __init__(self, depth=DEFAULT_DEPTH, fan_out=DEFAULT_FAN_OUT, symbol_ratio=DEFAULT_SYMBOL_RATIO,
+                 text_ratio=DEFAULT_TEXT_RATIO, hidden_ratio=DEFAULT_HIDDEN_RATIO, pattern_weights=None,
+                 symbol_count=DEFAULT_SYMBOL_COUNT, seed=0):
+        if depth < 0 or fan_out < 1:
+            raise ValueError("depth 不能为负数，fan_out 至少为 1")
+        if symbol_ratio + text_ratio > 1:
+            raise ValueError("symbol_ratio 与 text_ratio 之和不能超过 1")
+        self.depth = depth
+        self.fan_out = fan_out
+        self.symbol_ratio = symbol_ratio
+        self.text_ratio = text_ratio
+        self.hidden_ratio = hidden_ratio
+        weights = pattern_weights or DEFAULT_PATTERN_WEIGHTS
+        self.patterns = list(weights)
+        self.pattern_weights = [weights[pattern] for pattern in self.patterns]
+        self.symbol_count = symbol_count if symbol_ratio > 0 else 0
+        self.seed = seed
+
+    def layer_count(self, artboards=1):
+        """生成的画板中的图层总数（含画板本身和隐藏图层，不含主元件）。"""
+        per_artboard = sum(self.fan_out ** level for level in range(self.depth + 1))
+        return per_artboard * artboards
+
+    def page_layer_count(self, artboards=1):
+        """page() 生成的页面中的图层总数：画板中的图层加上页面末尾的主元件（不含页面本身）。"""
+        return self.layer_count(artboards) + self.symbol_count * _SYMBOL_MASTER_LAYERS
+
+    # --- 生成 ---
+    def page(self, artboards=1, name="Page 1"):
+        """
+        生成一个页面：artboards 个画板，后面跟着文档的主元件。
+
+        主元件放在页面末尾而不是单独的 Symbols 页面，单个页面 JSON 即可完整地转换。
+        """
+        rng = random.Random(self.seed)
+        # (主元件 id, 主元件内文本图层 id)：实例的 overrideValues 需要引用文本图层的 do_objectID
+        symbols = [(self._object_id(rng), self._object_id(rng)) for _ in range(self.symbol_count)]
+        layers = [self._artboard(rng, index, symbols) for index in range(artboards)]
+        layers.extend(self._symbol_master(rng, index, *symbol) for index, symbol in enumerate(symbols))
+        return {
+            "_class": "page",
+            "do_objectID": self._object_id(rng),
+            "name": name,
+            "isVisible": True,
+            "frame": self._frame(0, 0, 0, 0),
+            "layers": layers,
+        }
+
+    def _artboard(self, rng, index, symbols):
+        width, height = self._group_size(self.depth)
+        artboard = self._base_layer(rng, "artboard", f"Artboard {index + 1}", index * (width + 100), 0, width, height)
+        # 转换的起点是第一个可见画板，画板本身总是可见
+        artboard["isVisible"] = True
+        # depth 为 0 时画板没有子图层，与 layer_count 一致
+        artboard["layers"] = self._children(rng, self.depth, symbols) if self.depth > 0 else []
+        return artboard
+
+    def _symbol_master(self, rng, index, symbol_id, label_id):
+        master = self._base_layer(rng, "symbolMaster", f"component/button/primary/{index}", 0, -200, 160, 48)
+        master["do_objectID"] = symbol_id
+        master["symbolID"] = symbol_id
+        master["isVisible"] = True
+        label = self._base_layer(rng, "text", "label", 16, 12, 128, 24)
+        label["do_objectID"] = label_id
+        label["isVisible"] = True
+        self._make_text(rng, label)
+        background = self._base_layer(rng, "rectangle", "background", 0, 0, 160, 48)
+        background["isVisible"] = True
+        master["layers"] = [background, label]
+        return master
+
+    def _children(self, rng, depth, symbols):
+        """生成编组（剩余层数为 depth）的子图层，按随机选取的排列方式摆放。"""
+        pattern = rng.choices(self.patterns, self.pattern_weights)[0]
+        child_width, child_height = self._group_size(depth - 1)
+        columns = max(1, round(self.fan_out ** 0.5))
+        children = []
+        for i in range(self.fan_out):
+            if pattern == "row":
+                x, y = i * (child_width + _GAP), 0
+            elif pattern == "column":
+                x, y = 0, i * (child_height + _GAP)
+            elif pattern == "grid":
+                x, y = (i % columns) * (child_width + _GAP), (i // columns) * (child_height + _GAP)
+            else:
+                x, y = rng.randint(0, child_width * 2), rng.randint(0, child_height * 2)
+            if depth > 1:
+                child = self._base_layer(rng, "group", rng.choice(_LAYER_NAMES), x, y, child_width, child_height)
+                child["layers"] = self._children(rng, depth - 1, symbols)
+            else:
+                child = self._leaf(rng, x, y, child_width, child_height, symbols)
+            children.append(child)
+        # Sketch 中图层的存储顺序与位置无关，打乱后布局分析需要自行排序
+        rng.shuffle(children)
+        return children
+
+    def _leaf(self, rng, x, y, width, height, symbols):
+        roll = rng.random()
+        if roll < self.symbol_ratio and symbols:
+            layer = self._base_layer(rng, "symbolInstance", "button", x, y, width, height)
+            symbol_id, label_id = rng.choice(symbols)
+            layer["symbolID"] = symbol_id
+            if rng.random() < 0.5:
+                layer["overrideValues"] = [{
+                    "_class": "overrideValue",
+                    "overrideName": f"{label_id}_stringValue",
+                    "value": rng.choice(_TEXTS),
+                }]
+        elif roll < self.symbol_ratio + self.text_ratio:
+            layer = self._base_layer(rng, "text", rng.choice(_LAYER_NAMES), x, y, width, height)
+            self._make_text(rng, layer)
+        else:
+            layer_class = rng.choice(_SHAPE_CLASSES)
+            layer = self._base_layer(rng, layer_class, rng.choice(_LAYER_NAMES), x, y, width, height)
+            if layer_class == "rectangle":
+                layer["fixedRadius"] = rng.choice((0, 4, 8))
+            elif layer_class == "bitmap":
+                layer["image"] = {"_class": "MSJSONFileReference", "_ref": f"images/{layer['do_objectID']}.png"}
+        return layer
+
+    # --- 图层属性 ---
+    def _base_layer(self, rng, layer_class, name, x, y, width, height):
+        return {
+            "_class": layer_class,
+            "do_objectID": self._object_id(rng),
+            "name": name,
+            "isVisible": rng.random() >= self.hidden_ratio,
+            "frame": self._frame(x, y, width, height),
+            "rotation": 0,
+            "style": self._style(rng),
+        }
+
+    def _make_text(self, rng, layer):
+        font_name, font_size = rng.choice(_FONTS)
+        layer["stringValue"] = rng.choice(_TEXTS)
+        layer["style"]["textStyle"] = {
+            "_class": "textStyle",
+            "encodedAttributes": {
+                "MSAttributedStringColorAttribute": self._color(rng),
+                "MSAttributedStringFontAttribute": {
+                    "_class": "fontDescriptor",
+                    "attributes": {"name": font_name, "size": font_size},
+                },
+            },
+        }
+
+    def _style(self, rng):
+        style = {"_class": "style", "contextSettings": {"_class": "graphicsContextSettings",
+                                                        "opacity": rng.choice((1, 1, 1, 0.5))}}
+        if rng.random() < 0.7:
+            style["fills"] = [{"_class": "fill", "isEnabled": rng.random() < 0.9, "color": self._color(rng)}]
+        if rng.random() < 0.3:
+            style["borders"] = [{"_class": "border", "isEnabled": True, "thickness": rng.choice((1, 2)),
+                                 "color": self._color(rng)}]
+        if rng.random() < 0.1:
+            style["shadows"] = [{"_class": "shadow", "isEnabled": True, "blurRadius": 4, "offsetX": 0, "offsetY": 2,
+                                 "color": self._color(rng)}]
+        return style
+
+    @staticmethod
+    def _color(rng):
+        red, green, blue = rng.choice(_COLORS)
+        return {"_class": "color", "red": red, "green": green, "blue": blue, "alpha": 1}
+
+    @staticmethod
+    def _frame(x, y, width, height):
+        return {"_class": "rect", "constrainProportions": False, "x": x, "y": y, "width": width, "height": height}
+
+    @staticmethod
+    def _object_id(rng):
+        return str(uuid.UUID(int=rng.getrandbits(128))).upper()
+
+    def _group_size(self, depth):
+        """剩余层数为 depth 的编组的尺寸（按行排列时的外接矩形）。"""
+        width, height = _CELL_WIDTH, _CELL_HEIGHT
+        for _ in range(depth):
+            width = self.fan_out * (width + _GAP)
+            height = self.fan_out * (height + _GAP)
+        return width, height
+
+
+def generate_page(depth=DEFAULT_DEPTH, fan_out=DEFAULT_FAN_OUT, artboards=1, seed=0, **options):
+    """生成合成页面的快捷方式，其余参数见 SyntheticSketchGenerator。"""
+    return SyntheticSketchGenerator(depth=depth, fan_out=fan_out, seed=seed, **options).page(artboards)
+
+
+def main():
+    """主函数：按默认参数生成合成页面并写入 OUTPUT_FILE，可作为其他脚本的 INPUT_FILE。"""
+    generator = SyntheticSketchGenerator()
+    page = generator.page()
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    try:
+        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+            json.dump(page, f, ensure_ascii=False)
+        print(f"[INFO] 已生成 {generator.layer_count()} 个图层的合成文档: {OUTPUT_FILE}")
+    except IOError as e:
+        print(f"[ERROR] 无法写入合成文档: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,26 @@
-
 import json
 import os
-from collections import defaultdict
+
+try:
+    from .dsl_node import TailwindNode, intern
+    from .dsl_writer import write_dsl
+    from .layout_core import cluster_rows, sort_by_position
+    from .token_registry import get_token_registry, pack_rgb
+except ImportError:
+    from dsl_node import TailwindNode, intern
+    from dsl_writer import write_dsl
+    from layout_core import cluster_rows, sort_by_position
+    from token_registry import get_token_registry, pack_rgb
 
 # --- 配置项 ---
 INPUT_FILE = os.path.join(os.path.dirname(__file__), '..', 'media', 'sketches', 'output.json')
 OUTPUT_FILE = os.path.join(os.path.dirname(__file__), '..', 'media', 'sketches', 'tailwind_output.json')
 BASE_WIDTH = 1920
 BASE_HEIGHT = 1080
+# 是否将颜色输出为设计令牌类名（如 bg-color-white），而不是任意值 bg-[#ffffff]
+USE_DESIGN_TOKENS = False
+# 颜色匹配的感知容差（CIELAB ΔE76），0 表示只做精确匹配
+COLOR_DELTA_E_TOLERANCE = 0
 
 # --- 核心转换逻辑 ---
 
@@ -45,12 +58,21 @@ def convert_color_to_hex(color_obj):
     r, g, b = int(color_obj['red'] * 255), int(color_obj['green'] * 255), int(color_obj['blue'] * 255)
     return f"#{r:02x}{g:02x}{b:02x}"
 
+def match_color_token(color_obj, index_name):
+    """启用设计令牌时，返回与颜色精确或感知匹配的令牌名称"""
+    if not USE_DESIGN_TOKENS:
+        return None
+    index = getattr(get_token_registry().get(), index_name)
+    return index.match(pack_rgb(color_obj), COLOR_DELTA_E_TOLERANCE)
+
 def get_background_style(layer):
     """从 layer 的 fills 属性中提取背景样式"""
     if (fills := layer.get('style', {}).get('fills')):
         for fill in reversed(fills):
             if fill.get('isEnabled'):
                 if color_hex := convert_color_to_hex(fill.get('color')):
+                    if token := match_color_token(fill['color'], 'color_index'):
+                        return f"bg-{token}"
                     return f"bg-[{color_hex}]"
     return ""
 
@@ -64,7 +86,10 @@ def get_border_style(layer):
             if border.get('isEnabled'):
                 thickness = border.get('thickness', 1)
                 if color_hex := convert_color_to_hex(border.get('color')):
-                    styles.append(f"border-[{thickness}px] border-[{color_hex}]")
+                    if token := match_color_token(border['color'], 'border_color_index'):
+                        styles.append(f"border-[{thickness}px] border-{token}")
+                    else:
+                        styles.append(f"border-[{thickness}px] border-[{color_hex}]")
                 break
     
     if layer.get('_class') == 'rectangle' and (fixed_radius := layer.get('fixedRadius', 0)) > 0:
@@ -81,37 +106,23 @@ def analyze_layout(layers):
     if not layers or len(layers) < 2:
         return {'type': 'absolute'}
 
-    layers.sort(key=lambda l: (l['frame']['y'], l['frame']['x']))
-
-    rows = defaultdict(list)
-    y_threshold = 10
-    for layer in layers:
-        found_row = False
-        for y_key in rows:
-            if abs(layer['frame']['y'] - y_key) < y_threshold:
-                rows[y_key].append(layer)
-                found_row = True
-                break
-        if not found_row:
-            rows[layer['frame']['y']].append(layer)
+    sort_by_position(layers)
 
+    rows = cluster_rows(layers)
     num_rows = len(rows)
-    items_per_row = [len(r) for r in rows.values()]
+    items_per_row = [len(r) for _, r in rows]
     
     if num_rows > 1 and len(set(items_per_row)) == 1 and items_per_row[0] > 1:
         cols = items_per_row[0]
         h_gaps, v_gaps = [], []
-        row_items = list(rows.values())
-        
-        for row in row_items:
+        for _, row in rows:
             for i in range(len(row) - 1):
                 gap = row[i+1]['frame']['x'] - (row[i]['frame']['x'] + row[i]['frame']['width'])
                 if gap > 0: h_gaps.append(gap)
         
-        sorted_rows = sorted(rows.items())
-        for i in range(len(sorted_rows) - 1):
-            y1, row1 = sorted_rows[i]
-            y2, _ = sorted_rows[i+1]
+        for i in range(len(rows) - 1):
+            y1, row1 = rows[i]
+            y2, _ = rows[i+1]
             gap = y2 - (y1 + row1[0]['frame']['height'])
             if gap > 0: v_gaps.append(gap)
 
@@ -183,9 +194,9 @@ def traverse_layer(layer, parent_layout_type='absolute'):
     if border_style := get_border_style(layer): styles.append(border_style)
     if any(s.startswith("p-") for s in styles): styles.append("box-border")
 
-    node = {"ele": node_ele, "style": " ".join(styles)}
-    if src: node["src"] = src
-    if children_nodes: node["children"] = children_nodes
+    node = TailwindNode(ele=node_ele, style=intern(" ".join(styles)))
+    if src: node.src = src
+    if children_nodes: node.children = children_nodes
 
     return node
 
@@ -206,8 +217,7 @@ def main():
     tailwind_json = traverse_layer(sketch_data)
     print(f"转换完成，正在写入输出文件: {OUTPUT_FILE}")
     try:
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(tailwind_json, f, ensure_ascii=False, indent=4)
+        write_dsl(OUTPUT_FILE, tailwind_json)
         print("成功！")
     except IOError as e:
         print(f"错误: 无法写入文件 at {OUTPUT_FILE}. {e}")
@@ -1,3 +1,1260 @@
-from django.test import TestCase
+import asyncio
+import copy
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+import zipfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils import timezone
+
+from sketch.models import Sketch
+from users.models import User
+from . import (
+    batch_converter, hybrid_converter_v1, metrics, result_cache, sketch_archive, tailwind_converter, token_registry,
+)
+from .diagnostics import Diagnostics
+from .document_index import DocumentIndex
+from .dsl_to_html import StyleInterner, dsl_node_to_html, dsl_to_html_document, iter_html_document, write_html
+from .dsl_columnar import ColumnarDSL, write_columnar
+from .dsl_node import DSLLayout, DSLNode, DSLStyle, json_default
+from .dsl_writer import dumps_dsl, iter_json, load_dsl, write_dsl
+from .incremental import IncrementalState
+from .layout_core import cluster_rows, sort_by_position
+from .llm_layout import LLMLayoutResolver
+from .models import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, ConversionJob
+from .result_cache import ConversionCache
+from .sketch_archive import SketchArchive, is_sketch_archive
+from .sketch_parser import filter_sketch_data, filter_sketch_events, ijson, load_sketch
+from .synthetic_sketch import SyntheticSketchGenerator
+from .token_registry import NearestColorIndex, TokenRegistry, get_token_registry, packed_to_lab
+from .token_report import TokenReportCollector
+from .traversal import walk
+
+
+def _events(data):
+    """把数据序列化后用 ijson 重新解析为事件流，与读取文件时的事件一致。"""
+    return ijson.basic_parse(json.dumps(data).encode("utf-8"), use_float=True)
+
+
+@unittest.skipIf(ijson is None, "未安装 'ijson' 库")
+class FilterSketchEventsTests(SimpleTestCase):
+    """流式过滤 filter_sketch_events 的结果必须与 filter_sketch_data 完全一致。"""
+
+    def assertSameAsFilter(self, data):
+        self.assertEqual(filter_sketch_events(_events(data)), filter_sketch_data(data))
+
+    def test_synthetic_page(self):
+        page = SyntheticSketchGenerator(depth=3, fan_out=3, hidden_ratio=0.2, seed=1).page(artboards=2)
+        self.assertSameAsFilter(page)
+
+    def test_hidden_layers_and_dropped_keys(self):
+        data = {
+            "_class": "page",
+            "do_objectID": "P",
+            "exportOptions": {"formats": [{"scale": 2}]},
+            "layers": [
+                {"_class": "group", "isVisible": False, "layers": [{"_class": "text", "name": "a"}]},
+                {
+                    "_class": "rectangle",
+                    "name": "r",
+                    "isVisible": True,
+                    "frame": {"_class": "rect", "x": 1, "y": 2.5, "width": 3, "height": 4, "constrainProportions": False},
+                    "style": {"fills": [{"isEnabled": True, "color": {"red": 1, "green": 0, "blue": 0, "alpha": 1}}]},
+                    "userInfo": {"nested": [[1, 2], {"x": None}]},
+                },
+                # 隐藏标记出现在已构建的键之后
+                {"_class": "oval", "name": "late", "frame": {"x": 0, "y": 0}, "isVisible": False, "layers": []},
+                [],
+            ],
+        }
+        self.assertSameAsFilter(data)
+
+    def test_top_level_list_and_scalars(self):
+        self.assertSameAsFilter([{"_class": "page", "layers": []}, {"isVisible": False}, 1, "text", None])
+        self.assertSameAsFilter({"name": "only"})
+
+
+class HtmlPreviewTests(SimpleTestCase):
+    def test_layer_names_and_style_values_are_escaped(self):
+        node = {
+            "name": '"><script>alert(1)</script>',
+            "style": {"backgroundColor": '#FFF" onmouseover="alert(2)', "borderRadius": "</style><script>"},
+            "children": [],
+        }
+        for html in (dsl_node_to_html(node), dsl_to_html_document(node, intern_styles=True),
+                     dsl_to_html_document(node, intern_styles=False)):
+            # <style> 元素只能由页面模板本身结束，元素部分不能出现未转义的标签或属性
+            head, _, body = html.rpartition("<body>")
+            self.assertLessEqual(head.count("</style>"), 1)
+            self.assertNotIn("<script>", body)
+            self.assertNotIn('" onmouseover', body)
+        self.assertIn('data-name="&quot;&gt;&lt;script&gt;alert(1)&lt;/script&gt;"', dsl_node_to_html(node))
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_hostile_style_values_cannot_inject_css_rules(self):
+        hostile = "1px} body{display:none} .x{"
+        red = {"_class": "color", "red": 1, "green": 0, "blue": 0, "alpha": 1}
+        artboard = _layer("artboard", "A", "a", layers=[
+            _layer("rectangle", "R", "r", fixedRadius=hostile, style={"_class": "style", "borders": [
+                {"_class": "border", "isEnabled": True, "thickness": hostile, "color": red},
+            ]}),
+        ])
+        dsl = hybrid_converter_v1.SketchConverter(artboard).build_dsl()
+        # 转换器把非数值的粗细和圆角替换为默认值
+        self.assertEqual(dsl["children"][0]["style"]["borderWidth"], "1px")
+        self.assertNotIn("borderRadius", dsl["children"][0]["style"])
+
+        # 直接构造的 DSL（如旧的 DSL 文件）中的恶意值在生成页面时被丢弃
+        node = {"name": "root", "style": {"borderWidth": hostile, "borderColor": "#FF0000",
+                                          "backgroundColor": "red; } body { display: none",
+                                          "borderRadius": "4px\\"}, "children": []}
+        for page in (dsl_to_html_document(node, intern_styles=True), dsl_to_html_document(node, intern_styles=False)):
+            self.assertNotIn("display:none", page)
+            self.assertNotIn("display: none", page)
+            self.assertNotIn("\\", page)
+            style_block = page.partition("<style>")[2].partition("</style>")[0]
+            self.assertEqual(style_block.count("{"), style_block.count("}"))
+        with self.assertRaises(ValueError):
+            StyleInterner().intern("border: 1px} body{display:none} .x{px solid red;")
+
+    def test_streaming_preview_starts_before_walking_the_tree(self):
+        visited = []
+
+        class Node(dict):
+            def get(self, key, default=None):
+                visited.append(key)
+                return super().get(key, default)
+
+        pages = iter_html_document(Node(name="root", style={"width": 10}, children=[]))
+        self.assertTrue(next(pages).startswith("<!DOCTYPE html>"))
+        self.assertEqual(visited, [])
+        self.assertIn('style="width: 10px;', "".join(pages))
+
+    def test_file_output_interns_styles(self):
+        node = {"name": "root", "style": {"width": 10}, "children": [{"name": "a", "style": {"width": 10}}]}
+        output = io.StringIO()
+        write_html(node, output)
+        self.assertIn('class="s0"', output.getvalue())
+
+
+class DSLWriterTests(SimpleTestCase):
+    """iter_json 的输出必须与标准库 json.dumps 逐字节一致。"""
+
+    values = {
+        "text": "中文 \"quoted\" \\ \n\t \u2028 \x00",
+        "numbers": [0, -1, 2 ** 70, 1.5, -0.0, 1e-07, 1e300, 3.141592653589793],
+        "constants": [True, False, None],
+        "empty": [{}, [], ""],
+        "nested": {"a": [[1, [2, []]], {"b": {"c": {}}}], 1: "int key"},
+        "tuple": (1, 2),
+        "record": DSLNode(name="n", style=DSLStyle(width=10, borderRadius="4px"), layout=DSLLayout(type="flex"),
+                          children=[DSLNode(name="child", children=[])]),
+    }
+
+    def test_pretty_output_matches_json_dumps(self):
+        expected = json.dumps(self.values, indent=4, ensure_ascii=False, default=json_default)
+        self.assertEqual("".join(iter_json(self.values, indent=4)), expected)
+        expected_ascii = json.dumps(self.values, indent=4, default=json_default)
+        self.assertEqual("".join(iter_json(self.values, indent=4, ensure_ascii=True)), expected_ascii)
+
+    def test_compact_output_matches_json_dumps(self):
+        expected = json.dumps(self.values, ensure_ascii=False, separators=(",", ":"), default=json_default)
+        self.assertEqual("".join(iter_json(self.values)), expected)
+        self.assertEqual(dumps_dsl(self.values, "compact", backend="json").decode("utf-8"), expected)
+
+    def test_converted_dsl_matches_json_dumps(self):
+        page = SyntheticSketchGenerator(depth=3, fan_out=3, seed=3).page()
+        with mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False):
+            dsl = hybrid_converter_v1.SketchConverter(page).build_dsl()
+        expected = json.dumps(dsl, indent=4, ensure_ascii=False, default=json_default)
+        self.assertEqual(dumps_dsl(dsl, "pretty").decode("utf-8"), expected)
+        self.assertEqual(json.loads(dumps_dsl(dsl, "compact")), json.loads(expected))
+
+    def test_deep_tree_and_lazy_values(self):
+        deep = []
+        for _ in range(5000):
+            deep = [deep]
+        # 标准库的编码和解码都会超出递归深度，直接比较文本
+        self.assertEqual("".join(iter_json(deep)), "[" * 5000 + "[]" + "]" * 5000)
+        lazy = {"items": iter([1, {"a": 2}]), "later": lambda: [3]}
+        self.assertEqual("".join(iter_json(lazy)), '{"items":[1,{"a":2}],"later":[3]}')
+
+    def test_compressed_round_trip(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        plain = json.loads(json.dumps(self.values, default=json_default))
+        for name, output_format in (("dsl.json", "pretty"), ("dsl.json.gz", "compact")):
+            path = f"{workdir.name}/{name}"
+            write_dsl(path, self.values, output_format)
+            self.assertEqual(load_dsl(path), plain)
+
+
+def _canonical(dsl):
+    """排序键后的 JSON 文本：字典相等时 1 与 1.0 视为相同，比较文本才能发现数值类型的变化。"""
+    return json.dumps(dsl, sort_keys=True, ensure_ascii=False, default=json_default)
+
+
+@mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+class ColumnarDSLTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = f"{workdir.name}/dsl.dslc"
+        page = SyntheticSketchGenerator(depth=3, fan_out=4, seed=4).page()
+        self.dsl = hybrid_converter_v1.SketchConverter(page).build_dsl()
+        # 补充转换结果中不会出现的值：浮点坐标、额外字段、空的子节点列表
+        self.dsl["children"][0]["style"]["width"] = 10.5
+        self.dsl["children"][0]["layout"]["top"] = -3
+        self.dsl["children"].append({"name": "附加", "ref": "S1", "overrides": {"a": 1}, "children": []})
+        write_columnar(self.path, self.dsl)
+
+    def test_round_trip(self):
+        with ColumnarDSL(self.path) as table:
+            self.assertEqual(_canonical(table.to_dsl()), _canonical(self.dsl))
+            self.assertEqual(len(table), len(_dsl_nodes(self.dsl)))
+
+    def test_subtree_access(self):
+        with ColumnarDSL(self.path) as table:
+            first_child = next(table.children(0))
+            self.assertEqual(_canonical(table.to_dsl(first_child)), _canonical(self.dsl["children"][0]))
+            last = table.find("附加")
+            self.assertEqual(len(last), 1)
+            node = table.node(last[0])
+            self.assertEqual(node["ref"], "S1")
+            self.assertEqual(node.get("children"), [])
+            self.assertNotIn("style", node)
+
+    def test_html_from_columnar_nodes(self):
+        with ColumnarDSL(self.path) as table:
+            self.assertEqual(dsl_node_to_html(table.root), dsl_node_to_html(self.dsl))
+
+
+class ConversionCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache = ConversionCache(cache_dir.name)
+        self.sketch = {"_class": "artboard", "name": "a", "layers": [{"_class": "text", "stringValue": "x"}]}
+        self.tokens = {"colors": {"#FFFFFF": "white"}}
+
+    def test_hit_and_miss(self):
+        key = ConversionCache.make_key(self.sketch, self.tokens, "1")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, {"dsl": {"type": "Group"}, "report": {}})
+        self.assertEqual(self.cache.get(key), {"dsl": {"type": "Group"}, "report": {}})
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_key_sensitivity(self):
+        key = ConversionCache.make_key(self.sketch, self.tokens, "1")
+        self.assertEqual(key, ConversionCache.make_key(copy.deepcopy(self.sketch), copy.deepcopy(self.tokens), "1"))
+        changed_sketch = copy.deepcopy(self.sketch)
+        changed_sketch["layers"][0]["stringValue"] = "y"
+        changed_tokens = {"colors": {"#FFFFFF": "white", "#000000": "black"}}
+        keys = {
+            key,
+            ConversionCache.make_key(changed_sketch, self.tokens, "1"),
+            ConversionCache.make_key(self.sketch, changed_tokens, "1"),
+            ConversionCache.make_key(self.sketch, self.tokens, "2"),
+            # 分段带长度前缀，内容在分段之间移动也会得到不同的键
+            ConversionCache.make_key("1", self.tokens, self.sketch),
+        }
+        self.assertEqual(len(keys), 5)
+
+    def test_key_is_canonical_and_source_digest_replaces_the_tree(self):
+        reordered = dict(reversed(list(self.sketch.items())))
+        self.assertEqual(ConversionCache.make_key(reordered, self.tokens, "1"),
+                         ConversionCache.make_key(self.sketch, self.tokens, "1"))
+        key = ConversionCache.make_key(self.sketch, self.tokens, "1", source_digest="a" * 64)
+        # 有文件摘要时键与图层树无关，也不会与按树计算的键相同
+        self.assertEqual(key, ConversionCache.make_key(None, self.tokens, "1", source_digest="a" * 64))
+        self.assertNotEqual(key, ConversionCache.make_key(self.sketch, self.tokens, "1"))
+        self.assertNotEqual(key, ConversionCache.make_key(self.sketch, self.tokens, "1", source_digest="b" * 64))
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_converter_keyed_by_source_digest_does_not_serialise_the_input(self):
+        artboard = _layer("artboard", "A", "a", layers=[_layer("text", "T", "t", stringValue="x")])
+
+        def convert():
+            converter = hybrid_converter_v1.SketchConverter(copy.deepcopy(artboard), cache=self.cache,
+                                                            source_digest="a" * 64)
+            return converter.build_dsl()
+
+        expected = dumps_dsl(convert(), "compact")
+        with mock.patch.object(result_cache, "_json_bytes", wraps=result_cache._json_bytes) as encode:
+            self.assertEqual(dumps_dsl(convert(), "compact"), expected)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertNotIn(artboard, [call.args[0] for call in encode.call_args_list])
+
+    def test_eviction_removes_least_recently_used(self):
+        keys = [ConversionCache.make_key(self.sketch, self.tokens, str(n)) for n in range(4)]
+        for age, key in zip((300, 200, 100), keys):
+            self.cache.put(key, {"dsl": {"name": key}})
+            path = self.cache._path(key)
+            os.utime(path, (time.time() - age, time.time() - age))
+        entry_size = os.path.getsize(self.cache._path(keys[0]))
+        self.cache.max_bytes = entry_size * 3
+        # 读取最旧的条目会更新其最近使用时间，之后最久未使用的是 keys[1]
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.cache.put(keys[3], {"dsl": {"name": keys[3]}})
+        self.assertEqual([os.path.exists(self.cache._path(key)) for key in keys], [True, False, True, True])
+        self.assertLessEqual(self.cache.stats()["bytes"], self.cache.max_bytes)
+
+    def test_corrupt_or_partial_entry_is_a_miss(self):
+        key = ConversionCache.make_key(self.sketch, self.tokens, "1")
+        self.cache.put(key, {"dsl": {"type": "Group", "children": []}, "report": {}})
+        path = self.cache._path(key)
+        with open(path, "rb") as f:
+            content = f.read()
+        for damaged in (content[: len(content) // 2], b"", b"\xff\xfe not json"):
+            with self.subTest(damaged=damaged):
+                with open(path, "wb") as f:
+                    f.write(damaged)
+                self.assertIsNone(self.cache.get(key))
+        # 重新写入后恢复正常
+        self.cache.put(key, {"dsl": {"type": "Group", "children": []}, "report": {}})
+        self.assertEqual(self.cache.get(key)["dsl"], {"type": "Group", "children": []})
+
+
+def _dsl_nodes(dsl):
+    nodes = []
+
+    def enter(node, _):
+        nodes.append(node)
+        return None, node.get("children") or ()
+
+    walk(dsl, enter)
+    return nodes
+
+
+def _layers(root, layer_class=None):
+    """按前序列出 root 下的图层（可按 _class 过滤）。"""
+    found = []
+
+    def enter(layer, _):
+        if layer_class is None or layer.get("_class") == layer_class:
+            found.append(layer)
+        return None, layer.get("layers") or ()
+
+    walk(root, enter)
+    return found
+
+
+def _shared_style(object_id, name, rgb):
+    red, green, blue = rgb
+    return {"_class": "sharedStyle", "do_objectID": object_id, "name": name, "value": {
+        "_class": "style",
+        "fills": [{"_class": "fill", "isEnabled": True,
+                   "color": {"_class": "color", "red": red, "green": green, "blue": blue, "alpha": 1}}],
+    }}
+
+
+@mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+class IncrementalConversionTests(SimpleTestCase):
+    """复用上一次状态的增量转换，结果必须与从头转换完全一致。"""
+
+    def convert(self, page, previous_state=None):
+        # 遍历会原地排序子图层，每次转换使用独立的副本
+        converter = hybrid_converter_v1.SketchConverter(
+            copy.deepcopy(page), incremental=True, previous_state=previous_state
+        )
+        dsl = converter.build_dsl()
+        return converter, json.loads(dumps_dsl(dsl, "compact"))
+
+    def assertIncrementalMatchesFresh(self, before, after):
+        previous, _ = self.convert(before)
+        incremental, incremental_dsl = self.convert(after, previous.incremental_state)
+        fresh, fresh_dsl = self.convert(after)
+        self.assertEqual(incremental_dsl, fresh_dsl)
+        self.assertEqual(incremental.report.to_dict(), fresh.report.to_dict())
+        return incremental.incremental_stats
+
+    def setUp(self):
+        self.page = SyntheticSketchGenerator(depth=3, fan_out=3, hidden_ratio=0, seed=2).page()
+
+    def test_unchanged_document_is_fully_reused(self):
+        stats = self.assertIncrementalMatchesFresh(self.page, self.page)
+        self.assertEqual(stats["recomputed"], 0)
+        self.assertGreater(stats["reused"], 0)
+
+    def test_changed_text_and_color(self):
+        after = copy.deepcopy(self.page)
+        artboard = after["layers"][0]
+        _layers(artboard, "text")[-1]["stringValue"] = "已修改"
+        styled = next(layer for layer in _layers(artboard) if layer["style"].get("fills"))
+        styled["style"]["fills"][0]["color"] = {"_class": "color", "red": 0.1, "green": 0.2, "blue": 0.3, "alpha": 1}
+        stats = self.assertIncrementalMatchesFresh(self.page, after)
+        self.assertGreater(stats["reused"], 0)
+        self.assertGreater(stats["recomputed"], 0)
+
+    def test_moved_and_hidden_subtrees(self):
+        after = copy.deepcopy(self.page)
+        groups = _layers(after["layers"][0], "group")
+        first, second = groups[0], groups[-1]
+        # 把一个编组移到另一个编组中，并隐藏一个图层
+        moved = first["layers"].pop()
+        second["layers"].append(moved)
+        second["layers"][0]["isVisible"] = False
+        self.assertIncrementalMatchesFresh(self.page, after)
+
+    def _with_shared_styles(self):
+        page = copy.deepcopy(self.page)
+        page["layerStyles"] = {"_class": "sharedStyleContainer", "objects": [
+            _shared_style("S1", "Primary", (1, 0, 0)),
+            _shared_style("S2", "Muted", (0.5, 0.5, 0.5)),
+        ]}
+        layer = _layers(page["layers"][0], "rectangle")[0]
+        layer["sharedStyleID"] = "S1"
+        del layer["style"]
+        return page, layer["do_objectID"]
+
+    def test_changed_shared_style(self):
+        before, _ = self._with_shared_styles()
+        after = copy.deepcopy(before)
+        after["layerStyles"]["objects"][0] = _shared_style("S1", "Secondary", (0, 0, 1))
+        self.assertIncrementalMatchesFresh(before, after)
+        _, dsl = self.convert(after)
+        self.assertIn('"sharedStyle":"Secondary"', json.dumps(dsl, separators=(",", ":")))
+
+    def test_changed_shared_style_reference(self):
+        before, object_id = self._with_shared_styles()
+        after = copy.deepcopy(before)
+        next(layer for layer in _layers(after) if layer.get("do_objectID") == object_id)["sharedStyleID"] = "S2"
+        stats = self.assertIncrementalMatchesFresh(before, after)
+        self.assertGreater(stats["recomputed"], 0)
+
+    def test_result_cache_key_covers_shared_styles(self):
+        before, _ = self._with_shared_styles()
+        after = copy.deepcopy(before)
+        after["layerStyles"]["objects"][0] = _shared_style("S1", "Secondary", (0, 0, 1))
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache = ConversionCache(cache_dir.name)
+        hybrid_converter_v1.SketchConverter(copy.deepcopy(before), cache=cache).build_dsl()
+        dsl = hybrid_converter_v1.SketchConverter(copy.deepcopy(after), cache=cache).build_dsl()
+        self.assertEqual(cache.hits, 0)
+        self.assertIn(b'"sharedStyle":"Secondary"', dumps_dsl(dsl, "compact"))
+
+    @mock.patch.object(hybrid_converter_v1, "SYMBOL_INSTANCE_MODE", "expand")
+    def test_result_cache_key_covers_symbol_masters(self):
+        # 与 .sketch 归档一样，主元件只在文档索引中，不在 sketch_data 中
+        page = SyntheticSketchGenerator(depth=2, fan_out=3, symbol_ratio=1, text_ratio=0, hidden_ratio=0,
+                                        symbol_count=1, seed=3).page()
+        master = page["layers"].pop()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache = ConversionCache(cache_dir.name)
+
+        def convert(text):
+            edited = copy.deepcopy(master)
+            _layers(edited, "text")[0]["stringValue"] = text
+            # 实例自带的文本覆盖会盖住主元件的文本，这里只看主元件本身的内容
+            data = copy.deepcopy(page)
+            for instance in _layers(data, "symbolInstance"):
+                instance.pop("overrideValues", None)
+            converter = hybrid_converter_v1.SketchConverter(data, cache=cache, index=DocumentIndex.build(edited))
+            return dumps_dsl(converter.build_dsl(), "compact")
+
+        self.assertIn(b'"OLD"', convert("OLD"))
+        dsl = convert("NEW")
+        self.assertEqual(cache.hits, 0)
+        self.assertIn(b'"NEW"', dsl)
+        self.assertNotIn(b'"OLD"', dsl)
+        convert("NEW")
+        self.assertEqual(cache.hits, 1)
+
+    def test_state_file_round_trip_and_damage(self):
+        converter, _ = self.convert(self.page)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "state.pickle")
+        converter.incremental_state.save(path)
+        loaded = IncrementalState.load(path)
+        self.assertEqual(loaded.fingerprint, converter.incremental_state.fingerprint)
+        stats = self.convert(self.page, loaded)[0].incremental_stats
+        self.assertEqual(stats["recomputed"], 0)
+
+        with open(path, "rb") as f:
+            content = f.read()
+        for damaged in (content[: len(content) // 2], b"", b"not a pickle"):
+            with open(path, "wb") as f:
+                f.write(damaged)
+            self.assertIsNone(IncrementalState.load(path))
+        self.assertIsNone(IncrementalState.load(os.path.join(directory.name, "missing.pickle")))
+
+    def test_state_saved_under_another_module_path(self):
+        # 模拟以脚本方式运行时保存的状态：类记录在另一个模块路径下，包内无法导入
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "state.pickle")
+        module = types.ModuleType("incremental_as_script")
+        module.IncrementalState = IncrementalState
+        with mock.patch.dict(sys.modules, {"incremental_as_script": module}), \
+                mock.patch.object(IncrementalState, "__module__", "incremental_as_script"):
+            IncrementalState("fingerprint", {}, []).save(path)
+        self.assertIsNone(IncrementalState.load(path))
+
+    def test_fingerprint_mismatch_disables_reuse(self):
+        previous, _ = self.convert(self.page)
+        previous.incremental_state.fingerprint = "stale"
+        converter, _ = self.convert(self.page, previous.incremental_state)
+        self.assertEqual(converter.incremental_stats["reused"], 0)
+
+
+def _layer(layer_class, object_id, name, **fields):
+    return {"_class": layer_class, "do_objectID": object_id, "name": name, "isVisible": True,
+            "frame": {"_class": "rect", "x": 0, "y": 0, "width": 100, "height": 40}, "style": {"_class": "style"},
+            **fields}
+
+
+def _master(symbol_id, name):
+    return _layer("symbolMaster", symbol_id, name, symbolID=symbol_id,
+                  layers=[_layer("text", f"{symbol_id}-label", "label", stringValue=name)])
+
+
+class SketchArchiveTests(SimpleTestCase):
+    """.sketch 归档的目录、按需解析和文档索引。"""
+
+    def setUp(self):
+        instances = [_layer("symbolInstance", f"I{n}", "instance", symbolID=symbol_id)
+                     for n, symbol_id in enumerate(("M1", "M2"))]
+        self.pages = [
+            _layer("page", "P1", "Page 1", layers=[
+                _layer("artboard", "A1", "首页", layers=instances),
+                _layer("artboard", "A2", "详情", layers=[_layer("text", "T1", "title", stringValue="hi")]),
+            ]),
+            # 改名或本地化的主元件页面，以及与画板放在一起的主元件
+            _layer("page", "P2", "组件", layers=[_master("M1", "component/button/primary")]),
+            _layer("page", "P3", "Page 3", layers=[
+                _layer("artboard", "A3", "其他", layers=[_layer("text", "T3", "body", stringValue="x")]),
+                _master("M2", "component/tag/default"),
+            ]),
+        ]
+        document = {"_class": "document", "do_objectID": "D", "layerStyles": {
+            "_class": "sharedStyleContainer", "objects": [_shared_style("S1", "Primary", (1, 0, 0))],
+        }}
+        meta = {"pagesAndArtboards": {
+            page["do_objectID"]: {"name": page["name"], "artboards": {
+                layer["do_objectID"]: {"name": layer["name"]}
+                for layer in page["layers"] if layer["_class"] == "artboard"
+            }} for page in self.pages
+        }}
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "design.sketch")
+        with zipfile.ZipFile(self.path, "w") as archive:
+            archive.writestr("document.json", json.dumps(document))
+            archive.writestr("meta.json", json.dumps(meta))
+            for page in self.pages:
+                archive.writestr(f"pages/{page['do_objectID']}.json", json.dumps(page))
+        self.archive = SketchArchive(self.path)
+        self.addCleanup(self.archive.close)
+
+    def test_pages(self):
+        self.assertTrue(is_sketch_archive(self.path))
+        self.assertEqual(self.archive.pages(), [
+            {"id": "P1", "name": "Page 1", "artboards": [{"id": "A1", "name": "首页"}, {"id": "A2", "name": "详情"}]},
+            {"id": "P2", "name": "组件", "artboards": []},
+            {"id": "P3", "name": "Page 3", "artboards": [{"id": "A3", "name": "其他"}]},
+        ])
+
+    def test_load_page(self):
+        page = self.archive.load_page("组件")
+        self.assertEqual(page, self.pages[1])
+        self.assertIs(self.archive.load_page("P2"), page)
+        with self.assertRaises(KeyError):
+            self.archive.load_page("Missing")
+
+    def test_load_artboard(self):
+        index = DocumentIndex()
+        self.assertEqual(self.archive.load_artboard("A2", index), self.pages[0]["layers"][1])
+        self.assertIn("T1", index.objects)
+        self.assertNotIn("A1", index.objects)
+        with self.assertRaises(KeyError):
+            self.archive.load_artboard("A9")
+
+    def test_load_artboard_without_ijson(self):
+        with mock.patch.object(sketch_archive, "ijson", None):
+            self.assertEqual(self.archive.load_artboard("A3"), self.pages[2]["layers"][0])
+
+    def test_build_index_finds_masters_on_every_page(self):
+        for module_ijson in (sketch_archive.ijson, None):
+            with self.subTest(ijson=module_ijson is not None), mock.patch.object(sketch_archive, "ijson", module_ijson):
+                index = SketchArchive(self.path).build_index()
+                # 主元件无论在哪个页面都会登记，画板等其他顶层图层不会
+                self.assertEqual(set(index.symbols), {"M1", "M2"})
+                self.assertIn("M1-label", index.objects)
+                self.assertEqual(set(index.shared_styles), {"S1"})
+                self.assertNotIn("A3", index.objects)
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_load_sketch_resolves_instances_from_other_pages(self):
+        index = DocumentIndex()
+        artboard = load_sketch(self.path, index, artboard="A1")
+        self.assertEqual(artboard["do_objectID"], "A1")
+        dsl = hybrid_converter_v1.SketchConverter(artboard, index=index).build_dsl()
+        # 未解析的实例会退回图层名 "instance"
+        self.assertEqual(sorted(node["type"] for node in _dsl_nodes(dsl)[1:]), ["button", "tag"])
+
+
+class SyntheticSketchTests(SimpleTestCase):
+    def setUp(self):
+        self.page = SyntheticSketchGenerator(depth=3, fan_out=4, symbol_ratio=0.5, hidden_ratio=0, seed=5).page()
+        self.instances = [layer for layer in _layers(self.page["layers"][0], "symbolInstance")
+                          if layer.get("overrideValues")]
+        self.assertTrue(self.instances)
+
+    def test_overrides_target_master_text_layers(self):
+        masters = {layer["symbolID"]: layer for layer in self.page["layers"] if layer["_class"] == "symbolMaster"}
+        for instance in self.instances:
+            target, _, prop = instance["overrideValues"][0]["overrideName"].rpartition("_")
+            self.assertEqual(prop, "stringValue")
+            texts = {layer["do_objectID"] for layer in _layers(masters[instance["symbolID"]], "text")}
+            self.assertIn(target, texts)
+
+    def test_layer_counts_match_generated_pages(self):
+        for depth, fan_out, artboards in ((0, 3, 1), (0, 1, 2), (1, 4, 1), (3, 3, 2)):
+            with self.subTest(depth=depth, fan_out=fan_out, artboards=artboards):
+                generator = SyntheticSketchGenerator(depth=depth, fan_out=fan_out, seed=1)
+                page = generator.page(artboards=artboards)
+                generated = sum(len(_layers(layer)) for layer in page["layers"] if layer["_class"] == "artboard")
+                self.assertEqual(generator.layer_count(artboards), generated)
+                self.assertEqual(generator.page_layer_count(artboards), len(_layers(page)) - 1)
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    @mock.patch.object(hybrid_converter_v1, "SYMBOL_INSTANCE_MODE", "ref")
+    def test_overrides_are_applied(self):
+        dsl = hybrid_converter_v1.SketchConverter(copy.deepcopy(self.page)).build_dsl()
+        overrides = [node["overrides"] for node in _dsl_nodes(dsl) if "overrides" in node]
+        self.assertEqual(len(overrides), len(self.instances))
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # 测试期间使用空的全局指标，结束后恢复
+        saved = metrics.REGISTRY.drain()
+        self.addCleanup(lambda: (metrics.REGISTRY.drain(), metrics.REGISTRY.merge(saved)))
+
+    def _dump(self, name, nodes):
+        # 模拟其他工作进程写出的文件
+        path = os.path.join(self.directory, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"pid": -1, "metrics": {metrics.NODES_PROCESSED.name: [[[], nodes]]}}, f)
+        return path
+
+    def test_collect_folds_stale_worker_files(self):
+        self._dump("live", 3)
+        stale = self._dump("restarted", 5)
+        old = time.time() - metrics.METRICS_STALE_SECONDS - 1
+        os.utime(stale, (old, old))
+        self.assertIn("sketch_conversion_nodes_total 8", metrics.collect(self.directory))
+        self.assertFalse(os.path.exists(stale))
+        # 已并入累计文件，再次合并时不会重复计数
+        self.assertIn("sketch_conversion_nodes_total 8", metrics.collect(self.directory))
+
+    def test_counters_do_not_decrease_when_workers_exit(self):
+        self._dump("a", 3)
+        self._dump("b", 5)
+        self.assertIn("sketch_conversion_nodes_total 8", metrics.collect(self.directory))
+        metrics.retire_worker_metrics("a", self.directory)
+        self.assertIn("sketch_conversion_nodes_total 8", metrics.collect(self.directory))
+        # 重启后的新进程从零开始计数，合并结果继续增长
+        self._dump("a-restarted", 1)
+        metrics.retire_worker_metrics("b", self.directory)
+        self.assertIn("sketch_conversion_nodes_total 9", metrics.collect(self.directory))
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.endswith(".json")),
+                         ["a-restarted.json"])
+
+    def test_corrupt_stale_file_is_dropped(self):
+        self._dump("live", 3)
+        broken = os.path.join(self.directory, "broken.json")
+        with open(broken, "w", encoding="utf-8") as f:
+            f.write('{"pid": ')
+        old = time.time() - metrics.METRICS_STALE_SECONDS - 1
+        os.utime(broken, (old, old))
+        with self.assertLogs("converter", "WARNING"):
+            self.assertIn("sketch_conversion_nodes_total 3", metrics.collect(self.directory))
+        self.assertFalse(os.path.exists(broken))
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_batch_workers_report_metrics(self):
+        page = SyntheticSketchGenerator(depth=2, fan_out=3, seed=6).page(artboards=3)
+        counts = []
+        for workers in (1, 2):
+            metrics.REGISTRY.drain()
+            batch_converter.convert_document(copy.deepcopy(page), max_workers=workers)
+            counts.append((metrics.NODES_PROCESSED.value(),
+                           metrics.STAGE_SECONDS.count(stage="traversal")))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[1][1], 3)
+        self.assertGreater(counts[1][0], 0)
+
+
+@mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+class BatchConverterTests(SimpleTestCase):
+    def setUp(self):
+        # Sketch 允许页面同名：第一页和第三页同名但是不同的页面
+        pages = [SyntheticSketchGenerator(depth=1, fan_out=2, seed=seed).page(artboards=2, name=name)
+                 for seed, name in ((1, "Page"), (2, "Other"), (3, "Page"))]
+        self.document = {"_class": "document", "pages": pages}
+        self.expected = [(page["do_objectID"], page["name"], [layer["do_objectID"] for layer in page["layers"]
+                                                               if layer["_class"] == "artboard"])
+                         for page in pages]
+
+    def test_pages_with_the_same_name_are_kept_apart(self):
+        document = batch_converter.convert_document(copy.deepcopy(self.document), max_workers=1)
+        self.assertEqual([(page["id"], page["name"], [result["id"] for result in page["artboards"]])
+                          for page in document["pages"]], self.expected)
+
+    def test_stream_document_groups_pages_like_convert_document(self):
+        document = batch_converter.stream_document(copy.deepcopy(self.document), max_workers=1)
+        self.assertEqual([(page["id"], page["name"], [result["id"] for result in page["artboards"]])
+                          for page in document["pages"]], self.expected)
+
+    def test_artboards_match_single_conversions(self):
+        document = batch_converter.convert_document(copy.deepcopy(self.document), max_workers=1)
+        page = self.document["pages"][0]
+        converter = hybrid_converter_v1.SketchConverter(copy.deepcopy(page))
+        self.assertEqual(dumps_dsl(document["pages"][0]["artboards"][0]["dsl"], "compact"),
+                         dumps_dsl(converter.build_dsl(), "compact"))
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_interleaved_serial_streams_keep_their_own_symbols(self):
+        def document(label):
+            # 两个文档中的主元件 ID 相同、名称不同，实例按主元件名称得到不同的类型
+            artboards = [_layer("artboard", f"{label}{n}", f"{label}{n}",
+                                layers=[_layer("symbolInstance", f"{label}I{n}", "instance", symbolID="M")])
+                         for n in range(2)]
+            return {"_class": "document", "pages": [
+                _layer("page", f"{label}P", label, layers=artboards),
+                _layer("page", f"{label}S", "symbols", layers=[_master("M", f"component/{label}/default")]),
+            ]}
+
+        first = batch_converter.stream_document(document("button"), max_workers=1)
+        second = batch_converter.stream_document(document("tag"), max_workers=1)
+        first_artboards = next(first["pages"])["artboards"]
+        second_artboards = next(second["pages"])["artboards"]
+        # 两个流交替转换画板
+        results = [(label, next(artboards)) for _ in range(2)
+                   for label, artboards in (("button", first_artboards), ("tag", second_artboards))]
+        for label, result in results:
+            self.assertEqual([node["type"] for node in _dsl_nodes(result["dsl"])[1:]], [label])
+        self.assertIsNone(batch_converter._worker_converter)
+
+
+def _group_chain(depth):
+    """depth 层嵌套的编组链，最内层为一个文本图层。"""
+    root = layer = _layer("group", "G0", "g0")
+    for level in range(1, depth):
+        child = _layer("group", f"G{level}", f"g{level}")
+        layer["layers"] = [child]
+        layer = child
+    layer["layers"] = [_layer("text", "T", "leaf", stringValue="deep")]
+    return root
+
+
+class TraversalTests(SimpleTestCase):
+    def test_walk_order_and_callbacks(self):
+        tree = ("a", [("b", [("d", [])]), ("c", [])])
+        events = []
+
+        def enter(item, parent_ctx):
+            name, children = item
+            events.append(("enter", name, parent_ctx))
+            # 剪掉 c 的子树：不调用 leave
+            return (None if name == "c" else (name, children))
+
+        result = walk(tree, enter, lambda item, ctx: events.append(("leave", ctx)))
+        self.assertEqual(result, "a")
+        self.assertEqual(events, [
+            ("enter", "a", None), ("enter", "b", "a"), ("enter", "d", "b"), ("leave", "d"), ("leave", "b"),
+            ("enter", "c", "a"), ("leave", "a"),
+        ])
+
+    def test_walk_deeper_than_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 3
+        root = node = {"children": []}
+        for _ in range(depth):
+            child = {"children": []}
+            node["children"].append(child)
+            node = child
+        visited = []
+        walk(root, lambda item, ctx: ((ctx or 0) + 1, item["children"]), lambda item, ctx: visited.append(ctx))
+        self.assertEqual(len(visited), depth + 1)
+        self.assertEqual(visited[0], depth + 1)
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_converter_deeper_than_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 2
+        for incremental in (False, True):
+            with self.subTest(incremental=incremental):
+                converter = hybrid_converter_v1.SketchConverter(_group_chain(depth), incremental=incremental)
+                nodes = _dsl_nodes(converter.build_dsl())
+                self.assertEqual(len(nodes), depth + 1)
+                self.assertEqual(nodes[-1]["content"], {"text": "deep"})
+                # 深层 DSL 也能完整写出
+                self.assertIn(b'"text":"deep"', dumps_dsl(nodes[0], "compact"))
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_pre_and_post_hooks(self):
+        page = _layer("group", "R", "root", layers=[
+            _layer("group", "A", "a", layers=[_layer("text", "A1", "a1", stringValue="x")]),
+            _layer("text", "B", "b", stringValue="y", frame={"_class": "rect", "x": 0, "y": 100, "width": 10,
+                                                              "height": 10}),
+        ])
+        converter = hybrid_converter_v1.SketchConverter(page)
+        events = []
+        converter.pre_hooks.append(lambda node, layer: events.append(("pre", layer["do_objectID"], len(node["children"]))))
+        converter.post_hooks.append(lambda node, layer: events.append(("post", layer["do_objectID"],
+                                                                       len(node["children"]))))
+        converter.build_dsl()
+        # 前序回调时子节点尚未生成，后序回调时已全部生成
+        self.assertEqual(events, [
+            ("pre", "R", 0), ("pre", "A", 0), ("pre", "A1", 0), ("post", "A1", 0), ("post", "A", 1),
+            ("pre", "B", 0), ("post", "B", 0), ("post", "R", 2),
+        ])
+
+
+def _frames(*positions, width=40, height=20):
+    return [{"_class": "rectangle", "name": f"r{i}", "frame": {"x": x, "y": y, "width": width, "height": height}}
+            for i, (x, y) in enumerate(positions)]
+
+
+def _pairwise_rows(layers, y_threshold=10):
+    """改写前两个分析器共用的行分组：每个图层依次与所有已有行键比较。"""
+    rows = {}
+    for layer in layers:
+        for y_key in rows:
+            if abs(layer["frame"]["y"] - y_key) < y_threshold:
+                rows[y_key].append(layer)
+                break
+        else:
+            rows[layer["frame"]["y"]] = [layer]
+    return list(rows.items())
+
+
+class LayoutCoreTests(SimpleTestCase):
+    def test_cluster_rows_matches_pairwise_grouping(self):
+        rng = random.Random(11)
+        # 阈值附近的偏移：恰好等于阈值时另起一行，略小于阈值时归入同一行
+        offsets = (0, 0.5, 9, 9.999, 10, 10.001, 19.999, 20, -10, -9.999)
+        for _ in range(500):
+            count = rng.randint(1, 30)
+            if rng.random() < 0.5:
+                ys = [rng.choice(offsets) + 10 * rng.randint(0, 5) for _ in range(count)]
+            else:
+                ys = [rng.uniform(-50, 200) for _ in range(count)]
+            layers = sort_by_position(_frames(*((rng.randint(0, 500), y) for y in ys)))
+            expected = _pairwise_rows(layers)
+            self.assertEqual([(y, [l["name"] for l in row]) for y, row in cluster_rows(layers)],
+                             [(y, [l["name"] for l in row]) for y, row in expected])
+
+    def test_threshold_boundaries(self):
+        layers = sort_by_position(_frames((0, 0), (50, 9.999), (100, 10), (150, 19.999)))
+        self.assertEqual([[l["name"] for l in row] for _, row in cluster_rows(layers)],
+                         [["r0", "r1"], ["r2", "r3"]])
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_analyzers_agree_on_layout_types(self):
+        converter = hybrid_converter_v1.SketchConverter({})
+        fixtures = {
+            "row": (_frames((0, 0), (60, 5), (120, 2)), "flex", "flex-row"),
+            "column": (_frames((0, 0), (0, 30), (2, 60)), "flex", "flex-col"),
+            "grid": (_frames((0, 0), (60, 0), (0, 30), (60, 31), (0, 60), (60, 65)), "grid", "grid"),
+            "ragged": (_frames((0, 0), (60, 0), (0, 30)), "absolute", "absolute"),
+            "single": (_frames((0, 0)), "absolute", "absolute"),
+        }
+        for name, (layers, expected_rules, expected_tailwind) in fixtures.items():
+            with self.subTest(name):
+                self.assertEqual(converter._analyze_layout_with_rules(copy.deepcopy(layers))["type"], expected_rules)
+                self.assertEqual(tailwind_converter.analyze_layout(copy.deepcopy(layers))["type"], expected_tailwind)
+        grid = converter._analyze_layout_with_rules(copy.deepcopy(fixtures["grid"][0]))
+        self.assertEqual(grid["columns"], tailwind_converter.analyze_layout(copy.deepcopy(fixtures["grid"][0]))["cols"])
+
+
+class TokenRegistryTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "design_tokens.json")
+        self.registry = TokenRegistry(self.path)
+
+    def _write(self, tokens, mtime_ns):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(tokens, f)
+        os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def test_reuses_compiled_tokens_until_mtime_changes(self):
+        self._write({"colors": {"#FFFFFF": "white"}}, 1_000_000_000)
+        with self.assertLogs("converter", "INFO") as logs:
+            first = self.registry.get()
+            self.assertIs(self.registry.get(), first)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(first.colors, {0xFFFFFF: "white"})
+
+        self._write({"colors": {"#000000": "black"}}, 2_000_000_000)
+        second = self.registry.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.colors, {0x000000: "black"})
+        self.assertNotEqual(second.fingerprint, first.fingerprint)
+        self.assertIs(self.registry.get(), second)
+
+    def test_missing_file_is_reloaded_once_created(self):
+        with self.assertLogs("converter", "WARNING"):
+            missing = self.registry.get()
+        self.assertEqual(missing.raw, {})
+        self.assertIsNone(missing.fingerprint)
+        self._write({"radii": {"4": "sm"}}, 1_000_000_000)
+        self.assertEqual(self.registry.get().radii, {4: "sm"})
+
+    def test_registry_is_shared_per_path(self):
+        self.assertIs(get_token_registry(self.path), get_token_registry(os.path.join(os.path.dirname(self.path), ".",
+                                                                                      "design_tokens.json")))
+
+    @mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False)
+    def test_token_fingerprint_is_part_of_the_state_fingerprint(self):
+        self._write({"colors": {"#FFFFFF": "white"}}, 1_000_000_000)
+        before = hybrid_converter_v1.SketchConverter({}, tokens=self.registry.get())._state_fingerprint()
+        self._write({"colors": {"#FFFFFF": "surface"}}, 2_000_000_000)
+        after = hybrid_converter_v1.SketchConverter({}, tokens=self.registry.get())._state_fingerprint()
+        self.assertNotEqual(before, after)
+
+
+class TokenReportCollectorTests(SimpleTestCase):
+    def _collect(self, names, sample_size=5, seed=0, **kwargs):
+        collector = TokenReportCollector(sample_size=sample_size, seed=seed, **kwargs)
+        collector.push("root")
+        for name in names:
+            collector.record("unknown_colors", "#123456", name, f"id-{name}")
+        collector.pop()
+        return collector
+
+    def test_reservoir_is_bounded(self):
+        small = self._collect(["a", "b", "c"])
+        self.assertEqual(small.to_dict()["unknown_colors"]["#123456"]["samples"],
+                         [["a", "id-a"], ["b", "id-b"], ["c", "id-c"]])
+        names = [f"layer{i}" for i in range(1000)]
+        entry = self._collect(names).to_dict()["unknown_colors"]["#123456"]
+        self.assertEqual(entry["count"], 1000)
+        self.assertEqual(len(entry["samples"]), 5)
+        self.assertTrue({name for name, _ in entry["samples"]} <= set(names))
+        self.assertEqual(entry["first_seen"], ["root", "layer0"])
+        self.assertEqual(entry["last_seen"], ["root", "layer999"])
+        # 种子固定，同一输入得到同一份报告
+        self.assertEqual(self._collect(names).to_dict(), self._collect(names).to_dict())
+
+    def test_merge(self):
+        left = self._collect([f"l{i}" for i in range(8)])
+        right = self._collect([f"r{i}" for i in range(3)])
+        right.record("unknown_fonts", "Helvetica-18", "title")
+        merged = TokenReportCollector(sample_size=5)
+        merged.merge(left)
+        merged.merge(right.to_dict())
+        colors = merged.to_dict()["unknown_colors"]["#123456"]
+        self.assertEqual(colors["count"], 11)
+        self.assertEqual(len(colors["samples"]), 5)
+        self.assertTrue({name for name, _ in colors["samples"]} <= {f"l{i}" for i in range(8)} | {"r0", "r1", "r2"})
+        self.assertEqual(colors["first_seen"], ["root", "l0"])
+        self.assertEqual(colors["last_seen"], ["root", "r2"])
+        self.assertEqual(merged.summary()["unknown_fonts"], {"Helvetica-18": ["title"]})
+        # 样本未超出上限时全部保留
+        small = TokenReportCollector(sample_size=5)
+        small.merge(self._collect(["a", "b"]))
+        small.merge(self._collect(["c"]))
+        self.assertEqual(small.summary()["unknown_colors"]["#123456"], ["a", "b", "c"])
+
+    def test_to_dict_round_trip(self):
+        collector = self._collect([f"layer{i}" for i in range(50)])
+        collector.record("unknown_radii", "7", "card")
+        data = json.loads(json.dumps(collector.to_dict()))
+        restored = TokenReportCollector.from_dict(data)
+        self.assertEqual(restored.to_dict(), collector.to_dict())
+        self.assertEqual(restored.stats(), collector.stats())
+        self.assertEqual(restored.summary(), collector.summary())
+        self.assertFalse(TokenReportCollector.from_dict({}))
+
+    def test_sidecar_records_every_occurrence(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "occurrences.jsonl")
+        self._collect([f"layer{i}" for i in range(30)], sidecar_path=path).close()
+        with open(path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 30)
+        self.assertEqual(lines[-1], {"kind": "unknown_colors", "key": "#123456", "name": "layer29",
+                                     "id": "id-layer29", "path": "root / layer29"})
+
+
+class _FormatProbe:
+    """记录被格式化次数的参数（logging 会吞掉格式化时的异常，因此计数而不是抛出异常）。"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "probe"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __format__(self, spec):
+        return self.__str__()
+
+
+class DiagnosticsTests(SimpleTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("converter.tests.diagnostics")
+
+    def test_logging_stops_after_limit_but_counting_continues(self):
+        diagnostics = Diagnostics(log_limit=2, log=self.logger)
+        with self.assertLogs(self.logger, "INFO") as logs:
+            for i in range(5):
+                diagnostics.info("layout.fallback", "fallback %d", i)
+            self.assertEqual(logs.output, ["INFO:converter.tests.diagnostics:fallback 0",
+                                           "INFO:converter.tests.diagnostics:fallback 1"])
+            diagnostics.close()
+        self.assertEqual(diagnostics.count("layout.fallback"), 5)
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(logs.records[-1].getMessage(), "[layout.fallback] 共出现 5 次，日志中只输出了前 2 次")
+
+    def test_close_is_silent_below_limit(self):
+        diagnostics = Diagnostics(log_limit=2, log=self.logger)
+        with self.assertLogs(self.logger, "INFO") as logs:
+            diagnostics.warning("llm.unavailable", "unavailable")
+            diagnostics.close()
+        self.assertEqual(len(logs.records), 1)
+
+    def test_summary_and_merge_respect_sample_size(self):
+        source = Diagnostics(sample_size=3, log=self.logger)
+        self.logger.setLevel(logging.CRITICAL)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+        for i in range(4):
+            source.warning("token.unknown", "未知颜色 %s", f"#{i}")
+        summary = source.summary()
+        self.assertEqual(summary["token.unknown"], {"level": "WARNING", "count": 4,
+                                                    "samples": ["未知颜色 #0", "未知颜色 #1", "未知颜色 #2"]})
+
+        merged = Diagnostics(sample_size=2, log=self.logger)
+        merged.merge(summary)
+        merged.merge(summary)
+        self.assertEqual(merged.summary()["token.unknown"], {"level": "WARNING", "count": 8,
+                                                             "samples": ["未知颜色 #0", "未知颜色 #1"]})
+
+    def test_disabled_level_does_not_format(self):
+        self.logger.setLevel(logging.WARNING)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+        probe = _FormatProbe()
+        diagnostics = Diagnostics(log_limit=1, log=self.logger)
+        for _ in range(3):
+            diagnostics.info("layout.fallback", "fallback %s", probe)
+        diagnostics.close()
+        self.assertEqual(diagnostics.count("layout.fallback"), 3)
+        self.assertEqual(probe.calls, 0)
+        # 启用的级别只在写入日志时格式化
+        self.logger.setLevel(logging.INFO)
+        with self.assertLogs(self.logger, "INFO"):
+            diagnostics.info("layout.other", "other %s", probe)
+        self.assertEqual(probe.calls, 1)
+
+
+class NearestColorIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.table = {0xFFFFFF: "white", 0x000000: "black", 0xFF0000: "red", 0x0000FF: "blue", 0x4A90E2: "primary"}
+
+    def test_lab_values(self):
+        # sRGB（D65）的参考值
+        for packed, expected in ((0xFFFFFF, (100, 0, 0)), (0x000000, (0, 0, 0)),
+                                 (0xFF0000, (53.2408, 80.0925, 67.2032)), (0x00FF00, (87.7347, -86.1827, 83.1793)),
+                                 (0x0000FF, (32.2970, 79.1875, -107.8602)), (0x808080, (53.5850, 0, 0))):
+            for actual, reference in zip(packed_to_lab(packed), expected):
+                self.assertAlmostEqual(actual, reference, places=3)
+
+    def test_delta_e76(self):
+        index = NearestColorIndex({0x0000FF: "blue"})
+        token, distance = index.nearest(0xFF0000)
+        self.assertEqual(token, "blue")
+        self.assertAlmostEqual(distance, 176.314, places=3)
+        self.assertEqual(index.nearest(0x0000FF), ("blue", 0))
+        self.assertEqual(NearestColorIndex({}).nearest(0xFF0000), (None, math.inf))
+
+    def test_tolerance(self):
+        index = NearestColorIndex(self.table)
+        near_red = 0xFE0101
+        _, distance = index.nearest(near_red)
+        self.assertGreater(distance, 0)
+        self.assertEqual(index.match(0xFF0000), "red")
+        # 容差为 0 时只做精确匹配
+        self.assertIsNone(index.match(near_red))
+        self.assertIsNone(index.match(near_red, distance / 2))
+        self.assertEqual(index.match(near_red, distance), "red")
+        self.assertIsNone(index.match(None, 10))
+
+    def test_numpy_matches_linear_scan(self):
+        if token_registry.np is None:
+            self.skipTest("未安装 'numpy' 库")
+        vectorized = NearestColorIndex(self.table)
+        with mock.patch.object(token_registry, "np", None):
+            linear = NearestColorIndex(self.table)
+        self.assertTrue(vectorized._vectorized)
+        self.assertFalse(linear._vectorized)
+        rng = random.Random(7)
+        for packed in [rng.getrandbits(24) for _ in range(500)] + list(self.table):
+            token, distance = vectorized.nearest(packed)
+            expected_token, expected_distance = linear.nearest(packed)
+            self.assertEqual(token, expected_token)
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+
+class _FakeLLMClient:
+    """openai.AsyncOpenAI 的替身，记录收到的提示词并返回固定的回答。"""
+
+    def __init__(self, content, prompts):
+        self.content = content
+        self.prompts = prompts
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, model, messages):
+        self.prompts.append(messages[-1]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))])
+
+    async def close(self):
+        pass
+
+
+class LLMLayoutResolverTests(SimpleTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.prompts = []
+        self.resolver = LLMLayoutResolver(
+            lambda: _FakeLLMClient('{"type": "flex", "direction": "row", "gap": 8}', self.prompts),
+            "test-model", cache_dir=cache_dir.name,
+        )
+
+    def test_deduplicates_and_caches_prompts(self):
+        layouts = self.resolver.resolve(["a", "b", "a"])
+        self.assertEqual([layout["type"] for layout in layouts], ["flex"] * 3)
+        self.assertCountEqual(self.prompts, ["a", "b"])
+        self.resolver.resolve(["a"])
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(self.resolver.stats["cache_hits"], 1)
+
+    def test_resolve_inside_running_event_loop(self):
+        async def handler():
+            return self.resolver.resolve(["a"])
+
+        self.assertEqual(asyncio.run(handler())[0]["direction"], "row")
+
+    def test_llm_configuration_changes_cache_key_and_fingerprint(self):
+        page = SyntheticSketchGenerator(depth=1, fan_out=2, seed=0).page()
+        with mock.patch.object(hybrid_converter_v1, "ENABLE_LLM_FALLBACK", False):
+            offline = hybrid_converter_v1.SketchConverter(copy.deepcopy(page))
+        online = hybrid_converter_v1.SketchConverter(copy.deepcopy(page))
+        online.llm_resolver = self.resolver
+        self.assertNotEqual(offline._llm_signature(), online._llm_signature())
+        self.assertNotEqual(offline._state_fingerprint(), online._state_fingerprint())
+
+
+class ConversionJobQueueTests(TransactionTestCase):
+    """数据库队列的领取与回收。"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="worker@example.com", password="password")
+        sketch = Sketch.objects.create(file="sketches/a.json", creator=self.user)
+        self.jobs = [ConversionJob.objects.create(source_sketch=sketch, creator=self.user) for _ in range(6)]
+
+    def test_concurrent_workers_claim_each_job_once(self):
+        claimed = []
+        errors = []
+
+        def work(name):
+            try:
+                while True:
+                    try:
+                        job = ConversionJob.claim_next(name)
+                    except OperationalError:
+                        # SQLite 共享缓存的表锁，稍后重试
+                        time.sleep(0.001)
+                        continue
+                    if job is None:
+                        break
+                    claimed.append(job.id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertCountEqual(claimed, [job.id for job in self.jobs])
+        self.assertFalse(ConversionJob.objects.filter(status=ConversionJob.STATUS_QUEUED).exists())
+        self.assertTrue(all(job.attempts == 1 for job in ConversionJob.objects.all()))
+
+    def test_claim_in_creation_order(self):
+        self.assertEqual(ConversionJob.claim_next("a").id, self.jobs[0].id)
+        self.assertEqual(ConversionJob.claim_next("b").id, self.jobs[1].id)
+
+    def test_stale_running_job_is_requeued(self):
+        job = ConversionJob.claim_next("crashed")
+        ConversionJob.objects.filter(pk=job.pk).update(
+            heartbeat_time=timezone.now() - timedelta(seconds=JOB_LEASE_SECONDS + 1)
+        )
+        # 回收后按创建顺序重新领取
+        reclaimed = ConversionJob.claim_next("next")
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.worker, "next")
+        self.assertEqual(reclaimed.attempts, 2)
+        # 原工作进程之后写入的结果被丢弃
+        with mock.patch("converter.pipeline.run_conversion_pipeline", side_effect=ValueError("late")):
+            job.run()
+        reclaimed.refresh_from_db()
+        self.assertEqual(reclaimed.status, ConversionJob.STATUS_RUNNING)
+        self.assertEqual(reclaimed.error, "")
+
+    def test_run_records_result(self):
+        job = ConversionJob.claim_next("worker")
+        with mock.patch("converter.pipeline.run_conversion_pipeline", side_effect=ValueError("broken")):
+            job.run()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ConversionJob.STATUS_FAILED)
+        self.assertEqual(job.error, "ValueError: broken")
+        self.assertIsNotNone(job.finished_time)
+
+    def test_repeatedly_crashing_job_fails(self):
+        job = self.jobs[0]
+        ConversionJob.objects.filter(pk=job.pk).update(
+            status=ConversionJob.STATUS_RUNNING, worker="crashed", attempts=JOB_MAX_ATTEMPTS,
+            heartbeat_time=timezone.now() - timedelta(seconds=JOB_LEASE_SECONDS + 1),
+        )
+        self.assertEqual(ConversionJob.reclaim_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ConversionJob.STATUS_FAILED)
+        self.assertIsNotNone(job.finished_time)
+
+    def test_fresh_heartbeat_is_not_reclaimed(self):
+        ConversionJob.claim_next("alive")
+        self.assertEqual(ConversionJob.reclaim_stale(), 0)
@@ -0,0 +1,215 @@
+"""
+进程级共享的设计令牌注册表。
+
+design_tokens.json 只在首次使用或文件 mtime 变化时重新加载，并编译成扁平的查找表：
+颜色以打包后的 24 位 RGB 整数为键，字体以 (字体名, 字号) 为键，圆角以整数为键。
+编译结果只读，可在线程和请求处理器之间安全共享。
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("converter")
+
+DEFAULT_TOKENS_FILE = os.path.join(os.path.dirname(__file__), "design_tokens.json")
+# 最近颜色查询结果的缓存上限，超出后清空重建
+NEAREST_MEMO_SIZE = 65536
+
+
+def pack_rgb(color_obj):
+    """将 Sketch 颜色对象打包为 0xRRGGBB 整数，与 convert_color_to_hex 的取整方式一致。"""
+    r = int(color_obj.get("red", 0) * 255)
+    g = int(color_obj.get("green", 0) * 255)
+    b = int(color_obj.get("blue", 0) * 255)
+    if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
+        return None
+    return (r << 16) | (g << 8) | b
+
+
+def _srgb_to_linear(channel):
+    c = channel / 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _lab_f(t):
+    return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+
+def packed_to_lab(packed):
+    """将 0xRRGGBB 转换为 CIELAB（D65 白点）。"""
+    r = _srgb_to_linear((packed >> 16) & 0xFF)
+    g = _srgb_to_linear((packed >> 8) & 0xFF)
+    b = _srgb_to_linear(packed & 0xFF)
+    fx = _lab_f((0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047)
+    fy = _lab_f(0.2126729 * r + 0.7151522 * g + 0.0721750 * b)
+    fz = _lab_f((0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883)
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+class NearestColorIndex:
+    """
+    颜色令牌的感知最近邻索引。
+
+    在 CIELAB 空间中以欧氏距离（ΔE76）比较颜色。安装了 NumPy 时对整个调色板做向量化距离计算，
+    否则线性扫描；查询结果按颜色缓存，大量重复的填充色只计算一次。
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._tokens = list(table.values())
+        labs = [packed_to_lab(packed) for packed in table]
+        self._vectorized = np is not None and bool(labs)
+        if self._vectorized:
+            # |a - b|² = |a|² - 2a·b + |b|²，调色板一侧的平方和预先算好，每次查询只需一次矩阵向量乘
+            self._labs = np.array(labs, dtype=float)
+            self._sq_norms = (self._labs ** 2).sum(axis=1)
+        else:
+            self._labs = labs
+        self._memo = {}
+
+    def nearest(self, packed):
+        """返回 (最近的令牌, ΔE)，调色板为空时返回 (None, inf)。"""
+        if (cached := self._memo.get(packed)) is not None:
+            return cached
+        if not self._tokens:
+            return None, math.inf
+        lab = packed_to_lab(packed)
+        if self._vectorized:
+            distances = self._sq_norms - 2 * (self._labs @ lab) + sum(c * c for c in lab)
+            index = int(distances.argmin())
+            result = (self._tokens[index], math.sqrt(max(float(distances[index]), 0.0)))
+        else:
+            index, distance = min(
+                ((i, math.dist(lab, token_lab)) for i, token_lab in enumerate(self._labs)),
+                key=lambda item: item[1],
+            )
+            result = (self._tokens[index], distance)
+        if len(self._memo) >= NEAREST_MEMO_SIZE:
+            self._memo.clear()
+        self._memo[packed] = result
+        return result
+
+    def match(self, packed, tolerance=0):
+        """先精确匹配；tolerance 大于 0 时再查找 ΔE 不超过容差的最近令牌。"""
+        if token := self.table.get(packed):
+            return token
+        if tolerance <= 0 or packed is None:
+            return None
+        token, distance = self.nearest(packed)
+        return token if distance <= tolerance else None
+
+
+def _compile_colors(entries):
+    table = {}
+    for hex_color, token in (entries or {}).items():
+        try:
+            table[int(hex_color.lstrip("#"), 16)] = token
+        except (AttributeError, ValueError):
+            logger.warning("无法识别的颜色令牌键: %s", hex_color)
+    return table
+
+
+def _compile_fonts(entries):
+    table = {}
+    for font_key, token in (entries or {}).items():
+        font_name, _, size = font_key.rpartition("-")
+        try:
+            table[(font_name, int(size))] = token
+        except ValueError:
+            logger.warning("无法识别的字体令牌键: %s", font_key)
+    return table
+
+
+def _compile_radii(entries):
+    table = {}
+    for radius, token in (entries or {}).items():
+        try:
+            table[int(radius)] = token
+        except ValueError:
+            logger.warning("无法识别的圆角令牌键: %s", radius)
+    return table
+
+
+class CompiledTokens:
+    """
+    编译后的令牌查找表，创建后不再修改（最近颜色索引内部的查询缓存除外）。
+
+    fingerprint 是令牌文件内容的 SHA-256 摘要（文件不存在时为 None），代表这份令牌参与转换缓存键的计算。
+    """
+
+    def __init__(self, raw, fingerprint):
+        self.raw = raw
+        self.fingerprint = fingerprint
+        self.colors = _compile_colors(raw.get("colors"))
+        self.text_colors = _compile_colors(raw.get("textColors"))
+        self.border_colors = _compile_colors(raw.get("borderColors"))
+        self.color_index = NearestColorIndex(self.colors)
+        self.text_color_index = NearestColorIndex(self.text_colors)
+        self.border_color_index = NearestColorIndex(self.border_colors)
+        self.fonts = _compile_fonts(raw.get("fonts"))
+        self.radii = _compile_radii(raw.get("radii"))
+
+
+class TokenRegistry:
+    """按文件 mtime 失效的令牌注册表，读多写少，只在重新加载时加锁。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._compiled = None
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            logger.warning("设计令牌文件未找到: %s。", self.path)
+            return CompiledTokens({}, None)
+        try:
+            raw = json.loads(content)
+        except json.JSONDecodeError:
+            logger.warning("设计令牌文件格式错误: %s", self.path)
+            raw = {}
+        logger.info("成功加载设计令牌文件: %s", self.path)
+        return CompiledTokens(raw, hashlib.sha256(content).hexdigest())
+
+    def get(self):
+        """返回当前的编译结果，文件变化时自动重新加载。"""
+        mtime = self._stat_mtime()
+        compiled = self._compiled
+        if compiled is not None and mtime == self._mtime:
+            return compiled
+        with self._lock:
+            if self._compiled is None or mtime != self._mtime:
+                self._compiled = self._load()
+                self._mtime = mtime
+            return self._compiled
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_token_registry(path=DEFAULT_TOKENS_FILE):
+    """返回指定令牌文件对应的进程级注册表。"""
+    key = os.path.abspath(path)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(key, TokenRegistry(key))
+    return registry
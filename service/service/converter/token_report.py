@@ -0,0 +1,214 @@
+"""
+未知设计令牌的报告收集器。
+
+每个未知令牌只保存出现次数、有界的示例蓄水池（图层名和 do_objectID）以及首次/最后一次出现的图层路径，
+内存占用与出现次数无关。需要完整的出现记录时，可以把每一次出现逐行写入 JSONL 旁路文件。
+"""
+import json
+import random
+
+# 每个未知令牌保留的示例数量上限
+REPORT_SAMPLE_SIZE = 20
+# 图层路径的分隔符
+PATH_SEPARATOR = " / "
+
+
+class _Occurrences:
+    """单个未知令牌的统计：次数、示例蓄水池、首次/最后出现路径。"""
+
+    __slots__ = ("count", "samples", "first_seen", "last_seen")
+
+    def __init__(self):
+        self.count = 0
+        self.samples = []
+        self.first_seen = None
+        self.last_seen = None
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "samples": [list(sample) for sample in self.samples],
+            "first_seen": list(self.first_seen),
+            "last_seen": list(self.last_seen),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        occurrences = cls()
+        occurrences.count = data["count"]
+        occurrences.samples = [tuple(sample) for sample in data["samples"]]
+        occurrences.first_seen = tuple(data["first_seen"])
+        occurrences.last_seen = tuple(data["last_seen"])
+        return occurrences
+
+
+class TokenReportCollector:
+    """
+    收集转换过程中未匹配到设计令牌的样式值。
+
+    示例采用蓄水池抽样：出现次数不超过 sample_size 时按出现顺序保留全部示例，
+    超过后每次出现以相同概率留在样本中。随机数种子固定，同一输入得到的报告是确定的。
+    图层路径由 push/pop 维护，转换器在遍历中进入/离开图层时调用。
+    """
+
+    def __init__(self, sample_size=REPORT_SAMPLE_SIZE, sidecar_path=None, seed=0):
+        self.sample_size = sample_size
+        self.sidecar_path = sidecar_path
+        self._rng = random.Random(seed)
+        self._tokens = {}
+        self._path = []
+        # 当前路径的元组快照，路径不变时多次记录共用同一个元组
+        self._path_snapshot = ()
+        self._sidecar = None
+
+    # --- 图层路径 ---
+    def push(self, layer_name):
+        """进入一个图层，其后记录的未知令牌都位于该图层之下。"""
+        self._path.append(layer_name)
+        self._path_snapshot = None
+
+    def pop(self):
+        """离开当前图层。"""
+        self._path.pop()
+        self._path_snapshot = None
+
+    def ancestors(self):
+        """当前图层路径（不含正在记录的图层本身）。"""
+        if self._path_snapshot is None:
+            self._path_snapshot = tuple(self._path)
+        return self._path_snapshot
+
+    # --- 记录 ---
+    def record(self, kind, key, layer_name, object_id=None, ancestors=None):
+        """
+        记录一次未知令牌。
+
+        参数:
+            kind (str): 报告分类，如 "unknown_colors"。
+            key (str): 未知的样式值，如 "#FF0000"。
+            layer_name (str): 使用该值的图层名。
+            object_id (str, optional): 图层的 do_objectID。
+            ancestors (tuple, optional): 图层的祖先路径，默认取当前路径。
+        """
+        if ancestors is None:
+            ancestors = self.ancestors()
+        entries = self._tokens.get(kind)
+        if entries is None:
+            entries = self._tokens[kind] = {}
+        occurrences = entries.get(key)
+        if occurrences is None:
+            occurrences = entries[key] = _Occurrences()
+            occurrences.first_seen = ancestors + (layer_name,)
+        occurrences.last_seen = ancestors + (layer_name,)
+        occurrences.count += 1
+
+        sample = (layer_name, object_id)
+        if len(occurrences.samples) < self.sample_size:
+            occurrences.samples.append(sample)
+        else:
+            index = self._rng.randrange(occurrences.count)
+            if index < self.sample_size:
+                occurrences.samples[index] = sample
+
+        if self.sidecar_path is not None:
+            self._write_sidecar(kind, key, layer_name, object_id, ancestors)
+
+    def _write_sidecar(self, kind, key, layer_name, object_id, ancestors):
+        if self._sidecar is None:
+            self._sidecar = open(self.sidecar_path, "w", encoding="utf-8")
+        line = {
+            "kind": kind,
+            "key": key,
+            "name": layer_name,
+            "id": object_id,
+            "path": PATH_SEPARATOR.join(map(str, ancestors + (layer_name,))),
+        }
+        self._sidecar.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def close(self):
+        """关闭 JSONL 旁路文件（如有）。"""
+        if self._sidecar is not None:
+            self._sidecar.close()
+            self._sidecar = None
+
+    def reset(self):
+        """清空已收集的数据，收集器可用于下一次转换。"""
+        self.close()
+        self._tokens = {}
+        self._path = []
+        self._path_snapshot = ()
+
+    # --- 合并与序列化 ---
+    def merge(self, other):
+        """
+        合并另一个收集器（或其 to_dict 结果）的数据，用于汇总多个画板的报告。
+
+        合并后样本总数超出上限时，按各自代表的出现次数加权抽样，保持与整体蓄水池抽样相同的分布。
+        """
+        tokens = other._tokens if isinstance(other, TokenReportCollector) else {
+            kind: {key: _Occurrences.from_dict(data) for key, data in entries.items()}
+            for kind, entries in other.items()
+        }
+        for kind, entries in tokens.items():
+            mine = self._tokens.setdefault(kind, {})
+            for key, theirs in entries.items():
+                occurrences = mine.get(key)
+                if occurrences is None:
+                    occurrences = mine[key] = _Occurrences()
+                    occurrences.first_seen = theirs.first_seen
+                occurrences.last_seen = theirs.last_seen
+                occurrences.samples = self._merge_samples(occurrences, theirs)
+                occurrences.count += theirs.count
+
+    def _merge_samples(self, left, right):
+        samples = left.samples + right.samples
+        if len(samples) <= self.sample_size:
+            return samples
+        # 加权无放回抽样（Efraimidis-Spirakis）：每个样本的权重为其代表的出现次数
+        weighted = []
+        for source in (left, right):
+            if source.samples:
+                weight = source.count / len(source.samples)
+                weighted.extend((self._rng.random() ** (1 / weight), i, s) for i, s in enumerate(source.samples))
+        weighted.sort(key=lambda item: item[0], reverse=True)
+        return [sample for _, _, sample in weighted[: self.sample_size]]
+
+    def to_dict(self):
+        """完整统计的可序列化形式：{分类: {样式值: {count, samples, first_seen, last_seen}}}。"""
+        return {
+            kind: {key: occurrences.to_dict() for key, occurrences in entries.items()}
+            for kind, entries in self._tokens.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        """由 to_dict 的结果重建收集器。"""
+        collector = cls(**kwargs)
+        collector.merge(data)
+        return collector
+
+    def __bool__(self):
+        return any(self._tokens.values())
+
+    # --- 报告输出 ---
+    def summary(self):
+        """与旧版报告相同的结构：{分类: {样式值: [图层名, ...]}}，图层名列表为示例。"""
+        return {
+            kind: {key: [name for name, _ in occurrences.samples] for key, occurrences in entries.items()}
+            for kind, entries in self._tokens.items()
+        }
+
+    def stats(self):
+        """每个未知令牌的出现次数、示例 ID 以及首次/最后出现的图层路径。"""
+        return {
+            kind: {
+                key: {
+                    "count": occurrences.count,
+                    "object_ids": [object_id for _, object_id in occurrences.samples if object_id],
+                    "first_seen": PATH_SEPARATOR.join(map(str, occurrences.first_seen)),
+                    "last_seen": PATH_SEPARATOR.join(map(str, occurrences.last_seen)),
+                }
+                for key, occurrences in entries.items()
+            }
+            for kind, entries in self._tokens.items()
+        }
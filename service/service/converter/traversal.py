@@ -0,0 +1,48 @@
+"""
+显式工作栈的树遍历引擎。
+
+Sketch 的图层树（以及由其生成的 DSL 树）可能嵌套得很深，递归实现会触及
+Python 的递归深度限制。这里用一个显式栈完成深度优先遍历，并支持前序与后序回调。
+"""
+
+_ENTER = 0
+_LEAVE = 1
+
+
+def walk(root, enter, leave=None):
+    """
+    以显式栈深度优先遍历一棵树，子节点按给定顺序依次访问。
+
+    参数:
+        root: 根节点对应的工作项。
+        enter (callable): 前序回调 enter(item, parent_ctx)，返回 (ctx, children)，
+            其中 children 是子节点工作项的序列；返回 None 表示剪掉该子树。
+            根节点的 parent_ctx 为 None。
+        leave (callable, optional): 后序回调 leave(item, ctx)，在该节点的全部子孙
+            处理完毕后调用。
+
+    返回:
+        根节点的 ctx；根节点被剪掉时返回 None。
+    """
+    root_ctx = None
+    stack = [(_ENTER, root, None)]
+    pop, push, extend = stack.pop, stack.append, stack.extend
+
+    while stack:
+        action, item, ctx = pop()
+        if action == _LEAVE:
+            leave(item, ctx)
+            continue
+
+        result = enter(item, ctx)
+        if result is None:
+            continue
+        node_ctx, children = result
+        if ctx is None:
+            root_ctx = node_ctx
+        if leave is not None:
+            push((_LEAVE, item, node_ctx))
+        if children:
+            extend([(_ENTER, child, node_ctx) for child in reversed(children)])
+
+    return root_ctx
@@ -0,0 +1,8 @@
+from rest_framework.routers import DefaultRouter
+from .views import ConversionJobView
+
+
+router = DefaultRouter()
+router.register(r'conversion-jobs', ConversionJobView, basename='conversion-job')
+
+urlpatterns = router.urls
@@ -1,3 +1,109 @@
+import os
+
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 
 # Create your views here.
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from service.settings import MEDIA_ROOT
+from .dsl_columnar import ColumnarDSL
+from .dsl_to_html import iter_html_document
+from .dsl_writer import load_dsl
+from . import metrics
+from .models import ConversionJob
+from .pipeline import COLUMNAR_FILE_NAME
+from .serializers import ConversionJobSerializer
+
+
+class ConversionJobView(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ConversionJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # 只能查看自己上传的文件对应的转换任务
+        return ConversionJob.objects.filter(creator=self.request.user, is_delete=False)
+
+    def _finished_job(self):
+        job = self.get_object()
+        if job.status != ConversionJob.STATUS_DONE or not job.dsl_file:
+            raise Http404('转换尚未完成')
+        return job
+
+    @staticmethod
+    def _open_columnar(job):
+        """打开任务的列式 DSL，旧任务没有列式文件时返回 None。"""
+        path = os.path.join(MEDIA_ROOT, os.path.dirname(job.dsl_file), COLUMNAR_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        return ColumnarDSL(path)
+
+    @staticmethod
+    def _node_index(request, table, param):
+        try:
+            index = int(request.query_params.get(param, 0))
+        except ValueError:
+            raise Http404(f'无效的节点下标: {request.query_params.get(param)}')
+        if not 0 <= index < len(table):
+            raise Http404(f'节点不存在: {index}')
+        return index
+
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        """
+        以流式响应返回转换结果的 HTML 预览，?debug=0 时去掉调试用的背景色和边框。
+
+        有列式 DSL 时通过 mmap 按需读取节点，?node=<下标> 只渲染该节点的子树。
+        """
+        job = self._finished_job()
+        debug_styles = request.query_params.get('debug', '1') != '0'
+        table = self._open_columnar(job)
+        if table is None:
+            dsl_data = load_dsl(os.path.join(MEDIA_ROOT, job.dsl_file))
+            pages = iter_html_document(dsl_data, debug_styles=debug_styles)
+        else:
+            try:
+                node = table.node(self._node_index(request, table, 'node'))
+            except Http404:
+                table.close()
+                raise
+            pages = _closing(iter_html_document(node, debug_styles=debug_styles), table)
+        return StreamingHttpResponse(pages, content_type='text/html; charset=utf-8')
+
+    @action(detail=True, methods=['get'])
+    def nodes(self, request, pk=None):
+        """列出 ?parent=<下标> 节点（默认为根节点）的直接子节点，用于逐层浏览转换结果。"""
+        job = self._finished_job()
+        table = self._open_columnar(job)
+        if table is None:
+            raise Http404('该任务没有列式 DSL')
+        with table:
+            parent = self._node_index(request, table, 'parent')
+            children = []
+            for index in table.children(parent):
+                children.append({
+                    'index': index,
+                    'name': table.field(index, 'name'),
+                    'type': table.field(index, 'type'),
+                    'descendants': len(table.subtree(index)) - 1,
+                })
+            return Response({'parent': parent, 'name': table.field(parent, 'name'), 'children': children})
+
+
+def _closing(chunks, table):
+    """流式响应结束（或被中断）后关闭列式 DSL 的映射。"""
+    try:
+        yield from chunks
+    finally:
+        table.close()
+
+
+def metrics_view(request):
+    """
+    Prometheus 抓取接口：合并 Web 进程与各转换工作进程的指标，以文本格式输出。
+
+    普通的 Django 视图，不经过 DRF 的令牌认证，抓取方无需登录；应只在内网暴露。
+    """
+    return HttpResponse(metrics.collect(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -153,3 +153,19 @@ AUTH_USER_MODEL = 'users.User'
 
 MEDIA_ROOT = Path(BASE_DIR, 'media')
 
+
+# 转换器的诊断日志（converter.diagnostics）。重复事件已聚合限流，默认只输出警告及以上，
+# 排查转换问题时可把 converter 的级别改为 INFO 或 DEBUG
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '[%(levelname)s] %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'converter': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
+from converter.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -32,5 +33,8 @@ urlpatterns = [
     # path('api/', include('results.urls')),
     path('v1/', include('users.urls')),
     path('v1/', include('sketch.urls')),
+    path('v1/', include('converter.urls')),
+    # Prometheus 指标（转换各阶段耗时与计数）
+    path('metrics', metrics_view, name='metrics'),
 
 ]
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from sketch.uploads import UPLOAD_SESSION_TTL, expire_sessions
+
+
+class Command(BaseCommand):
+    help = '取消长时间没有收到分片的上传会话，删除它们的临时文件。可由定时任务定期执行。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=UPLOAD_SESSION_TTL,
+                            help='会话超过该时长（秒）没有更新即视为已放弃，默认为 UPLOAD_SESSION_TTL')
+
+    def handle(self, *args, **options):
+        expired = expire_sessions(options['ttl'])
+        self.stdout.write(f'已取消 {expired} 个过期的上传会话')
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_basemodel_creator'),
+        ('sketch', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sketch',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='sketch',
+            name='file',
+            field=models.FileField(upload_to='sketches/'),
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('basemodel_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='core.basemodel')),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('received', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('complete', '已完成'), ('aborted', '已取消')], default='uploading', max_length=10)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('deduplicated', models.BooleanField(default=False)),
+                ('result_sketch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_sessions', to='sketch.sketch')),
+            ],
+            bases=('core.basemodel',),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sketch', '0002_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('uploading', '上传中'), ('completing', '完成中'), ('complete', '已完成'), ('aborted', '已取消')], default='uploading', max_length=10),
+        ),
+    ]
@@ -8,5 +8,39 @@ import os
 class Sketch(BaseModel):
     file_path = os.path.join('sketches/')
     file = models.FileField(upload_to=file_path)
+    # 文件内容的 SHA-256，同一用户重复上传相同内容时据此关联已有的 Sketch
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     def __str__(self):
-        return self.file.name
\ No newline at end of file
+        return self.file.name
+
+
+class UploadSession(BaseModel):
+    """
+    一次分片续传上传。
+
+    received 为已连续接收的字节数，也是下一个分片的起始偏移；全部接收后由 complete 接口
+    生成（或关联已有的）Sketch。
+    """
+    STATUS_UPLOADING = 'uploading'
+    # complete 接口已领取会话、正在生成 Sketch
+    STATUS_COMPLETING = 'completing'
+    STATUS_COMPLETE = 'complete'
+    STATUS_ABORTED = 'aborted'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, '上传中'),
+        (STATUS_COMPLETING, '完成中'),
+        (STATUS_COMPLETE, '已完成'),
+        (STATUS_ABORTED, '已取消'),
+    ]
+
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    content_hash = models.CharField(max_length=64, blank=True)
+    # 字段名不能用 sketch：BaseModel 已有指向 Sketch 子表的同名反向关联
+    result_sketch = models.ForeignKey(Sketch, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    deduplicated = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
\ No newline at end of file
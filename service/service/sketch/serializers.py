@@ -1,15 +1,44 @@
 from rest_framework import serializers
-from .models import Sketch
+from .models import Sketch, UploadSession
+from .uploads import UPLOAD_MAX_BYTES
 
 
 class SketchSerializer(serializers.ModelSerializer):
+    # 最近一次转换任务的 id，可通过 conversion-jobs 接口查询进度
+    conversion_job = serializers.SerializerMethodField()
+
     class Meta:
         model = Sketch
-        fields = ['id', 'file', 'created_time', 'updated_time', 'creator', 'is_delete']
+        fields = ['id', 'file', 'created_time', 'updated_time', 'creator', 'is_delete', 'content_hash', 'conversion_job']
         # read_only_fields: 将这些字段设置为只读，客户端提交数据时不能包含它们
         # 这些字段将由后端自动填充
-        read_only_fields = ['creator', 'created_time', 'updated_time', 'id', 'is_delete']
+        read_only_fields = ['creator', 'created_time', 'updated_time', 'id', 'is_delete', 'content_hash']
+
+    def get_conversion_job(self, obj):
+        # 视图的查询集通过 views.with_conversion_job 附加了任务 id，其他来源的实例才单独查询
+        if hasattr(obj, 'latest_conversion_job'):
+            return obj.latest_conversion_job
+        job = obj.conversion_jobs.order_by('-created_time').first()
+        return job.id if job else None
+
     def create (self, validated_data):
         user = self.context['request'].user
         validated_data['creator'] = user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'received', 'status', 'content_hash', 'result_sketch', 'deduplicated',
+                  'created_time', 'updated_time']
+        # 创建会话时只需提交 filename 和 size，其余字段由上传过程更新
+        read_only_fields = ['id', 'received', 'status', 'content_hash', 'result_sketch', 'deduplicated',
+                            'created_time', 'updated_time']
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('文件大小必须大于 0')
+        if value > UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(f'文件大小不能超过 {UPLOAD_MAX_BYTES} 字节')
+        return value
@@ -1,3 +1,218 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from converter.models import ConversionJob
+from users.models import User
+from . import uploads
+from .models import Sketch, UploadSession
+from .serializers import SketchSerializer
+from .views import with_conversion_job
+
+
+class SketchSerializerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+
+    def test_conversion_job_without_per_row_queries(self):
+        latest = {}
+        for i in range(5):
+            sketch = Sketch.objects.create(file=f'sketches/{i}.json', creator=self.user)
+            ConversionJob.objects.create(source_sketch=sketch, creator=self.user)
+            latest[str(sketch.id)] = ConversionJob.objects.create(source_sketch=sketch, creator=self.user).id
+        Sketch.objects.create(file='sketches/none.json', creator=self.user)
+
+        with self.assertNumQueries(1):
+            data = SketchSerializer(with_conversion_job(Sketch.objects.all()), many=True).data
+        for item in data:
+            self.assertEqual(item['conversion_job'], latest.get(item['id']))
+
+
+class UploadSessionTests(TestCase):
+    content = b'{"layers": []}' * 1000
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        partial_dir = mock.patch.object(uploads, 'UPLOAD_PARTIAL_DIR', os.path.join(media.name, 'partial'))
+        partial_dir.start()
+        self.addCleanup(partial_dir.stop)
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create(self):
+        response = self.client.post('/v1/uploads/', {'filename': 'design.sketch', 'size': len(self.content)},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def _chunk(self, session_id, offset, data):
+        return self.client.put(f'/v1/uploads/{session_id}/chunk/?offset={offset}', data=data,
+                               content_type='application/octet-stream')
+
+    def _upload(self):
+        session_id = self._create()
+        self.assertEqual(self._chunk(session_id, 0, self.content).status_code, 200)
+        return session_id
+
+    def _complete(self, session_id):
+        return self.client.post(f'/v1/uploads/{session_id}/complete/')
+
+    def test_chunks_resume_from_received(self):
+        session_id = self._create()
+        self.assertEqual(self._chunk(session_id, 0, self.content[:4000]).data['received'], 4000)
+        # 重发已接收的分片或跳过字节都返回 409 和正确的偏移
+        for offset in (0, 5000):
+            response = self._chunk(session_id, offset, self.content[offset:offset + 1000])
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data['received'], 4000)
+        # 换进程续传：注册表中没有哈希中间状态，按临时文件重新计算
+        uploads.hashers.discard(uuid.UUID(session_id))
+        self.assertEqual(self._chunk(session_id, 4000, self.content[4000:]).data['received'], len(self.content))
+
+        response = self._complete(session_id)
+        self.assertEqual(response.status_code, 200)
+        sketch = Sketch.objects.get(pk=response.data['sketch']['id'])
+        self.assertEqual(sketch.content_hash, hashlib.sha256(self.content).hexdigest())
+        with sketch.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(os.path.exists(uploads.partial_path(session_id)))
+        self.assertEqual(ConversionJob.objects.filter(source_sketch=sketch).count(), 1)
+
+    def test_chunk_already_written_by_another_process_is_a_conflict(self):
+        session_id = self._create()
+        self.assertEqual(self._chunk(session_id, 0, self.content[:4000]).status_code, 200)
+        # 另一个进程中的请求在 received 推进之前通过了视图的偏移检查，随后才轮到它写入
+        with self.assertRaises(uploads.UploadConflict) as raised:
+            uploads.write_chunk(uuid.UUID(session_id), 0, io.BytesIO(b'x' * 4000), len(self.content))
+        self.assertEqual(raised.exception.received, 4000)
+        with open(uploads.partial_path(session_id), 'rb') as f:
+            self.assertEqual(f.read(), self.content[:4000])
+
+    @unittest.skipIf(uploads.fcntl is None, '没有 fcntl')
+    def test_chunk_is_written_under_a_file_lock(self):
+        session_id = self._create()
+        path = uploads.partial_path(session_id)
+        locked = []
+
+        class Stream(io.BytesIO):
+            def read(self, size=-1):
+                # 写入过程中其他进程无法取得临时文件的锁
+                with open(path, 'rb') as other:
+                    try:
+                        uploads.fcntl.flock(other, uploads.fcntl.LOCK_EX | uploads.fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        locked.append(True)
+                    else:
+                        locked.append(False)
+                return super().read(size)
+
+        uploads.write_chunk(uuid.UUID(session_id), 0, Stream(self.content), len(self.content))
+        self.assertTrue(locked)
+        self.assertTrue(all(locked))
+        self.assertEqual(UploadSession.objects.get(pk=session_id).received, len(self.content))
+
+    def test_finish_hash_rehashes_when_the_file_length_differs(self):
+        session_id = uuid.UUID(self._upload())
+        path = uploads.partial_path(session_id)
+        size = len(self.content)
+        # 注册表中的中间状态与磁盘上的文件不一致
+        uploads.hashers.put(session_id, size, hashlib.sha256(b'stale'))
+        with open(path, 'ab') as f:
+            f.write(b'extra')
+        self.assertEqual(uploads.finish_hash(session_id, size), hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(os.path.getsize(path), size)
+
+        uploads.hashers.put(session_id, size, hashlib.sha256(b'stale'))
+        with open(path, 'r+b') as f:
+            f.truncate(size - 10)
+        with self.assertRaises(uploads.UploadConflict) as raised:
+            uploads.finish_hash(session_id, size)
+        self.assertEqual(raised.exception.received, size - 10)
+
+    def test_incomplete_upload_cannot_complete(self):
+        session_id = self._create()
+        self._chunk(session_id, 0, self.content[:10])
+        response = self._complete(session_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received'], 10)
+
+    def test_same_content_is_deduplicated(self):
+        first = self._complete(self._upload()).data['sketch']['id']
+        session_id = self._upload()
+        response = self._complete(session_id)
+        self.assertEqual(response.data['sketch']['id'], first)
+        self.assertTrue(response.data['upload']['deduplicated'])
+        self.assertEqual(Sketch.objects.count(), 1)
+        self.assertEqual(ConversionJob.objects.count(), 1)
+        self.assertFalse(os.path.exists(uploads.partial_path(session_id)))
+
+    def test_repeated_complete_returns_first_result(self):
+        session_id = self._upload()
+        stale = UploadSession.objects.get(pk=session_id)
+        first = self._complete(session_id)
+        # 另一个请求在领取之前读到的会话：领取失败，不再访问已移走的临时文件
+        self.assertIsNone(uploads.complete_session(stale))
+        second = self._complete(session_id)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['sketch']['id'], first.data['sketch']['id'])
+        self.assertEqual(Sketch.objects.count(), 1)
+
+    def test_complete_in_progress_returns_conflict(self):
+        session_id = self._upload()
+        # 读取会话后、领取之前，另一个请求已领取并正在生成 Sketch
+        session = UploadSession.objects.get(pk=session_id)
+        UploadSession.objects.filter(pk=session_id).update(status=UploadSession.STATUS_COMPLETING)
+        with mock.patch('sketch.views.UploadSessionView.get_object', return_value=session):
+            response = self._complete(session_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Sketch.objects.count(), 0)
+
+    def test_failed_complete_leaves_no_orphan_file(self):
+        session_id = self._upload()
+        with mock.patch.object(ConversionJob.objects, 'create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                uploads.complete_session(UploadSession.objects.get(pk=session_id))
+        self.assertEqual(Sketch.objects.count(), 0)
+        self.assertEqual(UploadSession.objects.get(pk=session_id).status, UploadSession.STATUS_UPLOADING)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, Sketch.file_path)), [])
+        self.assertTrue(os.path.exists(uploads.partial_path(session_id)))
+        # 临时文件已移回，可以重试
+        self.assertEqual(self._complete(session_id).status_code, 200)
+
+    def test_abandoned_sessions_expire(self):
+        stale_id = self._create()
+        self._chunk(stale_id, 0, self.content[:100])
+        UploadSession.objects.filter(pk=stale_id).update(
+            updated_time=timezone.now() - timedelta(seconds=uploads.UPLOAD_SESSION_TTL + 1))
+        self.assertEqual(uploads.expire_sessions(), 1)
+        self.assertEqual(UploadSession.objects.get(pk=stale_id).status, UploadSession.STATUS_ABORTED)
+        self.assertFalse(os.path.exists(uploads.partial_path(stale_id)))
+        self.assertNotIn(uuid.UUID(stale_id), uploads.hashers._hashers)
+
+        active_id = self._create()
+        self._chunk(active_id, 0, self.content[:100])
+        self.assertEqual(uploads.expire_sessions(), 0)
+        self.assertEqual(UploadSession.objects.get(pk=active_id).status, UploadSession.STATUS_UPLOADING)
+        self.assertTrue(os.path.exists(uploads.partial_path(active_id)))
+
+    def test_creating_session_expires_abandoned_ones(self):
+        stale_id = self._create()
+        UploadSession.objects.filter(pk=stale_id).update(
+            updated_time=timezone.now() - timedelta(seconds=uploads.UPLOAD_SESSION_TTL + 1))
+        self._create()
+        self.assertEqual(UploadSession.objects.get(pk=stale_id).status, UploadSession.STATUS_ABORTED)
@@ -0,0 +1,319 @@
+"""
+分片续传上传。
+
+客户端先创建上传会话，再按顺序以 PUT 发送各个分片，网络中断后查询会话的 received 并从该偏移继续发送，
+不必从头重传。分片一边写入磁盘上的临时文件一边更新 SHA-256，全部收到后临时文件通过 os.replace
+直接移动到 Sketch 的存储位置，不会再读一遍文件。
+
+同一用户上传内容相同的文件时，直接关联已有的 Sketch（及其转换结果），不再保存副本，也不重复转换。
+
+SHA-256 的中间状态无法持久化，只保存在当前进程的注册表中：续传请求落到另一个进程（或服务重启）时，
+按已接收的字节数重新计算一次临时文件的哈希。
+
+多个工作进程可能同时收到同一会话的分片，写入分片时对临时文件加排他的 flock，并在锁内重新核对
+会话已接收的字节数、写入后推进 received，同一偏移的分片只有一个能写入。
+
+超过 UPLOAD_SESSION_TTL 没有收到分片的会话视为已放弃，由 expire_sessions 取消并删除临时文件。
+"""
+import contextlib
+import hashlib
+import os
+import threading
+from datetime import timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只在进程内串行化
+    fcntl = None
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from converter.models import ConversionJob
+from service.settings import MEDIA_ROOT
+
+from .models import Sketch, UploadSession
+
+# 分片临时文件所在目录，需与 Sketch 文件在同一文件系统上，完成时才能原子地移动
+UPLOAD_PARTIAL_DIR = os.path.join(MEDIA_ROOT, 'uploads', 'partial')
+# 单个上传文件的大小上限
+UPLOAD_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# 从请求体读取分片时每次读取的字节数
+UPLOAD_READ_SIZE = 1024 * 1024
+# 会话超过该时长（秒）没有更新即视为已放弃
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+
+class UploadConflict(Exception):
+    """分片的起始偏移与会话已接收的字节数不一致。"""
+
+    def __init__(self, received):
+        super().__init__(f'分片偏移不正确，已接收 {received} 字节')
+        self.received = received
+
+
+class _HasherRegistry:
+    """进程内的 SHA-256 中间状态：会话 id → (已哈希的字节数, hasher)。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashers = {}
+        self._session_locks = {}
+
+    def session_lock(self, session_id):
+        """同一进程内串行化同一会话的分片写入。"""
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def get(self, session_id, path, offset):
+        """
+        返回已哈希到 offset 处的 hasher 副本。
+
+        注册表中没有该会话或偏移不一致（续传落到其他进程、之前的分片写入失败）时重新计算临时文件前 offset 个字节。
+        """
+        with self._lock:
+            entry = self._hashers.get(session_id)
+        if entry is not None and entry[0] == offset:
+            return entry[1].copy()
+        return _hash_file(path, offset)
+
+    def put(self, session_id, offset, hasher):
+        with self._lock:
+            self._hashers[session_id] = (offset, hasher)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._hashers.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+
+
+hashers = _HasherRegistry()
+
+
+def _hash_file(path, offset):
+    """计算文件前 offset 个字节的 SHA-256，文件不足 offset 字节时抛出 UploadConflict（带实际长度）。"""
+    hasher = hashlib.sha256()
+    remaining = offset
+    if remaining:
+        with open(path, 'rb') as f:
+            while remaining:
+                block = f.read(min(UPLOAD_READ_SIZE, remaining))
+                if not block:
+                    raise UploadConflict(offset - remaining)
+                hasher.update(block)
+                remaining -= len(block)
+    return hasher
+
+
+def partial_path(session_id):
+    """会话的分片临时文件路径。"""
+    return os.path.join(UPLOAD_PARTIAL_DIR, f'{session_id}.part')
+
+
+@contextlib.contextmanager
+def _locked_partial(path):
+    """打开（必要时创建）临时文件并加排他的 flock，跨进程串行化同一会话的写入，产出可读写的文件对象。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _uploading_received(session_id):
+    """返回上传中会话已接收的字节数，会话已完成、取消或不存在时返回 None。"""
+    return UploadSession.objects.filter(
+        pk=session_id, status=UploadSession.STATUS_UPLOADING
+    ).values_list('received', flat=True).first()
+
+
+def write_chunk(session_id, offset, stream, limit):
+    """
+    把请求体中的分片写入临时文件的 offset 处，同时更新 SHA-256，并把会话的 received 推进到分片末尾。
+
+    在临时文件的排他锁内重新核对会话已接收的字节数：其他进程中的请求已写入同一偏移的分片时
+    不会再截断、覆盖临时文件。
+
+    参数:
+        session_id: 上传会话 id。
+        offset (int): 分片的起始偏移，须等于会话已接收的字节数。
+        stream: 请求体的文件对象。
+        limit (int): 本分片最多允许写入的字节数（文件剩余大小）。
+
+    返回:
+        int: 写入的字节数。
+
+    异常:
+        UploadConflict: offset 与会话已接收的字节数不一致。
+        ValueError: 分片超出了文件的声明大小，或会话已不在上传中。
+    """
+    path = partial_path(session_id)
+    with hashers.session_lock(session_id), _locked_partial(path) as f:
+        received = _uploading_received(session_id)
+        if received is None:
+            raise ValueError('上传会话已结束，不能继续上传')
+        if received != offset:
+            raise UploadConflict(received)
+        written = _write_chunk(session_id, f, path, offset, stream, limit)
+        # update() 不会自动更新 updated_time，需显式写入，否则续传中的会话也会被当作已放弃
+        updated = UploadSession.objects.filter(
+            pk=session_id, status=UploadSession.STATUS_UPLOADING, received=offset
+        ).update(received=offset + written, updated_time=timezone.now())
+        if not updated:
+            # 持有锁期间 received 不会被其他写入推进，只可能是会话在写入过程中被取消
+            raise ValueError('上传会话已结束，不能继续上传')
+    return written
+
+
+def _write_chunk(session_id, f, path, offset, stream, limit):
+    hasher = hashers.get(session_id, path, offset)
+    written = 0
+    # 丢弃之前中断的分片写入的多余字节
+    f.seek(offset)
+    f.truncate()
+    while True:
+        block = stream.read(UPLOAD_READ_SIZE)
+        if not block:
+            break
+        written += len(block)
+        if written > limit:
+            f.truncate(offset)
+            raise ValueError('分片超出了文件的声明大小')
+        f.write(block)
+        hasher.update(block)
+    f.flush()
+    hashers.put(session_id, offset + written, hasher)
+    return written
+
+
+def finish_hash(session_id, size):
+    """
+    返回已完整接收的临时文件的 SHA-256 十六进制摘要，并移除注册表中的中间状态。
+
+    临时文件的长度与 size 不一致时注册表中的中间状态不可信，按磁盘上的文件重新计算；
+    文件不足 size 字节时抛出 UploadConflict。
+    """
+    path = partial_path(session_id)
+    with _locked_partial(path) as f:
+        length = os.fstat(f.fileno()).st_size
+        if length == size:
+            hasher = hashers.get(session_id, path, size)
+        else:
+            hasher = _hash_file(path, size)
+            # received 不会超过 size，多出的字节从未被接受
+            f.truncate(size)
+    hashers.discard(session_id)
+    return hasher.hexdigest()
+
+
+def discard_partial(session_id):
+    """删除会话的临时文件和哈希中间状态。"""
+    hashers.discard(session_id)
+    try:
+        os.remove(partial_path(session_id))
+    except FileNotFoundError:
+        pass
+
+
+def file_sha256(file):
+    """计算 Django 上传文件（或 File 对象）的 SHA-256，逐块读取。"""
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def complete_session(session):
+    """
+    完成上传：计算 SHA-256，同一用户已有相同内容的 Sketch 时直接关联它并删除临时文件，
+    否则把临时文件移动为新 Sketch 的文件并入队转换任务。
+
+    先用带状态条件的 UPDATE 把会话从 uploading 改为 completing，并发的重复 complete 请求只有一个能领取；
+    生成 Sketch 失败时文件移回临时位置、会话恢复为 uploading，可以重试。
+
+    返回:
+        Sketch | None: 新建或已有的 Sketch；会话未上传完整或已被其他请求领取时返回 None。
+    """
+    claimed = UploadSession.objects.filter(
+        pk=session.pk, status=UploadSession.STATUS_UPLOADING, received=F('size')
+    ).update(status=UploadSession.STATUS_COMPLETING, updated_time=timezone.now())
+    if not claimed:
+        return None
+    try:
+        sketch = _complete_claimed(session)
+    except BaseException:
+        UploadSession.objects.filter(
+            pk=session.pk, status=UploadSession.STATUS_COMPLETING
+        ).update(status=UploadSession.STATUS_UPLOADING, updated_time=timezone.now())
+        raise
+    return sketch
+
+
+def _complete_claimed(session):
+    digest = finish_hash(session.id, session.size)
+    existing = Sketch.objects.filter(
+        creator=session.creator, content_hash=digest, is_delete=False
+    ).order_by('created_time').first()
+    target = None
+    try:
+        with transaction.atomic():
+            if existing is not None:
+                sketch = existing
+            else:
+                storage = Sketch._meta.get_field('file').storage
+                filename = storage.get_valid_name(os.path.basename(session.filename)) or f'{session.id}.sketch'
+                name = storage.get_available_name(os.path.join(Sketch.file_path, filename))
+                target = storage.path(name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(partial_path(session.id), target)
+                sketch = Sketch.objects.create(file=name, content_hash=digest, creator=session.creator)
+                # 与普通上传一样入队转换任务
+                ConversionJob.objects.create(source_sketch=sketch, creator=session.creator)
+
+            session.status = UploadSession.STATUS_COMPLETE
+            session.content_hash = digest
+            session.result_sketch = sketch
+            session.deduplicated = existing is not None
+            session.save(update_fields=['status', 'content_hash', 'result_sketch', 'deduplicated', 'updated_time'])
+    except BaseException:
+        # 事务回滚后不留下没有 Sketch 记录的文件
+        if target is not None and os.path.exists(target):
+            os.replace(target, partial_path(session.id))
+        raise
+    if existing is not None:
+        discard_partial(session.id)
+    return sketch
+
+
+def abort_session(session_id):
+    """
+    取消仍在上传中的会话并删除临时文件。
+
+    返回:
+        bool: 会话是否由本次调用取消（已完成或已被其他请求取消时为 False）。
+    """
+    aborted = UploadSession.objects.filter(
+        pk=session_id, status=UploadSession.STATUS_UPLOADING
+    ).update(status=UploadSession.STATUS_ABORTED, updated_time=timezone.now())
+    if aborted:
+        discard_partial(session_id)
+    return bool(aborted)
+
+
+def expire_sessions(ttl=UPLOAD_SESSION_TTL):
+    """
+    取消超过 ttl 秒没有更新的上传中会话，删除它们的临时文件和哈希中间状态。
+
+    返回:
+        int: 取消的会话数。
+    """
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    stale = UploadSession.objects.filter(
+        status=UploadSession.STATUS_UPLOADING, updated_time__lt=cutoff
+    ).values_list('pk', flat=True)
+    return sum(abort_session(session_id) for session_id in list(stale))
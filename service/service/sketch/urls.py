@@ -1,8 +1,9 @@
 from rest_framework.routers import DefaultRouter
-from .views import SketchView
+from .views import SketchView, UploadSessionView
 
 
 router = DefaultRouter()
 router.register(r'sketch', SketchView, basename='sketch')
+router.register(r'uploads', UploadSessionView, basename='uploads')
 
 urlpatterns = router.urls
\ No newline at end of file
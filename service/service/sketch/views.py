@@ -1,16 +1,32 @@
 from django.shortcuts import render
 
 # Create your views here.
-from rest_framework import viewsets,status
+import io
+import re
+
+from django.db.models import OuterRef, Subquery, UUIDField
+from rest_framework import mixins, viewsets,status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .models import Sketch
-from .serializers import SketchSerializer
+from .models import Sketch, UploadSession
+from .serializers import SketchSerializer, UploadSessionSerializer
+from . import uploads
+from converter.models import ConversionJob
 from rest_framework.parsers import MultiPartParser, FormParser
 
+# Content-Range: bytes <start>-<end>/<total>
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def with_conversion_job(queryset):
+    """附加最近一次转换任务的 id（latest_conversion_job），列表中的每个 Sketch 不再单独查询。"""
+    latest = ConversionJob.objects.filter(source_sketch=OuterRef('pk')).order_by('-created_time').values('pk')[:1]
+    return queryset.annotate(latest_conversion_job=Subquery(latest, output_field=UUIDField()))
+
 
 class SketchView(viewsets.ModelViewSet):
-    queryset = Sketch.objects.all()
+    queryset = with_conversion_job(Sketch.objects.all())
     serializer_class = SketchSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
@@ -23,10 +39,113 @@ class SketchView(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # 从 request.user 中获取当前认证的用户实例
         # 并将其作为 creator 字段的值，保存到数据库
-        serializer.save(creator=self.request.user)
+        # 记录内容哈希，之后通过分片上传提交相同内容时可直接关联这个 Sketch
+        content_hash = uploads.file_sha256(serializer.validated_data['file'])
+        sketch = serializer.save(creator=self.request.user, content_hash=content_hash)
+        # 入队转换任务，由 run_conversion_worker 工作进程在后台执行，请求线程不等待转换
+        job = ConversionJob.objects.create(source_sketch=sketch, creator=self.request.user)
+        sketch.latest_conversion_job = job.id
 
     def destory(self, request, *args, **kwargs):
         sketch = self.get_object()
         sketch.is_delete = True
         sketch.save()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionView(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                        viewsets.GenericViewSet):
+    """
+    分片续传上传。
+
+        POST   /uploads/                 创建会话，提交 filename 和 size
+        GET    /uploads/<id>/            查询会话，received 即下一个分片的起始偏移
+        PUT    /uploads/<id>/chunk/      上传分片，请求体为原始字节，偏移由 ?offset= 或 Content-Range 指定
+        POST   /uploads/<id>/complete/   全部分片上传后完成上传，返回（新建或已有的）Sketch
+        DELETE /uploads/<id>/            取消上传并删除临时文件
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(creator=self.request.user, is_delete=False)
+
+    def perform_create(self, serializer):
+        # 顺带清理已放弃的会话，也可由 expire_uploads 命令定期执行
+        uploads.expire_sessions()
+        serializer.save(creator=self.request.user)
+
+    def _chunk_offset(self, request):
+        """读取分片的起始偏移，格式不正确时返回 None。"""
+        content_range = request.headers.get('Content-Range')
+        if content_range:
+            match = _CONTENT_RANGE.match(content_range.strip())
+            return int(match.group(1)) if match else None
+        offset = request.query_params.get('offset')
+        if offset is None or not offset.isdigit():
+            return None
+        return int(offset)
+
+    def _conflict(self, session):
+        return Response({'error': '分片偏移不正确', 'received': session.received}, status=status.HTTP_409_CONFLICT)
+
+    @action(detail=True, methods=['put'], parser_classes=[])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        if session.status != UploadSession.STATUS_UPLOADING:
+            return Response({'error': f'上传会话状态为 {session.status}，不能继续上传'}, status=status.HTTP_400_BAD_REQUEST)
+        offset = self._chunk_offset(request)
+        if offset is None:
+            return Response({'error': '缺少或无法解析分片偏移（?offset= 或 Content-Range）'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # 与已接收字节数不一致时返回 409 和正确的偏移，客户端据此续传
+        if offset != session.received:
+            return self._conflict(session)
+
+        # 不经过解析器，直接从请求体流式写入临时文件；并发的重复分片（包括其他进程中的）只有一个能写入，
+        # 由 write_chunk 在临时文件的锁内核对偏移并推进 received。请求体为空时 request.stream 为 None
+        stream = request.stream or io.BytesIO()
+        try:
+            uploads.write_chunk(session.id, offset, stream, session.size - offset)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except uploads.UploadConflict as e:
+            return Response({'error': str(e), 'received': e.received}, status=status.HTTP_409_CONFLICT)
+        session.refresh_from_db()
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        if session.status == UploadSession.STATUS_COMPLETE:
+            # 重复提交 complete 时直接返回之前的结果
+            return self._completed(session)
+        if session.status == UploadSession.STATUS_COMPLETING:
+            return self._completing(session)
+        if session.status != UploadSession.STATUS_UPLOADING:
+            return Response({'error': f'上传会话状态为 {session.status}，不能完成'}, status=status.HTTP_400_BAD_REQUEST)
+        if session.received != session.size:
+            return Response({'error': f'文件尚未上传完整：{session.received}/{session.size} 字节',
+                             'received': session.received}, status=status.HTTP_409_CONFLICT)
+        if uploads.complete_session(session) is None:
+            # 并发的 complete 请求已领取该会话：已完成时返回其结果，否则返回 409
+            session.refresh_from_db()
+            if session.status == UploadSession.STATUS_COMPLETE:
+                return self._completed(session)
+            return self._completing(session)
+        return self._completed(session)
+
+    def _completing(self, session):
+        return Response({'error': f'上传会话状态为 {session.status}，不能完成', 'received': session.received},
+                        status=status.HTTP_409_CONFLICT)
+
+    def _completed(self, session):
+        return Response({
+            'upload': self.get_serializer(session).data,
+            'sketch': SketchSerializer(session.result_sketch, context=self.get_serializer_context()).data,
+        })
+
+    def destroy(self, request, *args, **kwargs):
+        session = self.get_object()
+        uploads.abort_session(session.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)